@@ -0,0 +1,167 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Replays an alert stream through the alert watcher's old dispatch, every
+match object tried on every alert with its own alert.what() call, and
+through the dispatch table keyed by alert type.
+
+The match objects are the server session's (SessionManager and
+LibtorrentSession), with log_on_match off so only matching is timed.
+The stream is a mix typical of a busy server with ALERT_MASK_DEFAULT, or
+the alert types found in a seedbank log, i.e. lines containing
+"(<type>_alert)":
+
+    python2.7 bench/alert_dispatch.py [-n alerts] [-f seedbank.log]
+"""
+
+import re
+import time
+import random
+import optparse
+
+import bench_util
+import seedbank.server.alert_match as alert_match
+from seedbank.server.alert_watcher import UnthreadedAlertWatcher
+
+# relative frequency of alert types on a busy server
+ALERT_MIX = [
+    ('stats_alert', 300),
+    ('incoming_connection_alert', 120),
+    ('peer_connect_alert', 120),
+    ('peer_disconnected_alert', 110),
+    ('performance_alert', 20),
+    ('state_update_alert', 10),
+    ('peer_error_alert', 40),
+    ('peer_blocked_alert', 10),
+    ('mongodb_plugin_alert', 30),
+    ('torrent_added_alert', 15),
+    ('torrent_removed_alert', 15),
+    ('torrent_paused_alert', 15),
+    ('torrent_resumed_alert', 15),
+    ('tracker_error_alert', 5),
+    ('file_error_alert', 1),
+    ('torrent_finished_alert', 1),
+    ('listen_succeeded_alert', 1)
+    ]
+
+class FakeAlert(object):
+    """
+    Formats its message on every message() call, like the binding.
+    Counts what() calls.
+    """
+    what_calls = 0
+
+    def __init__(self, what):
+        self._what = what
+
+    def what(self):
+        FakeAlert.what_calls += 1
+        return self._what
+
+    def message(self):
+        if self._what == 'mongodb_plugin_alert':
+            return '(%i) %s' % (alert_match.LOOKUP_METRICS_CODE, '{}')
+        return '%s: peer (%s:%i) %s' % (self._what, '10.0.0.1', 6881, 'message text')
+
+class LinearAlertWatcher(UnthreadedAlertWatcher):
+    """
+    _match_alert before the dispatch table
+    """
+    def _match_alert(self, alert):
+        for name, match_item in self._match_list.iteritems():
+            matched = match_item.match(alert)
+            if matched and not self._match_all:
+                break
+
+def _ignore(alert):
+    pass
+
+def get_match_list():
+    matches = [
+        ('listen_succeeded', alert_match.ListenSucceededAlertMatch, {}),
+        ('listen_failed', alert_match.ListenFailedAlertMatch, {}),
+        ('torrent_finished', alert_match.TorrentFinishedAlertMatch, {}),
+        ('incoming_connection', alert_match.IncomingConnectionAlertMatch, {}),
+        ('peer_connect', alert_match.PeerConnectAlertMatch, {}),
+        ('peer_disconnect', alert_match.PeerDisconnectedAlertMatch, {}),
+        ('file_error', alert_match.FileErrorAlertMatch, {}),
+        ('torrent_error', alert_match.TorrentErrorAlertMatch, {}),
+        ('tracker_error', alert_match.TrackerErrorAlertMatch, {}),
+        ('mongodb', alert_match.MongodbAlertMatch, {}),
+        ('lookup_metrics', alert_match.CallbackAlertMatch, {'type': 'mongodb_plugin_alert', 'callback': _ignore}),
+        ('torrent_state_update', alert_match.CallbackAlertMatch, {'type': 'state_update_alert', 'callback': _ignore}),
+        ('torrent_state_added', alert_match.CallbackAlertMatch, {'type': 'torrent_added_alert', 'callback': _ignore}),
+        ('torrent_state_removed', alert_match.CallbackAlertMatch, {'type': 'torrent_removed_alert', 'callback': _ignore})
+        ]
+    for (name, klass, kwargs) in matches:
+        kwargs['expires_after'] = 0
+    return matches
+
+def make_stream(count):
+    random.seed(0)
+    choices = []
+    for (what, weight) in ALERT_MIX:
+        choices.extend([what] * weight)
+    return [FakeAlert(random.choice(choices)) for i in xrange(count)]
+
+def read_stream(path, count):
+    """
+    Alert types in log order, repeated up to `count` alerts
+    """
+    pattern = re.compile(r'\((\w+_alert)\)')
+    types = []
+    f = open(path)
+    try:
+        for line in f:
+            m = pattern.search(line)
+            if m:
+                types.append(m.group(1))
+    finally:
+        f.close()
+    if not types:
+        raise ValueError('No alerts found in %s' % path)
+    return [FakeAlert(types[i % len(types)]) for i in xrange(max(count, len(types)))]
+
+def replay(watcher_class, stream):
+    watcher = watcher_class(label='bench', session=object(), match_list=get_match_list(),
+                            async_logging=False)
+    FakeAlert.what_calls = 0
+    start = time.time()
+    for alert in stream:
+        watcher._match_alert(alert)
+    elapsed = time.time() - start
+    return (elapsed, FakeAlert.what_calls)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='count', type='int', default=200000, help='number of alerts')
+    parser.add_option('-f', dest='log_file', help='take alert types from a seedbank log')
+    (options, args) = parser.parse_args()
+
+    if options.log_file:
+        stream = read_stream(options.log_file, options.count)
+    else:
+        stream = make_stream(options.count)
+    print '%i alerts, %i match objects' % (len(stream), len(get_match_list()))
+    for (label, watcher_class) in (('linear', LinearAlertWatcher), ('table', UnthreadedAlertWatcher)):
+        (elapsed, what_calls) = replay(watcher_class, stream)
+        print '%-7s %7.3f s  %6.2f us/alert  %8i alerts/s  %5.2f what() calls/alert' % (
+            label, elapsed, elapsed / len(stream) * 1e6, len(stream) / elapsed, float(what_calls) / len(stream))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Delay from an alert being posted, or a control message being queued, to
+the session process handling it: p50/p99 for the old tick-and-sleep loops
+and the event driven ones.
+
+Alerts go through the real ThreadedAlertWatcher, fed by a stand-in for
+the libtorrent session's alert queue.  The old watcher slept for the
+tick interval between alert batches; the new one blocks in
+wait_for_alert().  Control messages are queued from another process;
+the old session loop drained the in queue once per tick, the new one
+blocks on it until the next DeadlineScheduler timer is due.
+
+    python2.7 bench/alert_latency.py [-n count] [-i interval] [-t tick]
+"""
+
+import os
+import time
+import random
+import select
+import optparse
+import threading
+import multiprocessing
+from Queue import Empty
+
+import bench_util
+from seedbank.server.alert_watcher import ThreadedAlertWatcher
+from seedbank.server.alert_match import CallbackAlertMatch
+from seedbank.server.deadline_scheduler import DeadlineScheduler
+
+class FakeAlert(object):
+    __slots__ = ('posted',)
+
+    def __init__(self):
+        self.posted = time.time()
+
+    def what(self):
+        return 'bench_alert'
+
+    def message(self):
+        return 'bench alert'
+
+class FakeSession(object):
+    """
+    Alert queue with the pop_alerts/wait_for_alert interface of
+    libtorrent.session.  Waits on a pipe: threading.Condition.wait() with
+    a timeout polls in python 2, which would hide the difference being
+    measured.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alerts = []
+        (self._wake_r, self._wake_w) = os.pipe()
+
+    def post_alert(self, alert):
+        self._lock.acquire()
+        try:
+            self._alerts.append(alert)
+        finally:
+            self._lock.release()
+        os.write(self._wake_w, 'x')
+
+    def pop_alerts(self):
+        self._lock.acquire()
+        try:
+            alerts = self._alerts
+            self._alerts = []
+        finally:
+            self._lock.release()
+        if alerts:
+            os.read(self._wake_r, 4096)
+        return alerts
+
+    def wait_for_alert(self, max_wait_ms):
+        select.select([self._wake_r], [], [], max_wait_ms / 1000.0)
+
+    def num_dropped_alerts(self):
+        return 0
+
+    def close(self):
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+class SleepingAlertWatcher(ThreadedAlertWatcher):
+    """
+    Watcher loop before wait_for_alert
+    """
+    def _wait_for_alert(self):
+        time.sleep(self._tick_interval)
+
+def run_alerts(watcher_class, count, interval, tick_interval):
+    random.seed(0)
+    latencies = []
+    ses = FakeSession()
+    def on_alert(alert):
+        latencies.append(time.time() - alert.posted)
+    match_list = [('bench', CallbackAlertMatch, {'type': 'bench_alert', 'expires_after': 0, 'callback': on_alert})]
+    watcher = watcher_class(label='bench', session=ses, match_list=match_list,
+                            tick_interval=tick_interval, loop_limit=0, async_logging=False)
+    watcher.start()
+    for i in xrange(count):
+        time.sleep(random.uniform(0, 2 * interval))
+        ses.post_alert(FakeAlert())
+    while len(latencies) < count:
+        time.sleep(0.01)
+    watcher.stop()
+    watcher.join()
+    ses.close()
+    return latencies
+
+def _produce(in_q, count, interval):
+    """
+    SeedbankServer stand-in, queues send timestamps, then None
+    """
+    random.seed(1)
+    for i in xrange(count):
+        time.sleep(random.uniform(0, 2 * interval))
+        in_q.put(time.time())
+    in_q.put(None)
+
+def consume_polling(in_q, tick_interval):
+    """
+    The old session loop: tick() drained the queue, then sleep
+    """
+    latencies = []
+    while True:
+        while not in_q.empty():
+            sent = in_q.get()
+            if sent is None:
+                return latencies
+            latencies.append(time.time() - sent)
+        time.sleep(tick_interval)
+
+def consume_blocking(in_q, tick_interval):
+    """
+    LibtorrentSession._event_loop and _handle_queue
+    """
+    latencies = []
+    scheduler = DeadlineScheduler(max_wait=tick_interval * 10)
+    scheduler.add('check_watcher', tick_interval * 10, lambda: None)
+    while True:
+        try:
+            sent = in_q.get(block=True, timeout=scheduler.get_timeout())
+            while True:
+                if sent is None:
+                    return latencies
+                latencies.append(time.time() - sent)
+                sent = in_q.get(block=False)
+        except Empty:
+            pass
+        scheduler.run()
+
+def run_control(consume, count, interval, tick_interval):
+    in_q = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_produce, args=(in_q, count, interval))
+    proc.start()
+    latencies = consume(in_q, tick_interval)
+    proc.join()
+    return latencies
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='count', type='int', default=200, help='alerts and control messages per run')
+    parser.add_option('-i', dest='interval', type='float', default=0.02, help='mean seconds between events')
+    parser.add_option('-t', dest='tick_interval', type='float', default=0.5, help='session tick interval')
+    (options, args) = parser.parse_args()
+
+    for (label, watcher_class) in (('sleep', SleepingAlertWatcher), ('wait', ThreadedAlertWatcher)):
+        latencies = run_alerts(watcher_class, options.count, options.interval, options.tick_interval)
+        print 'alerts   %-6s %s' % (label, bench_util.format_latency(latencies))
+    for (label, consume) in (('sleep', consume_polling), ('wait', consume_blocking)):
+        latencies = run_control(consume, options.count, options.interval, options.tick_interval)
+        print 'control  %-6s %s' % (label, bench_util.format_latency(latencies))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Per-alert cost of matching on the formatted alert message, as the match
+objects used to, against matching on typed alert attributes.
+
+For each alert type, a stream of alerts from many peers and files goes
+through a match object waiting for one of them: an AlertMatch with the
+expected message, and the AlertMatch subclass with field matches.  The
+stand-in alerts format their message on every message() call, like the
+binding does in C++.
+
+    python2.7 bench/alert_match_cost.py [-n alerts]
+"""
+
+import time
+import random
+import optparse
+
+import bench_util
+from seedbank.server.alert_match import AlertMatch, IncomingConnectionAlertMatch, \
+    PeerConnectAlertMatch, FileErrorAlertMatch
+
+class FakeHandle(object):
+    def __init__(self, name, info_hash):
+        self._name = name
+        self._info_hash = info_hash
+
+    def name(self):
+        return self._name
+
+    def info_hash(self):
+        return self._info_hash
+
+class FakeError(object):
+    def __init__(self, message):
+        self._message = message
+
+    def message(self):
+        return self._message
+
+class FakeAlert(object):
+    """
+    Messages as formatted by libtorrent, counts message() calls
+    """
+    message_calls = 0
+
+    def __init__(self, what, **kwargs):
+        self._what = what
+        for (name, value) in kwargs.iteritems():
+            setattr(self, name, value)
+
+    def what(self):
+        return self._what
+
+    def message(self):
+        FakeAlert.message_calls += 1
+        if self._what == 'incoming_connection_alert':
+            return 'incoming connection from %s:%u (%s)' % (
+                self.ip[0], self.ip[1], IncomingConnectionAlertMatch._SOCKET_TYPE_LIST[self.socket_type])
+        if self._what == 'peer_connect_alert':
+            return 'peer (%s, %s) connecting to peer' % (self.ip[0], self.client)
+        if self._what == 'file_error_alert':
+            return '%s file (%s) error: %s' % (self.handle.name(), self.file, self.error.message())
+        return ''
+
+def _make_ip(i):
+    return ('10.%i.%i.%i' % ((i >> 16) & 255, (i >> 8) & 255, i & 255), 6881 + i % 100)
+
+def make_incoming_connection(i):
+    return FakeAlert('incoming_connection_alert', ip=_make_ip(i), socket_type=1 + i % 2)
+
+def make_peer_connect(i):
+    return FakeAlert('peer_connect_alert', ip=_make_ip(i), client='libtorrent 0.16.%i' % (i % 10),
+                     handle=FakeHandle('torrent %i' % (i % 50), '%040x' % (i % 50)))
+
+def make_file_error(i):
+    handle = FakeHandle('torrent %i' % i, '%040x' % i)
+    return FakeAlert('file_error_alert', handle=handle, file='/var/lib/seedbank/data/torrent %i' % i,
+                     error=FakeError('No such file or directory'))
+
+# alert type, alert factory, message match, field match
+CASES = [
+    ('incoming_connection_alert', make_incoming_connection,
+     lambda a: AlertMatch(type=a.what(), message=a.message(), expires_after=0),
+     lambda a: IncomingConnectionAlertMatch(ip_address=a.ip[0], port=a.ip[1], socket_type=a.socket_type, expires_after=0)),
+    ('peer_connect_alert', make_peer_connect,
+     lambda a: AlertMatch(type=a.what(), message=a.message(), expires_after=0),
+     lambda a: PeerConnectAlertMatch(ip_address=a.ip[0], torrent=a.handle.name(), expires_after=0)),
+    ('file_error_alert', make_file_error,
+     lambda a: AlertMatch(type=a.what(), message=a.message(), expires_after=0),
+     lambda a: FileErrorAlertMatch(filename=a.handle.name(), filepath=a.file, expires_after=0))
+    ]
+
+def time_match(match, stream):
+    FakeAlert.message_calls = 0
+    matched = 0
+    start = time.time()
+    for alert in stream:
+        if match.match(alert):
+            matched += 1
+    elapsed = time.time() - start
+    return (elapsed, matched, FakeAlert.message_calls)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='count', type='int', default=100000, help='alerts per run')
+    parser.add_option('-p', dest='peers', type='int', default=1000, help='distinct peers or files in the stream')
+    (options, args) = parser.parse_args()
+
+    random.seed(0)
+    for (what, factory, message_match, field_match) in CASES:
+        stream = [factory(random.randrange(options.peers)) for i in xrange(options.count)]
+        expected = factory(0)
+        for (label, make_match) in (('message', message_match), ('field', field_match)):
+            (elapsed, matched, message_calls) = time_match(make_match(expected), stream)
+            print '%-26s %-8s %6.2f us/alert  %5i matched  %4.2f message() calls/alert' % (
+                what, label, elapsed / len(stream) * 1e6, matched, float(message_calls) / len(stream))
+
+if __name__ == '__main__':
+    main()
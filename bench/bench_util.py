@@ -0,0 +1,54 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Helpers shared by the benchmark scripts in this directory.  Importing this
+module puts the tree's src directory on sys.path, so the scripts run
+against the working copy:
+
+    python2.7 bench/<script>.py --help
+"""
+
+import os
+import sys
+
+_src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if _src not in sys.path:
+    sys.path.insert(0, _src)
+
+def percentile(samples, fraction):
+    """
+    `samples` must be sorted
+    """
+    if not samples:
+        return 0
+    index = min(len(samples) - 1, int(len(samples) * fraction))
+    return samples[index]
+
+def format_latency(samples, scale=1000.0, unit='ms'):
+    """
+    One line summary of a list of latencies in seconds
+    """
+    if not samples:
+        return 'no samples'
+    samples = sorted(samples)
+    return 'n %6i  mean %8.3f %s  p50 %8.3f %s  p99 %8.3f %s  max %8.3f %s' % (
+        len(samples),
+        sum(samples) / len(samples) * scale, unit,
+        percentile(samples, 0.5) * scale, unit,
+        percentile(samples, 0.99) * scale, unit,
+        samples[-1] * scale, unit)
@@ -0,0 +1,154 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Per-item cost of session queue traffic at 1, 100 and 10,000 items per
+second: each item pickled and put on the queue on its own, as before,
+against BatchingQueueWriter envelopes flushed once per tick.
+
+A sender process queues items at the given rate and the main process
+reads and unpacks them.  Reports sender and reader CPU time per item,
+pickled bytes per item and the delay to the reader.  Items carry a small
+dict like the update heartbeat, or with -b a blob like the torrent file
+in an add_torrent item.
+
+    python2.7 bench/queue_envelope_cost.py [-d seconds] [-t tick] [-b bytes] [rate ...]
+"""
+
+import os
+import time
+import pickle
+import optparse
+import multiprocessing
+
+import bench_util
+from seedbank.server.session_queue_item import LibtorrentSessionQueueItem, BatchingQueueWriter, unpack_batch
+
+class OldQueueItem(object):
+    """
+    LibtorrentSessionQueueItem before __slots__ and envelopes
+    """
+    def __init__(self, item_type, value):
+        self.type = item_type
+        self.value = value
+
+def _make_value(payload, index):
+    value = {'sent': time.time(), 'torrent_count': 1000}
+    if payload:
+        # a distinct string per item, pickle would share repeats in an envelope
+        value['torrent_file'] = payload + str(index)
+    return value
+
+def _pickled_size(obj):
+    """
+    Returns (bytes, cpu seconds spent measuring)
+    """
+    cpu_start = time.clock()
+    size = len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    return (size, time.clock() - cpu_start)
+
+def _send(mode, out_q, result_q, rate, duration, tick_interval, payload_size):
+    """
+    Envelopes are flushed every tick, as the session event loop does
+    """
+    payload = os.urandom(payload_size) if payload_size else None
+    writer = BatchingQueueWriter(out_q)
+    pickled_bytes = 0
+    measure_cpu = 0.0
+    count = max(1, int(rate * duration))
+    cpu_start = time.clock()
+    start = time.time()
+    next_flush = start + tick_interval
+    i = 0
+    while i < count:
+        now = time.time()
+        if mode == 'envelope' and now >= next_flush:
+            if writer.get_pending_count():
+                (size, cpu) = _pickled_size((1, tuple(writer._pending)))
+                pickled_bytes += size
+                measure_cpu += cpu
+                writer.flush()
+            next_flush = now + tick_interval
+        target = start + float(i) / rate
+        if now < target:
+            if mode == 'envelope':
+                target = min(target, next_flush)
+            time.sleep(target - now)
+            continue
+        if mode == 'item':
+            item = OldQueueItem('update', _make_value(payload, i))
+            out_q.put(item)
+            (size, cpu) = _pickled_size(item)
+            pickled_bytes += size
+            measure_cpu += cpu
+        else:
+            writer.put(LibtorrentSessionQueueItem('update', _make_value(payload, i)))
+        i += 1
+    if writer.get_pending_count():
+        (size, cpu) = _pickled_size((1, tuple(writer._pending)))
+        pickled_bytes += size
+        measure_cpu += cpu
+        writer.flush()
+    out_q.put(None)
+    # the queue's feeder thread pickles and writes, wait for it
+    out_q.close()
+    out_q.join_thread()
+    result_q.put((time.clock() - cpu_start - measure_cpu, pickled_bytes, count))
+
+def run(mode, rate, duration, tick_interval, payload_size):
+    out_q = multiprocessing.Queue()
+    result_q = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_send, args=(mode, out_q, result_q, rate, duration, tick_interval, payload_size))
+    proc.start()
+
+    latencies = []
+    reader_cpu = 0.0
+    while True:
+        obj = out_q.get()
+        cpu_start = time.clock()
+        if obj is None:
+            break
+        if mode == 'item':
+            items = [obj]
+        else:
+            items = unpack_batch(obj)
+        now = time.time()
+        for item in items:
+            latencies.append(now - item.value['sent'])
+        reader_cpu += time.clock() - cpu_start
+
+    (sender_cpu, pickled_bytes, count) = result_q.get()
+    proc.join()
+    return (latencies, sender_cpu / count, reader_cpu / count, float(pickled_bytes) / count)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [rate ...]')
+    parser.add_option('-d', dest='duration', type='float', default=5.0, help='seconds per run')
+    parser.add_option('-t', dest='tick_interval', type='float', default=0.1, help='seconds between envelope flushes')
+    parser.add_option('-b', dest='payload_size', type='int', default=0, help='bytes of blob payload per item')
+    (options, args) = parser.parse_args()
+    rates = [float(arg) for arg in args] or [1, 100, 10000]
+
+    for rate in rates:
+        for mode in ('item', 'envelope'):
+            (latencies, sender_cpu, reader_cpu, item_bytes) = run(mode, rate, options.duration,
+                                                                 options.tick_interval, options.payload_size)
+            print '%6i/s  %-8s  send %7.1f us  read %7.1f us  %7.1f bytes/item  %s' % (
+                rate, mode, sender_cpu * 1e6, reader_cpu * 1e6, item_bytes, bench_util.format_latency(latencies))
+
+if __name__ == '__main__':
+    main()
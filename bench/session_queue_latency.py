@@ -0,0 +1,133 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Latency from a session process queueing an item to the SeedbankServer
+main loop handling it, as the number of sessions grows.
+
+Compares the old loop, a blocking get() with a 0.5 s timeout on each
+session's out queue in turn followed by a tick sleep, with the Reactor
+waiting on the out queue pipes of every session at once.  Each session
+process queues items at random intervals, like torrent_finished and
+server_init items arriving from otherwise idle sessions.
+
+    python2.7 bench/session_queue_latency.py [-n items] [-i interval] [sessions ...]
+"""
+
+import time
+import random
+import optparse
+import multiprocessing
+from Queue import Empty
+
+import bench_util
+from seedbank.server.reactor import Reactor
+
+# as in SeedbankServer and the old SessionInstance.check_queue
+TICK_INTERVAL = 0.5
+QUEUE_TIMEOUT = 0.5
+
+def _produce(out_q, count, interval, seed):
+    """
+    Session process stand-in.  Queues send timestamps, then None.
+    """
+    random.seed(seed)
+    for i in xrange(count):
+        time.sleep(random.uniform(0, 2 * interval))
+        out_q.put(time.time())
+    out_q.put(None)
+
+class _QueueReader(object):
+    """
+    Selectable out queue, see SessionInstance.fileno
+    """
+    def __init__(self, out_q):
+        self.out_q = out_q
+
+    def fileno(self):
+        return self.out_q._reader.fileno()
+
+def run_polling(queues):
+    """
+    The old check_queues loop: at most one item per session per pass
+    """
+    latencies = []
+    done = set()
+    while len(done) < len(queues):
+        for out_q in queues:
+            try:
+                sent = out_q.get(block=True, timeout=QUEUE_TIMEOUT)
+            except Empty:
+                continue
+            if sent is None:
+                done.add(out_q)
+            else:
+                latencies.append(time.time() - sent)
+        time.sleep(TICK_INTERVAL)
+    return latencies
+
+def run_reactor(queues):
+    latencies = []
+    readers = [_QueueReader(out_q) for out_q in queues]
+    reactor = Reactor(max_wait=TICK_INTERVAL)
+
+    def on_ready(ready):
+        for reader in ready:
+            while True:
+                try:
+                    sent = reader.out_q.get(block=False)
+                except Empty:
+                    break
+                if sent is None:
+                    readers.remove(reader)
+                    break
+                latencies.append(time.time() - sent)
+        if not readers:
+            reactor.stop()
+
+    reactor.add_reader_source(lambda: readers, on_ready)
+    reactor.run()
+    reactor.close()
+    return latencies
+
+def run(loop, num_sessions, count, interval):
+    queues = [multiprocessing.Queue() for i in xrange(num_sessions)]
+    procs = [multiprocessing.Process(target=_produce, args=(queues[i], count, interval, i))
+             for i in xrange(num_sessions)]
+    for proc in procs:
+        proc.start()
+    start = time.time()
+    latencies = loop(queues)
+    elapsed = time.time() - start
+    for proc in procs:
+        proc.join()
+    return (latencies, elapsed)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [sessions ...]')
+    parser.add_option('-n', dest='count', type='int', default=8, help='items queued per session')
+    parser.add_option('-i', dest='interval', type='float', default=0.5, help='mean seconds between items')
+    (options, args) = parser.parse_args()
+    session_counts = [int(arg) for arg in args] or [1, 2, 4, 8, 16]
+
+    for num_sessions in session_counts:
+        for (label, loop) in (('polling', run_polling), ('reactor', run_reactor)):
+            (latencies, elapsed) = run(loop, num_sessions, options.count, options.interval)
+            print '%3i sessions  %-8s %6.1f s  %s' % (num_sessions, label, elapsed, bench_util.format_latency(latencies))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Loopback load test of sharded server sessions: aggregate upload
+throughput for 1, 2 and 4 shards.  Needs the libtorrent python bindings.
+
+Each shard is a seeding process with the server session settings,
+listening on listen_port + shard index like the session manager's server
+shards, and seeding the torrents whose info hash falls in its range (see
+seedbank.server.shard).  Downloader processes fetch every torrent from
+the shard that owns it over loopback.  Throughput is the payload the
+downloaders received during the measurement window.
+
+The downloaders share the machine with the shards, so keep their number
+at or below half the cores to see the shards scale.
+
+    python2.7 bench/shard_load.py [-t torrents] [-m MB] [-c downloaders] [-d seconds] [shards ...]
+"""
+
+import os
+import time
+import shutil
+import optparse
+import tempfile
+import multiprocessing
+
+import bench_util
+import libtorrent as lt
+import seedbank.server.shard as shard
+from seedbank.server.libtorrent_settings import get_server_settings, get_client_settings
+
+def make_torrents(root, count, size_mb):
+    """
+    Write `count` single file torrents of random data, returns a list of
+    (hex info hash, bencoded torrent file)
+    """
+    data_dir = os.path.join(root, 'data')
+    os.mkdir(data_dir)
+    torrents = []
+    for i in xrange(count):
+        path = os.path.join(data_dir, 'torrent-%i.bin' % i)
+        f = open(path, 'wb')
+        for j in xrange(size_mb):
+            f.write(os.urandom(1024 * 1024))
+        f.close()
+
+        fs = lt.file_storage()
+        lt.add_files(fs, path)
+        t = lt.create_torrent(fs)
+        t.set_creator('seedbank shard_load bench')
+        lt.set_piece_hashes(t, data_dir)
+        torrent_file = lt.bencode(t.generate())
+        ti = lt.torrent_info(lt.bdecode(torrent_file))
+        torrents.append((str(ti.info_hash()), torrent_file))
+    return (data_dir, torrents)
+
+def _add_torrent(ses, torrent_file, save_path, seed_mode):
+    params = {
+        'ti': lt.torrent_info(lt.bdecode(torrent_file)),
+        'save_path': save_path,
+        'seed_mode': seed_mode,
+        'auto_managed': False,
+        'paused': False
+        }
+    return ses.add_torrent(params)
+
+def _seed(shard_index, shard_count, port, data_dir, torrents, stop, result_q):
+    ses = lt.session(lt.fingerprint('TE', 1, 0, 0, 0), 0)
+    ses.set_settings(get_server_settings())
+    ses.listen_on(port, port, None, lt.listen_on_flags_t.listen_reuse_address)
+    for (info_hash, torrent_file) in torrents:
+        if shard.get_shard_index(info_hash, shard_count) == shard_index:
+            _add_torrent(ses, torrent_file, data_dir, True)
+    stop.wait()
+    result_q.put(('seed', shard_index, ses.status().total_payload_upload))
+
+def _download(index, base_port, shard_count, download_dir, torrents, start, stop, result_q):
+    ses = lt.session(lt.fingerprint('BN', 0, 1, 0, 0), 0)
+    ses.set_settings(get_client_settings())
+    ses.listen_on(base_port + 100 + index * 10, base_port + 109 + index * 10)
+    peers = []
+    for (info_hash, torrent_file) in torrents:
+        handle = _add_torrent(ses, torrent_file, download_dir, False)
+        port = base_port + shard.get_shard_index(info_hash, shard_count)
+        peers.append((handle, ('127.0.0.1', port)))
+
+    start.wait()
+    while not stop.is_set():
+        # connect_peer is a no-op for peers that are already connected
+        for (handle, endpoint) in peers:
+            handle.connect_peer(endpoint, 0)
+        stop.wait(1.0)
+
+    downloaded = 0
+    finished = 0
+    for (handle, endpoint) in peers:
+        s = handle.status()
+        downloaded += s.total_payload_download
+        if s.is_seeding:
+            finished += 1
+    result_q.put(('download', index, downloaded, finished))
+
+def run(shard_count, options, data_dir, torrents, root):
+    start = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    result_q = multiprocessing.Queue()
+    seeders = []
+    for i in xrange(shard_count):
+        seeders.append(multiprocessing.Process(target=_seed, args=(i, shard_count, options.port + i,
+                                                                   data_dir, torrents, stop, result_q)))
+    downloaders = []
+    download_dirs = []
+    for i in xrange(options.downloaders):
+        download_dir = tempfile.mkdtemp(prefix='download-%i.' % i, dir=root)
+        download_dirs.append(download_dir)
+        downloaders.append(multiprocessing.Process(target=_download, args=(i, options.port, shard_count, download_dir,
+                                                                           torrents, start, stop, result_q)))
+    for proc in seeders + downloaders:
+        proc.start()
+
+    # let sessions start listening
+    time.sleep(2)
+    start.set()
+    time.sleep(options.duration)
+    stop.set()
+
+    uploaded = 0
+    downloaded = 0
+    finished = 0
+    for i in xrange(len(seeders) + len(downloaders)):
+        result = result_q.get()
+        if result[0] == 'seed':
+            uploaded += result[2]
+        else:
+            downloaded += result[2]
+            finished += result[3]
+    for proc in seeders + downloaders:
+        proc.join()
+    for download_dir in download_dirs:
+        shutil.rmtree(download_dir)
+    return (uploaded, downloaded, finished)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [shards ...]')
+    parser.add_option('-t', dest='torrents', type='int', default=16, help='number of torrents')
+    parser.add_option('-m', dest='size_mb', type='int', default=64, help='MB per torrent')
+    parser.add_option('-c', dest='downloaders', type='int', default=max(1, multiprocessing.cpu_count() / 2), help='downloader processes')
+    parser.add_option('-d', dest='duration', type='float', default=20, help='seconds to measure')
+    parser.add_option('-p', dest='port', type='int', default=46000, help='listen port of shard 0')
+    (options, args) = parser.parse_args()
+    shard_counts = [int(arg) for arg in args] or [1, 2, 4]
+
+    root = tempfile.mkdtemp(prefix='shard_load.')
+    try:
+        (data_dir, torrents) = make_torrents(root, options.torrents, options.size_mb)
+        print '%i cores, %i torrents of %i MB, %i downloaders, %.0f s per run' % (
+            multiprocessing.cpu_count(), options.torrents, options.size_mb, options.downloaders, options.duration)
+        for shard_count in shard_counts:
+            (uploaded, downloaded, finished) = run(shard_count, options, data_dir, torrents, root)
+            print '%2i shards  upload %8.1f MB/s  download %8.1f MB/s  %i of %i downloads finished early' % (
+                shard_count, uploaded / options.duration / 1e6, downloaded / options.duration / 1e6,
+                finished, options.torrents * options.downloaders)
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
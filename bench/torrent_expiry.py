@@ -0,0 +1,197 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Inactive torrent expiry with 10,000 simulated torrents: the old scan,
+one torrent.status() call per handle every run, against TorrentManager
+with its expiry queue and the TorrentStateTable.
+
+The simulated session gives a small share of its torrents transfer
+activity each run.  Those are reported through state updates, as
+state_update_alert does.  Expired torrents are removed and replaced with
+new ones, so the session stays the same size.  Runs use a simulated clock;
+-r adds a busy wait to every status() call to stand in for the round
+trip to the libtorrent network thread.
+
+    python2.7 bench/torrent_expiry.py [-n torrents] [-r status us] [-a active share]
+"""
+
+import time
+import random
+import optparse
+
+import bench_util
+import seedbank.server.torrent_manager as torrent_manager
+import seedbank.server.torrent_state_table as torrent_state_table
+import seedbank.server.active_set as active_set
+from seedbank.server.torrent_manager import TorrentManager
+from seedbank.server.torrent_state_table import TorrentStateTable
+
+class SimulatedClock(object):
+    """
+    Stands in for the time module in the modules under test
+    """
+    def __init__(self):
+        self.now = 1340000000.0
+
+    def time(self):
+        return self.now
+
+clock = SimulatedClock()
+
+class FakeStatus(object):
+    def __init__(self, handle, rate):
+        self.handle = handle
+        self.info_hash = handle.info_hash()
+        idle = clock.now - handle.last_active
+        self.time_since_download = idle
+        self.time_since_upload = idle
+        self.upload_rate = rate
+        self.download_rate = 0
+        self.num_peers = 1 if rate else 0
+        self.progress = 1
+        self.paused = False
+
+class FakeHandle(object):
+    status_calls = 0
+    status_cost = 0
+
+    def __init__(self, info_hash):
+        self._info_hash = info_hash
+        self.last_active = clock.now
+        self.valid = True
+
+    def info_hash(self):
+        return self._info_hash
+
+    def name(self):
+        return self._info_hash
+
+    def is_valid(self):
+        return self.valid
+
+    def status(self):
+        FakeHandle.status_calls += 1
+        if FakeHandle.status_cost:
+            end = time.time() + FakeHandle.status_cost
+            while time.time() < end:
+                pass
+        return FakeStatus(self, 0)
+
+class FakeLibtorrentSession(object):
+    """
+    lt.session stand-in, keeps the state table in sync the way the alert
+    watcher does from torrent_added_alert and torrent_removed_alert
+    """
+    def __init__(self, torrent_state):
+        self._torrent_state = torrent_state
+        self._handles = {}
+        self._next_id = 0
+        self.removed = 0
+
+    def add_torrent(self):
+        self._next_id += 1
+        handle = FakeHandle('%040x' % self._next_id)
+        self._handles[handle.info_hash()] = handle
+        self._torrent_state.add(handle)
+        return handle
+
+    def remove_torrent(self, handle):
+        handle.valid = False
+        del self._handles[handle.info_hash()]
+        self._torrent_state.remove(handle.info_hash())
+        self.removed += 1
+
+    def get_torrents(self):
+        return self._handles.values()
+
+    def get_handles(self):
+        return self._handles
+
+class FakeSession(object):
+    """
+    LibtorrentSession stand-in, what TorrentManager uses of it
+    """
+    def __init__(self, lt_session):
+        self._ses = lt_session
+        self._out_writer = None
+
+def old_check(lt_session, timeout):
+    """
+    TorrentManager._check_libtorrent_torrents before the expiry queue
+    """
+    for torrent in lt_session.get_torrents():
+        s = torrent.status()
+        if s.time_since_download > timeout and s.time_since_upload > timeout:
+            lt_session.remove_torrent(torrent)
+
+def simulate(mode, options):
+    random.seed(0)
+    clock.now = 1340000000.0
+    FakeHandle.status_calls = 0
+    FakeHandle.status_cost = options.status_us / 1e6
+    torrent_state = TorrentStateTable()
+    lt_session = FakeLibtorrentSession(torrent_state)
+    for i in xrange(options.torrents):
+        lt_session.add_torrent()
+    manager = TorrentManager(exec_interval=options.exec_interval, tick_interval=options.exec_interval / 10.0,
+                             inactive_torrent_timeout=options.timeout, torrent_state=torrent_state)
+    session = FakeSession(lt_session)
+
+    run_times = []
+    for run in xrange(options.runs):
+        clock.now += options.exec_interval
+        handles = lt_session.get_handles().values()
+        active = random.sample(handles, int(len(handles) * options.active_share))
+        for handle in active:
+            handle.last_active = clock.now
+        torrent_state.update([FakeStatus(handle, 1000) for handle in active])
+
+        start = time.time()
+        if mode == 'scan':
+            old_check(lt_session, options.timeout)
+        else:
+            manager.execute(session=session)
+        run_times.append(time.time() - start)
+
+        # replace removed torrents, new peers keep arriving
+        while len(lt_session.get_handles()) < options.torrents:
+            lt_session.add_torrent()
+    return (run_times, FakeHandle.status_calls, lt_session.removed)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='torrents', type='int', default=10000, help='torrents in the session')
+    parser.add_option('-s', dest='runs', type='int', default=200, help='expiry runs')
+    parser.add_option('-e', dest='exec_interval', type='float', default=5.0, help='seconds between runs')
+    parser.add_option('-t', dest='timeout', type='int', default=300, help='inactive torrent timeout')
+    parser.add_option('-a', dest='active_share', type='float', default=0.02, help='share of torrents active per run')
+    parser.add_option('-r', dest='status_us', type='float', default=0, help='simulated status() round trip in us')
+    (options, args) = parser.parse_args()
+
+    for module in (torrent_manager, torrent_state_table, active_set):
+        module.time = clock
+
+    print '%i torrents, %i runs every %.0f s, %i s timeout, %.1f%% active per run' % (
+        options.torrents, options.runs, options.exec_interval, options.timeout, options.active_share * 100)
+    for mode in ('scan', 'heap'):
+        (run_times, status_calls, removed) = simulate(mode, options)
+        print '%-5s %8.1f status() calls/run  %6i removed  run time %s' % (
+            mode, float(status_calls) / options.runs, removed, bench_util.format_latency(run_times))
+
+if __name__ == '__main__':
+    main()
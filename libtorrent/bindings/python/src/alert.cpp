@@ -42,6 +42,13 @@ tuple incoming_connection_alert_ip(incoming_connection_alert const& ica)
     return endpoint_to_tuple(ica.ip);
 }
 
+/* seed bank -- begin mod */
+tuple listen_succeeded_alert_endpoint(listen_succeeded_alert const& lsa)
+{
+    return endpoint_to_tuple(lsa.endpoint);
+}
+/* seed bank -- end mod */
+
 list stats_alert_transferred(stats_alert const& alert)
 {
    list result;
@@ -254,7 +261,9 @@ void bind_alert()
 
     class_<listen_succeeded_alert, bases<alert>, noncopyable>(
         "listen_succeeded_alert", no_init)
-        .def_readonly("endpoint", &listen_succeeded_alert::endpoint)
+        /* seed bank -- begin mod */
+        .add_property("endpoint", &listen_succeeded_alert_endpoint)
+        /* seed bank -- end mod */
         ;
 
     class_<portmap_error_alert, bases<alert>, noncopyable>(
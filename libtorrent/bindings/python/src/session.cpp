@@ -76,6 +76,14 @@ namespace
             s.add_extension(create_mongodb_torrent_db_plugin, param_map);
         }
     }
+
+    void send_extension_message(session& s, dict const& message_dict)
+    {
+        string_map message;
+        _dict_to_string_map(message, message_dict);
+        allow_threading_guard guard;
+        s.send_extension_message(message);
+    }
     /* seed bank -- end mod */
 
     void add_extension(session& s, object const& e)
@@ -395,6 +403,26 @@ namespace
         return s.wait_for_alert(milliseconds(ms));
     }
 
+    /* seed bank -- begin mod */
+    list pop_alerts(session& s)
+    {
+        std::deque<alert*> alerts;
+        {
+            allow_threading_guard guard;
+            s.pop_alerts(&alerts);
+        }
+
+        list ret;
+        for (std::deque<alert*>::iterator i = alerts.begin()
+            , end(alerts.end()); i != end; ++i)
+        {
+            std::auto_ptr<alert> ptr(*i);
+            ret.append(object(ptr));
+        }
+        return ret;
+    }
+    /* seed bank -- end mod */
+
     list get_torrents(session& s)
     {
         list ret;
@@ -484,6 +512,9 @@ void bind_session()
         .def_readonly("num_peers", &session_status::num_peers)
         .def_readonly("num_unchoked", &session_status::num_unchoked)
         .def_readonly("allowed_upload_slots", &session_status::allowed_upload_slots)
+        /* seed bank -- begin mod */
+        .def_readonly("num_torrents", &session_status::num_torrents)
+        /* seed bank -- end mod */
 
         .def_readonly("up_bandwidth_queue", &session_status::up_bandwidth_queue)
         .def_readonly("down_bandwidth_queue", &session_status::down_bandwidth_queue)
@@ -640,9 +671,16 @@ void bind_session()
 #endif
         .def("set_alert_mask", allow_threads(&session::set_alert_mask))
         .def("pop_alert", allow_threads(&session::pop_alert))
+        /* seed bank -- begin mod */
+        .def("pop_alerts", &pop_alerts)
+        .def("num_dropped_alerts", allow_threads(&session::num_dropped_alerts))
+        /* seed bank -- end mod */
         .def("wait_for_alert", &wait_for_alert, return_internal_reference<>())
         .def("add_extension", &add_extension)
         .def("add_extension", &add_extension_with_param_map)
+        /* seed bank -- begin mod */
+        .def("send_extension_message", &send_extension_message)
+        /* seed bank -- end mod */
 #ifndef TORRENT_NO_DEPRECATE
         .def("set_peer_proxy", allow_threads(&session::set_peer_proxy))
         .def("set_tracker_proxy", allow_threads(&session::set_tracker_proxy))
@@ -101,6 +101,11 @@ void bind_torrent_status()
         .def_readonly("time_since_download", &torrent_status::time_since_download)
         .def_readonly("queue_position", &torrent_status::queue_position)
         .def_readonly("need_save_resume", &torrent_status::need_save_resume)
+        /* seed bank -- begin mod */
+        // lets state_update_alert consumers act on a torrent without
+        // another lookup
+        .def_readonly("handle", &torrent_status::handle)
+        /* seed bank -- end mod */
         ;
 
     enum_<torrent_status::state_t>("states")
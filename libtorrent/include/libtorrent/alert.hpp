@@ -142,8 +142,17 @@ namespace libtorrent {
 		bool should_post() const
 		{
 			mutex::scoped_lock lock(m_mutex);
-			if (m_alerts.size() >= m_queue_size_limit) return false;
-			return (m_alert_mask & T::static_category) != 0;
+			/* seed bank -- begin mod */
+			if ((m_alert_mask & T::static_category) == 0) return false;
+			if (m_alerts.size() >= m_queue_size_limit)
+			{
+				// count alerts that would have been posted
+				// if the queue had room
+				++m_num_dropped;
+				return false;
+			}
+			return true;
+			/* seed bank -- end mod */
 		}
 
 		bool should_post(alert const* a) const
@@ -164,6 +173,12 @@ namespace libtorrent {
 		size_t alert_queue_size_limit() const { return m_queue_size_limit; }
 		size_t set_alert_queue_size_limit(size_t queue_size_limit_);
 
+		/* seed bank -- begin mod */
+		// total number of alerts discarded because the
+		// alert queue was full
+		boost::uint64_t num_dropped_alerts() const;
+		/* seed bank -- end mod */
+
 		void set_dispatch_function(boost::function<void(std::auto_ptr<alert>)> const&);
 
 #ifndef TORRENT_DISABLE_EXTENSIONS
@@ -171,13 +186,22 @@ namespace libtorrent {
 #endif
 
 	private:
-		void post_impl(std::auto_ptr<alert>& alert_);
+		/* seed bank -- begin mod */
+		void post_impl(std::auto_ptr<alert>& alert_, mutex::scoped_lock& l);
+		/* seed bank -- end mod */
 
 		std::deque<alert*> m_alerts;
 		mutable mutex m_mutex;
-//		event m_condition;
+		/* seed bank -- begin mod */
+		// signalled whenever an alert is queued, to wake
+		// up threads blocked in wait_for_alert()
+		condition m_condition;
+		/* seed bank -- end mod */
 		boost::uint32_t m_alert_mask;
 		size_t m_queue_size_limit;
+		/* seed bank -- begin mod */
+		mutable boost::uint64_t m_num_dropped;
+		/* seed bank -- end mod */
 		boost::function<void(std::auto_ptr<alert>)> m_dispatch;
 		io_service& m_ios;
 
@@ -235,6 +235,7 @@ namespace libtorrent
             void add_ses_extension(
                 boost::function<boost::shared_ptr<plugin>(string_map const&)> func,
                 string_map const& param_map);
+            void send_extension_message(string_map const& message);
             /* seed bank -- end mod */
 #endif
 #ifdef TORRENT_DEBUG
@@ -286,6 +287,12 @@ namespace libtorrent
 			boost::weak_ptr<torrent> find_torrent(std::string const& uuid);
             /* seed bank -- begin mod */
             boost::weak_ptr<torrent> find_torrent(sha1_hash const& info_hash, bool use_extended_pool);
+
+            // connections waiting for a plugin to finish looking up
+            // their torrent, see plugin::is_torrent_pending
+            bool is_torrent_pending(sha1_hash const& info_hash) const;
+            void park_connection(sha1_hash const& info_hash, peer_connection* p);
+            void resume_parked_connections(sha1_hash const& info_hash);
             /* seed bank -- end mod */
 
 			peer_id const& get_peer_id() const { return m_peer_id; }
@@ -369,6 +376,9 @@ namespace libtorrent
 			size_t set_alert_queue_size_limit(size_t queue_size_limit_);
 			std::auto_ptr<alert> pop_alert();
 			void pop_alerts(std::deque<alert*>* alerts);
+            /* seed bank -- begin mod */
+            boost::uint64_t num_dropped_alerts() const;
+            /* seed bank -- end mod */
 			void set_alert_dispatch(boost::function<void(std::auto_ptr<alert>)> const&);
 			void post_alert(const alert& alert_);
 
@@ -727,6 +737,11 @@ namespace libtorrent
 			// object. It is the complete list of all connected
 			// peers.
 			connection_map m_connections;
+
+			/* seed bank -- begin mod */
+			typedef std::multimap<sha1_hash, boost::intrusive_ptr<peer_connection> > parked_connection_map;
+			parked_connection_map m_parked_connections;
+			/* seed bank -- end mod */
 			
 			// filters incoming connections
 			ip_filter m_ip_filter;
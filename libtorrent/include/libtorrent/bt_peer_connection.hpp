@@ -162,6 +162,10 @@ namespace libtorrent
 			, std::size_t bytes_transferred);
 		void on_receive(error_code const& error
 			, std::size_t bytes_transferred);
+
+		/* seed bank -- begin mod */
+		virtual void resume_attach();
+		/* seed bank -- end mod */
 		
 		virtual void get_specific_peer_info(peer_info& p) const;
 		virtual bool in_handshake() const;
@@ -107,6 +107,20 @@ namespace libtorrent
         // called in find_torrent
         virtual boost::weak_ptr<torrent> on_find_torrent(sha1_hash const& info_hash, boost::weak_ptr<torrent> t, bool use_extended_pool)
         { return t; }
+
+        // return true while a torrent that on_find_torrent didn't return
+        // is still being looked up.  Incoming connections for it are held
+        // until session_impl::resume_parked_connections is called.
+        virtual bool is_torrent_pending(sha1_hash const& info_hash)
+        { return false; }
+
+        // called on the network thread for session::send_extension_message
+        virtual void on_extension_message(string_map const& message) {}
+
+        // called on the network thread when the session starts shutting
+        // down, while its io_service still runs.  Plugins with their own
+        // threads stop them here, not in the destructor.
+        virtual void on_abort() {}
         /* seed bank -- end mod */
 	};
 
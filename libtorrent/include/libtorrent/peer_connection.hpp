@@ -695,6 +695,13 @@ namespace libtorrent
 		// attach to an encrypted torrent
 		void attach_to_torrent(sha1_hash const& ih, bool allow_encrypted);
 
+		/* seed bank -- begin mod */
+		// called by the session when the lookup of a torrent this
+		// connection was parked on in attach_to_torrent has finished
+		virtual void resume_attach() { m_parked = false; m_lookup_done = true; }
+		bool is_parked() const { return m_parked; }
+		/* seed bank -- end mod */
+
 		bool verify_piece(peer_request const& p) const;
 
 		void update_desired_queue_size();
@@ -1137,6 +1144,17 @@ namespace libtorrent
 		// is set to 1
 		bool m_snubbed:1;
 
+		/* seed bank -- begin mod */
+		// set while waiting for a session plugin to look up the
+		// torrent this peer asked for
+		bool m_parked:1;
+
+		// set once the lookup this peer was parked on has finished.  The
+		// resumed attach doesn't start another lookup, so a peer whose
+		// lookup failed is disconnected instead of parked again.
+		bool m_lookup_done:1;
+		/* seed bank -- end mod */
+
 		// this is set to true once the bitfield is received
 		bool m_bitfield_received:1;
 
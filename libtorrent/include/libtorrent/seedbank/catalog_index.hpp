@@ -0,0 +1,89 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef CATALOG_INDEX_HPP_INCLUDED
+#define CATALOG_INDEX_HPP_INCLUDED
+
+#ifdef _MSC_VER
+#pragma warning(push, 1)
+#endif
+
+#include <boost/shared_ptr.hpp>
+#include <boost/function.hpp>
+#include <boost/cstdint.hpp>
+#include "libtorrent/config.hpp"
+#include "libtorrent/peer_id.hpp" // sha1_hash
+#include "libtorrent/error_code.hpp"
+#include "libtorrent/thread.hpp"
+#include "libtorrent/time.hpp"
+#include <string>
+
+#ifdef _MSC_VER
+#pragma warning(pop)
+#endif
+
+namespace libtorrent
+{
+    /**
+     * Read only view of the local catalog index written by
+     * seedbank.db.catalog_index, which documents the file layout.  Keep
+     * the two in sync.
+     *
+     * The file is memory mapped.  Records added or replaced in place are
+     * seen right away.  When the writer rebuilds the index it renames a
+     * new file over the old one, which is noticed and remapped within
+     * a second.
+     *
+     * Safe to use from several threads.  POSIX only.
+     */
+    class TORRENT_EXPORT catalog_index
+    {
+    public:
+        struct record
+        {
+            std::string data_root;
+            std::string name;
+            boost::uint64_t size;
+        };
+
+        catalog_index(std::string const& path);
+
+        // false if the info hash isn't in the index or, with ec set, if
+        // the index can't be read
+        bool find(sha1_hash const& info_hash, record& r, error_code& ec);
+
+        // calls f with every info hash in the index
+        void for_each(boost::function<void(sha1_hash const&)> const& f, error_code& ec);
+
+        int count(error_code& ec);
+
+        std::string const& path() const { return m_path; }
+
+    private:
+        struct mapping;
+
+        boost::shared_ptr<mapping const> _get_mapping(error_code& ec);
+        boost::shared_ptr<mapping> _map_file(error_code& ec);
+
+        std::string m_path;
+        mutex m_mutex;
+        boost::shared_ptr<mapping> m_mapping;
+        ptime m_next_check;
+    };
+}
+
+#endif // CATALOG_INDEX_HPP_INCLUDED
@@ -0,0 +1,70 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#ifndef INFO_HASH_FILTER_HPP_INCLUDED
+#define INFO_HASH_FILTER_HPP_INCLUDED
+
+#ifdef _MSC_VER
+#pragma warning(push, 1)
+#endif
+
+#include <boost/cstdint.hpp>
+#include <vector>
+#include "libtorrent/config.hpp"
+#include "libtorrent/peer_id.hpp" // sha1_hash
+
+#ifdef _MSC_VER
+#pragma warning(pop)
+#endif
+
+namespace libtorrent
+{
+    /**
+     * Bloom filter of info hashes, sized at runtime for the expected
+     * number of entries and false positive rate.
+     *
+     * The fixed size bloom_filter<N> in libtorrent takes two 16 bit
+     * indexes from the key, which caps it at 64 kbit and far too high a
+     * false positive rate for a large catalog.  Info hashes are already
+     * uniformly distributed, so the k bit indexes here come from double
+     * hashing with the first two 64 bit words of the hash.
+     */
+    class TORRENT_EXPORT info_hash_filter
+    {
+    public:
+        info_hash_filter(int expected_count, double false_positive_rate);
+
+        void set(sha1_hash const& info_hash);
+        bool find(sha1_hash const& info_hash) const;
+
+        boost::uint64_t num_bits() const { return m_num_bits; }
+        int num_hashes() const { return m_num_hashes; }
+        int count() const { return m_count; }
+
+        // false positive rate expected from the bits currently set
+        double estimated_false_positive_rate() const;
+
+    private:
+        boost::uint64_t _index(boost::uint64_t h1, boost::uint64_t h2, int i) const;
+
+        std::vector<boost::uint8_t> m_bits;
+        boost::uint64_t m_num_bits;
+        int m_num_hashes;
+        int m_count;
+    };
+}
+
+#endif // INFO_HASH_FILTER_HPP_INCLUDED
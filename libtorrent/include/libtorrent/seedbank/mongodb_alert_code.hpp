@@ -22,6 +22,10 @@ namespace libtorrent
             // INFO
             db_connect_ok = 201,
             torrent_activated = 202,
+            cache_stats = 203,
+            filter_rebuilt = 204,
+            db_circuit_closed = 205,
+            lookup_metrics = 206,
 
             // WARN
             torrent_not_found = 401,
@@ -30,7 +34,8 @@ namespace libtorrent
             unclassified_error = 500,
             db_connect_error = 501,
             db_connection_failed = 502,
-            invalid_torrent_file = 503
+            invalid_torrent_file = 503,
+            db_circuit_open = 504
         };
     };
 
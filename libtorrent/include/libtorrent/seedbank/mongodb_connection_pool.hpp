@@ -0,0 +1,156 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef MONGODB_CONNECTION_POOL_HPP_INCLUDED
+#define MONGODB_CONNECTION_POOL_HPP_INCLUDED
+
+#ifdef _MSC_VER
+#pragma warning(push, 1)
+#endif
+
+#include <boost/shared_ptr.hpp>
+#include <boost/function.hpp>
+#include <boost/cstdint.hpp>
+#include "libtorrent/config.hpp"
+#include "libtorrent/thread.hpp"
+#include "libtorrent/time.hpp"
+#include <mongo/client/dbclient.h>
+#include <string>
+#include <vector>
+
+#ifdef _MSC_VER
+#pragma warning(pop)
+#endif
+
+namespace libtorrent
+{
+    /**
+     * Connection pool shared by the mongodb plugin's worker threads.
+     *
+     * Connections that failed are dropped and reopened on demand.  Idle
+     * connections are pinged before reuse once they have been idle for
+     * the health check interval.  After a failed connect the next attempt
+     * waits for an exponential backoff with random jitter, so workers
+     * don't reconnect in lock step.
+     *
+     * A circuit breaker opens after `breaker_threshold` consecutive
+     * failures.  While it is open acquire() fails right away instead of
+     * tying up workers in socket timeouts.  After `breaker_reset` one
+     * trial request is let through, and its outcome closes or reopens
+     * the circuit.
+     */
+    class TORRENT_EXPORT mongodb_connection_pool
+    {
+    public:
+        typedef boost::shared_ptr<mongo::DBClientConnection> connection_ptr;
+
+        // called with a mongodb_alert_code and message
+        typedef boost::function<void(int, std::string const&)> alert_callback;
+
+        struct params
+        {
+            params()
+                : size(4)
+                , query_timeout(5.0)
+                , backoff_min(100)
+                , backoff_max(30000)
+                , breaker_threshold(5)
+                , breaker_reset(30)
+                , health_check_interval(30)
+            {}
+
+            std::string connection_string;
+            int size;
+            double query_timeout; // seconds, 0 for none
+            int backoff_min; // milliseconds
+            int backoff_max; // milliseconds
+            int breaker_threshold; // consecutive failures, 0 disables the breaker
+            int breaker_reset; // seconds
+            int health_check_interval; // seconds
+        };
+
+        struct stats
+        {
+            int open;
+            int idle;
+            bool circuit_open;
+            boost::uint64_t connects;
+            boost::uint64_t connect_failures;
+            boost::uint64_t health_check_failures;
+            boost::uint64_t query_failures;
+            boost::uint64_t circuit_opens;
+            boost::uint64_t rejected;
+        };
+
+        mongodb_connection_pool(params const& p, alert_callback const& cb);
+
+        // Returns a healthy connection, or null if the circuit is open, a
+        // reconnect is backing off or the pool was aborted.  Blocks while
+        // all connections are in use.
+        connection_ptr acquire();
+
+        // Return a connection.  `ok` is false if a query on it failed with a
+        // connection error, which drops the connection.
+        void release(connection_ptr const& c, bool ok);
+
+        // Wake up and fail any blocked acquire() calls
+        void abort();
+
+        void get_stats(stats& s) const;
+
+    private:
+        struct idle_connection
+        {
+            connection_ptr connection;
+            ptime last_used;
+        };
+
+        bool _check_circuit(ptime now);
+        connection_ptr _connect();
+        bool _is_healthy(connection_ptr const& c);
+        void _record_success();
+        void _record_failure(ptime now);
+        int _jitter(int ms);
+
+        params m_params;
+        alert_callback m_alert;
+
+        mutable mutex m_mutex;
+        condition m_cond;
+        std::vector<idle_connection> m_idle;
+        int m_open;
+        bool m_abort;
+
+        // reconnect backoff and circuit breaker state
+        int m_consecutive_failures;
+        int m_backoff;
+        ptime m_next_connect;
+        bool m_circuit_open;
+        bool m_trial_in_progress;
+        ptime m_circuit_retry;
+        boost::uint32_t m_random;
+
+        boost::uint64_t m_connects;
+        boost::uint64_t m_connect_failures;
+        boost::uint64_t m_health_check_failures;
+        boost::uint64_t m_query_failures;
+        boost::uint64_t m_circuit_opens;
+        boost::uint64_t m_rejected;
+    };
+}
+
+#endif // MONGODB_CONNECTION_POOL_HPP_INCLUDED
@@ -0,0 +1,106 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef TORRENT_INFO_CACHE_HPP_INCLUDED
+#define TORRENT_INFO_CACHE_HPP_INCLUDED
+
+#ifdef _MSC_VER
+#pragma warning(push, 1)
+#endif
+
+#include <boost/intrusive_ptr.hpp>
+#include <boost/cstdint.hpp>
+#include "libtorrent/config.hpp"
+#include "libtorrent/peer_id.hpp" // sha1_hash
+#include "libtorrent/thread.hpp"
+#include "libtorrent/torrent_info.hpp"
+#include <ctime> // time_t
+#include <list>
+#include <map>
+
+#ifdef _MSC_VER
+#pragma warning(pop)
+#endif
+
+namespace libtorrent
+{
+    /**
+     * Parsed torrent files, keyed by info hash and bounded by an estimate
+     * of their memory use.  Entries are only returned while the torrent
+     * file's mtime matches the one they were parsed from.
+     *
+     * Cached torrent_info objects are never handed out.  find() returns a
+     * copy, which duplicates the info section but skips reading and
+     * parsing the file, so an active torrent can't change a cached entry.
+     *
+     * Safe to use from several threads.
+     */
+    class TORRENT_EXPORT torrent_info_cache
+    {
+    public:
+        struct stats
+        {
+            int entries;
+            boost::uint64_t bytes;
+            boost::uint64_t hits;
+            boost::uint64_t misses;
+            boost::uint64_t stale; // misses because the file changed
+            boost::uint64_t evictions;
+        };
+
+        torrent_info_cache(boost::uint64_t max_bytes);
+
+        // copy of the torrent_info parsed from a file with this mtime, or null
+        boost::intrusive_ptr<torrent_info> find(sha1_hash const& info_hash, std::time_t mtime);
+
+        // `ti` must not be used by the caller afterwards
+        void insert(sha1_hash const& info_hash, std::time_t mtime
+            , boost::uint64_t file_size, boost::intrusive_ptr<torrent_info> const& ti);
+
+        void erase(sha1_hash const& info_hash);
+        void clear();
+
+        void get_stats(stats& s) const;
+
+    private:
+        struct entry
+        {
+            boost::intrusive_ptr<torrent_info> ti;
+            std::time_t mtime;
+            boost::uint64_t bytes;
+            std::list<sha1_hash>::iterator lru;
+        };
+
+        void _erase(std::map<sha1_hash, entry>::iterator i);
+
+        boost::uint64_t m_max_bytes;
+        boost::uint64_t m_bytes;
+
+        mutable mutex m_mutex;
+
+        // most recently used first
+        std::map<sha1_hash, entry> m_entries;
+        std::list<sha1_hash> m_lru;
+
+        boost::uint64_t m_hits;
+        boost::uint64_t m_misses;
+        boost::uint64_t m_stale;
+        boost::uint64_t m_evictions;
+    };
+}
+
+#endif // TORRENT_INFO_CACHE_HPP_INCLUDED
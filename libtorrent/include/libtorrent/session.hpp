@@ -292,6 +292,10 @@ namespace libtorrent
         void add_extension(
             boost::function<boost::shared_ptr<plugin>(string_map const&)> func,
             string_map const& string_map);
+
+        // deliver a message to every session plugin, see
+        // plugin::on_extension_message
+        void send_extension_message(string_map const& message);
         /* seed bank -- end mod */
 #endif
 
@@ -473,6 +477,11 @@ namespace libtorrent
 		// delete them all.
 		void pop_alerts(std::deque<alert*>* alerts);
 
+        /* seed bank -- begin mod */
+        // number of alerts discarded because the alert queue was full
+        boost::uint64_t num_dropped_alerts() const;
+        /* seed bank -- end mod */
+
 #ifndef TORRENT_NO_DEPRECATE
 		TORRENT_DEPRECATED_PREFIX
 		void set_severity_level(alert::severity_t s) TORRENT_DEPRECATED;
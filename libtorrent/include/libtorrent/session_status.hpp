@@ -117,6 +117,12 @@ namespace libtorrent
 		int num_unchoked;
 		int allowed_upload_slots;
 
+		/* seed bank -- begin mod */
+		// number of torrents in the session, without
+		// building a list of torrent handles
+		int num_torrents;
+		/* seed bank -- end mod */
+
 		int up_bandwidth_queue;
 		int down_bandwidth_queue;
 
@@ -63,6 +63,12 @@ namespace libtorrent
 		condition();
 		~condition();
 		void wait(mutex::scoped_lock& l);
+		/* seed bank -- begin mod */
+		// waits until signalled or until the timeout expires.
+		// like wait(), this may return early on a spurious
+		// wakeup, so callers must re-check their predicate
+		void timed_wait(mutex::scoped_lock& l, int milliseconds);
+		/* seed bank -- end mod */
 		void signal_all(mutex::scoped_lock& l);
 	private:
 #ifdef BOOST_HAS_PTHREADS
@@ -336,6 +336,9 @@ namespace libtorrent {
 	alert_manager::alert_manager(io_service& ios, int queue_limit, boost::uint32_t alert_mask)
 		: m_alert_mask(alert_mask)
 		, m_queue_size_limit(queue_limit)
+		/* seed bank -- begin mod */
+		, m_num_dropped(0)
+		/* seed bank -- end mod */
 		, m_ios(ios)
 	{}
 
@@ -357,26 +360,24 @@ namespace libtorrent {
 		mutex::scoped_lock lock(m_mutex);
 
 		if (!m_alerts.empty()) return m_alerts.front();
-		
-//		system_time end = get_system_time()
-//			+ boost::posix_time::microseconds(total_microseconds(max_wait));
-
-		// apparently this call can be interrupted
-		// prematurely if there are other signals
-//		while (m_condition.timed_wait(lock, end))
-//			if (!m_alerts.empty()) return m_alerts.front();
 
-		ptime start = time_now_hires();
+		/* seed bank -- begin mod */
+		// post_impl() signals m_condition whenever an alert is
+		// queued, so block on it rather than polling. The wait
+		// can return early on a spurious wakeup, so keep waiting
+		// out whatever is left of max_wait
+		ptime end = time_now_hires() + max_wait;
 
-		// TODO: change this to use an asio timer instead
 		while (m_alerts.empty())
 		{
-			lock.unlock();
-			sleep(50);
-			lock.lock();
-			if (time_now_hires() - start >= max_wait) return 0;
+			ptime now = time_now_hires();
+			if (now >= end) return 0;
+			// round up, to not spin on sub-millisecond remainders
+			int ms = int((total_microseconds(end - now) + 999) / 1000);
+			m_condition.timed_wait(lock, ms);
 		}
 		return m_alerts.front();
+		/* seed bank -- end mod */
 	}
 
 	void alert_manager::set_dispatch_function(boost::function<void(std::auto_ptr<alert>)> const& fun)
@@ -410,7 +411,9 @@ namespace libtorrent {
 		std::auto_ptr<alert> a(alert_);
 		mutex::scoped_lock lock(m_mutex);
 
-		post_impl(a);
+		/* seed bank -- begin mod */
+		post_impl(a, lock);
+		/* seed bank -- end mod */
 
 #ifndef TORRENT_DISABLE_EXTENSIONS
 		lock.unlock();
@@ -431,7 +434,9 @@ namespace libtorrent {
 		std::auto_ptr<alert> a(alert_.clone());
 		mutex::scoped_lock lock(m_mutex);
 
-		post_impl(a);
+		/* seed bank -- begin mod */
+		post_impl(a, lock);
+		/* seed bank -- end mod */
 
 #ifndef TORRENT_DISABLE_EXTENSIONS
 		lock.unlock();
@@ -447,7 +452,9 @@ namespace libtorrent {
 
 	}
 		
-	void alert_manager::post_impl(std::auto_ptr<alert>& alert_)
+	/* seed bank -- begin mod */
+	void alert_manager::post_impl(std::auto_ptr<alert>& alert_, mutex::scoped_lock& l)
+	/* seed bank -- end mod */
 	{
 		if (m_dispatch)
 		{
@@ -459,7 +466,16 @@ namespace libtorrent {
 		else if (m_alerts.size() < m_queue_size_limit || !alert_->discardable())
 		{
 			m_alerts.push_back(alert_.release());
+			/* seed bank -- begin mod */
+			m_condition.signal_all(l);
+			/* seed bank -- end mod */
+		}
+		/* seed bank -- begin mod */
+		else
+		{
+			++m_num_dropped;
 		}
+		/* seed bank -- end mod */
 	}
 
 #ifndef TORRENT_DISABLE_EXTENSIONS
@@ -503,6 +519,14 @@ namespace libtorrent {
 		return queue_size_limit_;
 	}
 
+	/* seed bank -- begin mod */
+	boost::uint64_t alert_manager::num_dropped_alerts() const
+	{
+		mutex::scoped_lock lock(m_mutex);
+		return m_num_dropped;
+	}
+	/* seed bank -- end mod */
+
 	stats_alert::stats_alert(torrent_handle const& h, int in
 		, stat const& s)
 		: torrent_alert(h)
@@ -2334,6 +2334,19 @@ namespace libtorrent
 	// RECEIVE DATA
 	// --------------------------
 
+	/* seed bank -- begin mod */
+	/**
+	 * The info hash part of the handshake is still in the receive buffer,
+	 * so running on_receive without new data attaches to the torrent and
+	 * continues the handshake, or disconnects if it wasn't found.
+	 */
+	void bt_peer_connection::resume_attach()
+	{
+		peer_connection::resume_attach();
+		on_receive(error_code(), 0);
+	}
+	/* seed bank -- end mod */
+
 	void bt_peer_connection::on_receive(error_code const& error
 		, std::size_t bytes_transferred)
 	{
@@ -3011,6 +3024,12 @@ namespace libtorrent
 
 				attach_to_torrent(info_hash, allow_encrypted);
 				if (is_disconnecting()) return;
+
+				/* seed bank -- begin mod */
+				// parked until the torrent has been looked up, the
+				// handshake continues from resume_attach()
+				if (is_parked()) return;
+				/* seed bank -- end mod */
 			}
 			else
 			{
@@ -185,6 +185,10 @@ namespace libtorrent
 		, m_share_mode(false)
 		, m_upload_only(false)
 		, m_snubbed(false)
+		/* seed bank -- begin mod */
+		, m_parked(false)
+		, m_lookup_done(false)
+		/* seed bank -- end mod */
 		, m_bitfield_received(false)
 		, m_no_download(false)
 		, m_endgame_mode(false)
@@ -989,7 +993,10 @@ namespace libtorrent
 
 		TORRENT_ASSERT(!m_disconnecting);
 		TORRENT_ASSERT(m_torrent.expired());
-		boost::weak_ptr<torrent> wpt = m_ses.find_torrent(ih);
+		/* seed bank -- begin mod */
+		// only the first attach may start a plugin lookup
+		boost::weak_ptr<torrent> wpt = m_ses.find_torrent(ih, !m_lookup_done);
+		/* seed bank -- end mod */
 		boost::shared_ptr<torrent> t = wpt.lock();
 
 #if defined TORRENT_VERBOSE_LOGGING || defined TORRENT_ERROR_LOGGING
@@ -1011,6 +1018,24 @@ namespace libtorrent
 			t.reset();
 		}
 
+		/* seed bank -- begin mod */
+		if (!t && !m_lookup_done && m_ses.is_torrent_pending(ih))
+		{
+			// a session plugin is activating the torrent off the network
+			// thread. Hold the connection, the session calls
+			// resume_attach() once the lookup finishes.
+#if defined TORRENT_VERBOSE_LOGGING || defined TORRENT_ERROR_LOGGING
+			peer_log("*** waiting for torrent lookup: %s", to_hex(ih.to_string()).c_str());
+#endif
+			if (!m_parked)
+			{
+				m_parked = true;
+				m_ses.park_connection(ih, this);
+			}
+			return;
+		}
+		/* seed bank -- end mod */
+
 		if (!t)
 		{
 			// we couldn't find the torrent!
@@ -0,0 +1,212 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include "libtorrent/pch.hpp"
+#include "libtorrent/seedbank/catalog_index.hpp"
+
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <errno.h>
+#include <cstring> // memcmp, memchr
+
+namespace libtorrent
+{
+    namespace
+    {
+        // see seedbank.db.catalog_index
+        char const magic[] = "SBCATIDX";
+        const int version = 1;
+        const int header_size = 64;
+        const int record_size = 256;
+        const int state_offset = 20;
+        const int size_offset = 24;
+        const int data_root_offset = 48;
+        const int name_offset = 152;
+        const int field_length = 104;
+
+        enum { slot_empty = 0, slot_used = 1, slot_deleted = 2 };
+
+        boost::uint32_t read_uint32_le(char const* p)
+        {
+            unsigned char const* u = (unsigned char const*)p;
+            return boost::uint32_t(u[0]) | (boost::uint32_t(u[1]) << 8)
+                | (boost::uint32_t(u[2]) << 16) | (boost::uint32_t(u[3]) << 24);
+        }
+
+        boost::uint64_t read_uint64_le(char const* p)
+        {
+            return boost::uint64_t(read_uint32_le(p))
+                | (boost::uint64_t(read_uint32_le(p + 4)) << 32);
+        }
+
+        std::string read_field(char const* p)
+        {
+            char const* end = (char const*)memchr(p, 0, field_length);
+            return std::string(p, end ? end - p : field_length);
+        }
+    }
+
+    struct catalog_index::mapping
+    {
+        mapping() : addr(0), length(0), slot_count(0), dev(0), ino(0) {}
+        ~mapping() { if (addr) munmap(addr, length); }
+
+        char const* slot(boost::uint32_t i) const
+        {
+            return (char const*)addr + header_size + size_t(i) * record_size;
+        }
+
+        int used() const { return int(read_uint32_le((char const*)addr + 20)); }
+
+        void* addr;
+        size_t length;
+        boost::uint32_t slot_count;
+        dev_t dev;
+        ino_t ino;
+    };
+
+    catalog_index::catalog_index(std::string const& path)
+        : m_path(path)
+        , m_next_check(min_time())
+    {}
+
+    /**
+     * Linear probing from the first 8 bytes of the info hash, big endian
+     */
+    bool catalog_index::find(sha1_hash const& info_hash, record& r, error_code& ec)
+    {
+        boost::shared_ptr<mapping const> m = _get_mapping(ec);
+        if (!m) return false;
+
+        boost::uint64_t h = 0;
+        for (int i = 0; i < 8; ++i) h = (h << 8) | boost::uint64_t(info_hash[i]);
+        boost::uint32_t s = boost::uint32_t(h % m->slot_count);
+
+        for (boost::uint32_t i = 0; i < m->slot_count; ++i) {
+            char const* p = m->slot(s);
+            int state = (unsigned char)p[state_offset];
+            if (state == slot_empty) return false;
+            if (state == slot_used && memcmp(p, &info_hash[0], sha1_hash::size) == 0) {
+                r.size = read_uint64_le(p + size_offset);
+                r.data_root = read_field(p + data_root_offset);
+                r.name = read_field(p + name_offset);
+                return true;
+            }
+            s = (s + 1) % m->slot_count;
+        }
+        return false;
+    }
+
+    void catalog_index::for_each(boost::function<void(sha1_hash const&)> const& f, error_code& ec)
+    {
+        boost::shared_ptr<mapping const> m = _get_mapping(ec);
+        if (!m) return;
+        for (boost::uint32_t i = 0; i < m->slot_count; ++i) {
+            char const* p = m->slot(i);
+            if ((unsigned char)p[state_offset] != slot_used) continue;
+            sha1_hash info_hash;
+            std::memcpy(&info_hash[0], p, sha1_hash::size);
+            f(info_hash);
+        }
+    }
+
+    int catalog_index::count(error_code& ec)
+    {
+        boost::shared_ptr<mapping const> m = _get_mapping(ec);
+        return m ? m->used() : 0;
+    }
+
+    /**
+     * Readers keep the mapping they got alive until they are done with it,
+     * so a replaced index is unmapped after the last lookup using it.
+     */
+    boost::shared_ptr<catalog_index::mapping const> catalog_index::_get_mapping(error_code& ec)
+    {
+        mutex::scoped_lock l(m_mutex);
+        ptime now = time_now_hires();
+        if (m_mapping && now < m_next_check) return m_mapping;
+        m_next_check = now + seconds(1);
+
+        if (m_mapping) {
+            struct stat st;
+            if (::stat(m_path.c_str(), &st) == 0
+                && st.st_dev == m_mapping->dev && st.st_ino == m_mapping->ino)
+            {
+                return m_mapping;
+            }
+        }
+
+        boost::shared_ptr<mapping> m = _map_file(ec);
+        // keep using the old index if the new one can't be read
+        if (m) m_mapping = m;
+        return m_mapping;
+    }
+
+    boost::shared_ptr<catalog_index::mapping> catalog_index::_map_file(error_code& ec)
+    {
+        boost::shared_ptr<mapping> m;
+        int fd = ::open(m_path.c_str(), O_RDONLY);
+        if (fd < 0) {
+            ec = error_code(errno, get_posix_category());
+            return m;
+        }
+
+        struct stat st;
+        char header[header_size];
+        if (::fstat(fd, &st) != 0) {
+            ec = error_code(errno, get_posix_category());
+            ::close(fd);
+            return m;
+        }
+        if (::pread(fd, header, header_size, 0) != header_size) {
+            ec = error_code(EINVAL, get_posix_category());
+            ::close(fd);
+            return m;
+        }
+
+        boost::uint32_t slot_count = read_uint32_le(header + 16);
+        size_t length = header_size + size_t(slot_count) * record_size;
+        if (memcmp(header, magic, 8) != 0
+            || read_uint32_le(header + 8) != boost::uint32_t(version)
+            || read_uint32_le(header + 12) != boost::uint32_t(record_size)
+            || slot_count == 0
+            || size_t(st.st_size) < length)
+        {
+            ec = error_code(EINVAL, get_posix_category());
+            ::close(fd);
+            return m;
+        }
+
+        void* addr = mmap(0, length, PROT_READ, MAP_SHARED, fd, 0);
+        ::close(fd);
+        if (addr == MAP_FAILED) {
+            ec = error_code(errno, get_posix_category());
+            return m;
+        }
+
+        m.reset(new mapping);
+        m->addr = addr;
+        m->length = length;
+        m->slot_count = slot_count;
+        m->dev = st.st_dev;
+        m->ino = st.st_ino;
+        return m;
+    }
+}
@@ -0,0 +1,87 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include "libtorrent/pch.hpp"
+#include "libtorrent/seedbank/info_hash_filter.hpp"
+
+#include <algorithm> // max, min
+#include <math.h> // log, exp, pow, ceil
+
+namespace libtorrent
+{
+    namespace
+    {
+        boost::uint64_t read_uint64(sha1_hash const& info_hash, int offset)
+        {
+            boost::uint64_t ret = 0;
+            for (int i = 0; i < 8; ++i) {
+                ret = (ret << 8) | boost::uint64_t(info_hash[offset + i]);
+            }
+            return ret;
+        }
+    }
+
+    /**
+     * Optimal sizing: m = -n ln(p) / ln(2)^2 bits and k = m/n ln(2) hashes
+     */
+    info_hash_filter::info_hash_filter(int expected_count, double false_positive_rate)
+        : m_count(0)
+    {
+        double n = (std::max)(expected_count, 1);
+        double p = (std::min)((std::max)(false_positive_rate, 1e-9), 0.5);
+        double m = ceil(-n * ::log(p) / (::log(2.0) * ::log(2.0)));
+        m_num_bits = (std::max)(boost::uint64_t(m), boost::uint64_t(64));
+        m_num_hashes = (std::max)(1, int(m / n * ::log(2.0) + 0.5));
+        m_bits.resize((m_num_bits + 7) / 8, 0);
+    }
+
+    boost::uint64_t info_hash_filter::_index(boost::uint64_t h1, boost::uint64_t h2, int i) const
+    {
+        return (h1 + boost::uint64_t(i) * h2) % m_num_bits;
+    }
+
+    void info_hash_filter::set(sha1_hash const& info_hash)
+    {
+        boost::uint64_t h1 = read_uint64(info_hash, 0);
+        boost::uint64_t h2 = read_uint64(info_hash, 8) | 1;
+        for (int i = 0; i < m_num_hashes; ++i) {
+            boost::uint64_t idx = _index(h1, h2, i);
+            m_bits[idx / 8] |= boost::uint8_t(1 << (idx & 7));
+        }
+        ++m_count;
+    }
+
+    bool info_hash_filter::find(sha1_hash const& info_hash) const
+    {
+        boost::uint64_t h1 = read_uint64(info_hash, 0);
+        boost::uint64_t h2 = read_uint64(info_hash, 8) | 1;
+        for (int i = 0; i < m_num_hashes; ++i) {
+            boost::uint64_t idx = _index(h1, h2, i);
+            if ((m_bits[idx / 8] & (1 << (idx & 7))) == 0) return false;
+        }
+        return true;
+    }
+
+    /**
+     * (1 - e^(-kn/m))^k
+     */
+    double info_hash_filter::estimated_false_positive_rate() const
+    {
+        double k = m_num_hashes;
+        return ::pow(1.0 - ::exp(-k * m_count / double(m_num_bits)), k);
+    }
+}
@@ -0,0 +1,243 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include "libtorrent/pch.hpp"
+#include "libtorrent/seedbank/mongodb_connection_pool.hpp"
+#include "libtorrent/seedbank/mongodb_alert_code.hpp"
+
+#include <algorithm> // min
+#include <ctime> // time
+#include <sstream>
+
+namespace libtorrent
+{
+    mongodb_connection_pool::mongodb_connection_pool(params const& p, alert_callback const& cb)
+        : m_params(p)
+        , m_alert(cb)
+        , m_open(0)
+        , m_abort(false)
+        , m_consecutive_failures(0)
+        , m_backoff(0)
+        , m_next_connect(min_time())
+        , m_circuit_open(false)
+        , m_trial_in_progress(false)
+        , m_circuit_retry(min_time())
+        , m_random(boost::uint32_t(std::time(0)) | 1)
+        , m_connects(0)
+        , m_connect_failures(0)
+        , m_health_check_failures(0)
+        , m_query_failures(0)
+        , m_circuit_opens(0)
+        , m_rejected(0)
+    {
+        if (m_params.size < 1) m_params.size = 1;
+    }
+
+    /**
+     * Connects and health checks run without holding the lock, so a slow
+     * database doesn't block release() calls from other workers.
+     */
+    mongodb_connection_pool::connection_ptr mongodb_connection_pool::acquire()
+    {
+        mutex::scoped_lock l(m_mutex);
+
+        // true if this call is the half open circuit's trial request
+        bool trial = false;
+
+        for (;;) {
+            if (m_abort) {
+                if (trial) m_trial_in_progress = false;
+                return connection_ptr();
+            }
+
+            ptime now = time_now_hires();
+            if (!trial && m_circuit_open) {
+                if (m_trial_in_progress || now < m_circuit_retry) {
+                    ++m_rejected;
+                    return connection_ptr();
+                }
+                m_trial_in_progress = true;
+                trial = true;
+            }
+
+            if (!m_idle.empty()) {
+                idle_connection ic = m_idle.back();
+                m_idle.pop_back();
+                bool check = m_params.health_check_interval > 0
+                    && now - ic.last_used >= seconds(m_params.health_check_interval);
+                if (!check && !ic.connection->isFailed()) return ic.connection;
+
+                l.unlock();
+                bool healthy = _is_healthy(ic.connection);
+                l.lock();
+                if (healthy) return ic.connection;
+
+                --m_open;
+                ++m_health_check_failures;
+                _record_failure(time_now_hires());
+                m_cond.signal_all(l);
+                if (trial) return connection_ptr();
+                continue;
+            }
+
+            if (m_open < m_params.size) {
+                // the trial request doesn't wait for the reconnect backoff
+                if (!trial && now < m_next_connect) {
+                    ++m_rejected;
+                    return connection_ptr();
+                }
+                ++m_open;
+                l.unlock();
+                connection_ptr c = _connect();
+                l.lock();
+                if (c) {
+                    ++m_connects;
+                    _record_success();
+                    return c;
+                }
+                --m_open;
+                ++m_connect_failures;
+                _record_failure(time_now_hires());
+                m_cond.signal_all(l);
+                return connection_ptr();
+            }
+
+            m_cond.wait(l);
+        }
+    }
+
+    void mongodb_connection_pool::release(connection_ptr const& c, bool ok)
+    {
+        mutex::scoped_lock l(m_mutex);
+        if (ok && !c->isFailed()) {
+            _record_success();
+            idle_connection ic;
+            ic.connection = c;
+            ic.last_used = time_now_hires();
+            m_idle.push_back(ic);
+        } else {
+            --m_open;
+            ++m_query_failures;
+            _record_failure(time_now_hires());
+        }
+        m_cond.signal_all(l);
+    }
+
+    void mongodb_connection_pool::abort()
+    {
+        mutex::scoped_lock l(m_mutex);
+        m_abort = true;
+        m_cond.signal_all(l);
+    }
+
+    void mongodb_connection_pool::get_stats(stats& s) const
+    {
+        mutex::scoped_lock l(m_mutex);
+        s.open = m_open;
+        s.idle = int(m_idle.size());
+        s.circuit_open = m_circuit_open;
+        s.connects = m_connects;
+        s.connect_failures = m_connect_failures;
+        s.health_check_failures = m_health_check_failures;
+        s.query_failures = m_query_failures;
+        s.circuit_opens = m_circuit_opens;
+        s.rejected = m_rejected;
+    }
+
+    /**
+     * Called without the lock held.  The socket timeout also bounds each
+     * query on the connection.
+     */
+    mongodb_connection_pool::connection_ptr mongodb_connection_pool::_connect()
+    {
+        connection_ptr c(new mongo::DBClientConnection(false, 0, m_params.query_timeout));
+        try {
+            c->connect(m_params.connection_string);
+        } catch (mongo::DBException& e) {
+            m_alert(mongodb_alert_code::db_connect_error, e.what());
+            return connection_ptr();
+        }
+        m_alert(mongodb_alert_code::db_connect_ok, "mongodb connection okay");
+        return c;
+    }
+
+    /**
+     * Called without the lock held
+     */
+    bool mongodb_connection_pool::_is_healthy(connection_ptr const& c)
+    {
+        if (c->isFailed()) return false;
+        try {
+            mongo::BSONObj info;
+            return c->runCommand("admin", BSON("ping" << 1), info);
+        } catch (mongo::DBException&) {
+            return false;
+        }
+    }
+
+    void mongodb_connection_pool::_record_success()
+    {
+        m_consecutive_failures = 0;
+        m_backoff = 0;
+        m_next_connect = min_time();
+        if (m_circuit_open) {
+            m_circuit_open = false;
+            m_trial_in_progress = false;
+            m_alert(mongodb_alert_code::db_circuit_closed, "mongodb connections restored, circuit closed");
+        }
+    }
+
+    void mongodb_connection_pool::_record_failure(ptime now)
+    {
+        ++m_consecutive_failures;
+        m_backoff = m_backoff == 0 ? m_params.backoff_min
+            : (std::min)(m_backoff * 2, m_params.backoff_max);
+        m_next_connect = now + milliseconds(_jitter(m_backoff));
+
+        if (m_trial_in_progress) {
+            // trial request failed, stay open
+            m_trial_in_progress = false;
+            m_circuit_retry = now + seconds(m_params.breaker_reset);
+            return;
+        }
+
+        if (!m_circuit_open && m_params.breaker_threshold > 0
+            && m_consecutive_failures >= m_params.breaker_threshold)
+        {
+            m_circuit_open = true;
+            ++m_circuit_opens;
+            m_circuit_retry = now + seconds(m_params.breaker_reset);
+            std::stringstream ss;
+            ss << "mongodb circuit open after " << m_consecutive_failures
+                << " consecutive failures, retrying in " << m_params.breaker_reset << " seconds";
+            m_alert(mongodb_alert_code::db_circuit_open, ss.str());
+        }
+    }
+
+    /**
+     * Uniform in [ms/2, ms].  xorshift32 rather than random(), which isn't
+     * safe to call off the network thread.
+     */
+    int mongodb_connection_pool::_jitter(int ms)
+    {
+        m_random ^= m_random << 13;
+        m_random ^= m_random >> 17;
+        m_random ^= m_random << 5;
+        int half = ms / 2;
+        return half + int(m_random % boost::uint32_t(ms - half + 1));
+    }
+}
@@ -22,6 +22,8 @@
 #endif
 
 #include <boost/shared_ptr.hpp>
+#include <boost/enable_shared_from_this.hpp>
+#include <boost/bind.hpp>
 
 #ifdef _MSC_VER
 #pragma warning(pop)
@@ -29,6 +31,10 @@
 
 #include "libtorrent/seedbank/mongodb_torrent_db.hpp"
 #include "libtorrent/seedbank/mongodb_alert_code.hpp"
+#include "libtorrent/seedbank/info_hash_filter.hpp"
+#include "libtorrent/seedbank/mongodb_connection_pool.hpp"
+#include "libtorrent/seedbank/torrent_info_cache.hpp"
+#include "libtorrent/seedbank/catalog_index.hpp"
 #include "libtorrent/session.hpp"
 #include "libtorrent/aux_/session_impl.hpp"
 #include "libtorrent/extensions.hpp"
@@ -38,9 +44,19 @@
 #include "libtorrent/torrent.hpp"
 #include "libtorrent/alert.hpp"
 #include "libtorrent/alert_types.hpp"
+#include "libtorrent/thread.hpp"
+#include "libtorrent/io_service.hpp"
+#include "libtorrent/time.hpp"
+#include "libtorrent/file.hpp" // stat_file
 
 #include <mongo/client/dbclient.h> // mongodb client
 #include <sstream>
+#include <cstdlib> // atoi, atof
+#include <deque>
+#include <list>
+#include <set>
+#include <vector>
+#include <algorithm> // max, fill
 
 using std::string;
 using std::stringstream;
@@ -66,10 +82,11 @@ namespace libtorrent {
         TORRENT_DEFINE_ALERT(mongodb_plugin_alert);
         const static int static_category = alert::error_notification | alert::status_notification;
 
+        // not truncated, lookup_metrics messages are long
         std::string message() const {
-            char ret[400];
-            snprintf(ret, sizeof(ret), "(%d) %s", code, msg.c_str());
-            return ret;
+            std::stringstream ss;
+            ss << "(" << code << ") " << msg;
+            return ss.str();
         }
 
         int code;
@@ -78,13 +95,187 @@ namespace libtorrent {
 
 namespace
 {
-    struct mongodb_torrent_db_plugin : plugin
+    /**
+     * Outcome of a torrent lookup on a worker thread.  Alerts are posted
+     * from the network thread when the result is handled.
+     */
+    struct lookup_result
+    {
+        lookup_result(sha1_hash const& ih, int generation)
+            : info_hash(ih)
+            , cached(false)
+            , cache_generation(generation)
+            , code(0)
+            , queued(time_now_hires())
+            , query_us(-1)
+            , parse_us(-1)
+        {}
+
+        sha1_hash info_hash;
+        string ih_hex;
+        string data_root;
+        boost::intrusive_ptr<torrent_info> ti;
+
+        // true if ih_hex and data_root came from the lookup cache, so
+        // only the torrent file needs to be read
+        bool cached;
+
+        // cache generation when the lookup was queued.  Results are only
+        // cached if no entry was invalidated since.
+        int cache_generation;
+
+        // mongodb_alert_code and message if the lookup failed
+        int code;
+        string msg;
+
+        // stage latencies, -1 if the stage didn't run
+        ptime queued;
+        boost::int64_t query_us;
+        boost::int64_t parse_us;
+    };
+
+    /**
+     * Latency histogram with power of two microsecond buckets.  Bucket i
+     * counts latencies below 2^(i+1) us, the last one everything longer.
+     */
+    struct latency_histogram
+    {
+        enum { num_buckets = 26 }; // 2^25 us is about 34 seconds
+
+        latency_histogram()
+            : count(0)
+            , sum(0)
+            , max_us(0)
+        {
+            std::fill(buckets, buckets + num_buckets, 0);
+        }
+
+        void record(boost::int64_t us)
+        {
+            if (us < 0) us = 0;
+            int i = 0;
+            while (i < num_buckets - 1 && (boost::int64_t(2) << i) <= us) ++i;
+            ++buckets[i];
+            ++count;
+            sum += us;
+            if (us > max_us) max_us = us;
+        }
+
+        void write_json(std::ostream& os) const
+        {
+            os << "{\"count\": " << count
+                << ", \"sum_us\": " << sum
+                << ", \"max_us\": " << max_us
+                << ", \"buckets\": [";
+            for (int i = 0; i < num_buckets; ++i) {
+                if (i) os << ", ";
+                os << buckets[i];
+            }
+            os << "]}";
+        }
+
+        boost::uint64_t buckets[num_buckets];
+        boost::uint64_t count;
+        boost::int64_t sum;
+        boost::int64_t max_us;
+    };
+
+    /**
+     * Lookup cache entry.  Found entries hold the database record, not
+     * found entries keep unknown info hashes from reaching the database.
+     */
+    struct cache_entry
+    {
+        bool found;
+        string ih_hex;
+        string data_root;
+        ptime expires;
+        std::list<sha1_hash>::iterator lru;
+    };
+
+    struct mongodb_torrent_db_plugin : plugin, boost::enable_shared_from_this<mongodb_torrent_db_plugin>
     {
         mongodb_torrent_db_plugin(string_map const& param_map)
+            : m_io_service(0)
+            , m_cache_generation(0)
+            , m_ticks(0)
+            , m_metrics_ticks(0)
+            , m_activated(0)
+            , m_not_found(0)
+            , m_invalid_file(0)
+            , m_db_failures(0)
+            , m_errors(0)
+            , m_positive_hits(0)
+            , m_negative_hits(0)
+            , m_misses(0)
+            , m_evictions(0)
+            , m_invalidations(0)
+            , m_filter_rejects(0)
+            , m_filter_false_positives(0)
+            , m_filter_rebuild_requested(false)
+            , m_filter_builds_started(0)
+            , m_abort(false)
         {
             _set_param_or_default(param_map, "connection_string", "localhost:27017");
             _set_param_or_default(param_map, "torrentdb_ns", "seedbank.torrent");
             _set_param_or_default(param_map, "torrent_file_root", "/var/lib/seedbank/torrents");
+            _set_param_or_default(param_map, "catalog_backend", "mongodb");
+            _set_param_or_default(param_map, "catalog_index_path", "/var/lib/seedbank/catalog.idx");
+            _set_param_or_default(param_map, "shard_index", "0");
+            _set_param_or_default(param_map, "shard_count", "1");
+            _set_param_or_default(param_map, "lookup_threads", "4");
+            _set_param_or_default(param_map, "cache_size", "10000");
+            _set_param_or_default(param_map, "cache_ttl", "3600");
+            _set_param_or_default(param_map, "cache_negative_ttl", "60");
+            _set_param_or_default(param_map, "cache_stats_interval", "60");
+            _set_param_or_default(param_map, "metrics_interval", "10");
+            _set_param_or_default(param_map, "filter_fpr", "0.01");
+            _set_param_or_default(param_map, "pool_size", "0"); // 0: one per worker thread
+            _set_param_or_default(param_map, "query_timeout", "5");
+            _set_param_or_default(param_map, "reconnect_backoff_min", "100");
+            _set_param_or_default(param_map, "reconnect_backoff_max", "30000");
+            _set_param_or_default(param_map, "breaker_threshold", "5");
+            _set_param_or_default(param_map, "breaker_reset", "30");
+            _set_param_or_default(param_map, "health_check_interval", "30");
+            _set_param_or_default(param_map, "torrent_info_cache_mb", "256");
+            m_connection_string = m_param_map["connection_string"];
+            m_torrentdb_ns = m_param_map["torrentdb_ns"];
+            m_torrent_file_root = m_param_map["torrent_file_root"];
+            m_shard_index = std::atoi(m_param_map["shard_index"].c_str());
+            m_shard_count = std::atoi(m_param_map["shard_count"].c_str());
+            m_lookup_threads = (std::max)(1, std::atoi(m_param_map["lookup_threads"].c_str()));
+            m_cache_size = (std::max)(0, std::atoi(m_param_map["cache_size"].c_str()));
+            m_cache_ttl = std::atoi(m_param_map["cache_ttl"].c_str());
+            m_cache_negative_ttl = std::atoi(m_param_map["cache_negative_ttl"].c_str());
+            m_cache_stats_interval = std::atoi(m_param_map["cache_stats_interval"].c_str());
+            m_metrics_interval = std::atoi(m_param_map["metrics_interval"].c_str());
+            m_filter_fpr = std::atof(m_param_map["filter_fpr"].c_str());
+
+            m_pool_params.connection_string = m_connection_string;
+            m_pool_params.size = std::atoi(m_param_map["pool_size"].c_str());
+            if (m_pool_params.size <= 0) m_pool_params.size = m_lookup_threads + 1;
+            m_pool_params.query_timeout = std::atof(m_param_map["query_timeout"].c_str());
+            m_pool_params.backoff_min = (std::max)(1, std::atoi(m_param_map["reconnect_backoff_min"].c_str()));
+            m_pool_params.backoff_max = (std::max)(m_pool_params.backoff_min, std::atoi(m_param_map["reconnect_backoff_max"].c_str()));
+            m_pool_params.breaker_threshold = std::atoi(m_param_map["breaker_threshold"].c_str());
+            m_pool_params.breaker_reset = (std::max)(1, std::atoi(m_param_map["breaker_reset"].c_str()));
+            m_pool_params.health_check_interval = std::atoi(m_param_map["health_check_interval"].c_str());
+
+            if (m_param_map["catalog_backend"] == "local") {
+                m_catalog_index.reset(new catalog_index(m_param_map["catalog_index_path"]));
+            }
+
+            int torrent_info_cache_mb = std::atoi(m_param_map["torrent_info_cache_mb"].c_str());
+            if (torrent_info_cache_mb > 0) {
+                m_torrent_info_cache.reset(new torrent_info_cache(
+                    boost::uint64_t(torrent_info_cache_mb) * 1024 * 1024));
+            }
+        }
+
+        // workers are normally stopped in on_abort
+        ~mongodb_torrent_db_plugin()
+        {
+            _stop_workers();
         }
 
         void _set_param_or_default(string_map const& param_map, string const& key, string const& default_value)
@@ -97,219 +288,838 @@ namespace
             }
         }
 
+        /**
+         * Start the lookup workers and the filter worker.  They take
+         * database connections from a shared pool, since a connection can't
+         * be used by two threads at once.  The local catalog backend needs
+         * no connections.  The info hash filter is built right away;
+         * lookups aren't filtered until it's ready.
+         */
         virtual void added(boost::weak_ptr<aux::session_impl> s)
         {
             m_ses = s;
+            m_self = shared_from_this();
             boost::shared_ptr<aux::session_impl> ses;
             ses = m_ses.lock();
+            m_io_service = &ses->m_io_service;
+            if (!m_catalog_index) {
+                m_pool.reset(new mongodb_connection_pool(m_pool_params,
+                    boost::bind(&mongodb_torrent_db_plugin::_post_alert_from, m_self, _1, _2)));
+            }
 
-            // make initial connection to mongodb
-            try {
-                m_db_connection.connect(m_param_map["connection_string"]);
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::db_connect_ok, "mongodb connection okay"));
-                }
-            } catch (mongo::DBException &e) {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::db_connect_error, e.what()));
-                }
+            for (int i = 0; i < m_lookup_threads; ++i) {
+                m_workers.push_back(boost::shared_ptr<thread>(
+                    new thread(boost::bind(&mongodb_torrent_db_plugin::_lookup_worker, this))));
+            }
+
+            if (m_filter_fpr > 0) {
+                m_filter_rebuild_requested = true;
+                m_workers.push_back(boost::shared_ptr<thread>(
+                    new thread(boost::bind(&mongodb_torrent_db_plugin::_filter_worker, this))));
             }
         }
 
         /**
          * Function executed after session::find_torrent looks through internal
-         * torrent map for an info_hash.  If not found, perform lookup in mongodb
-         * for the torrent.  If found, activate the torrent in the session and set
-         * the torrent pointer before returning.
+         * torrent map for an info_hash.  If not found, queue a lookup in mongodb
+         * for the torrent on a worker thread and return without a torrent.  The
+         * torrent is activated on the network thread when the lookup finishes;
+         * incoming connections wait for it, see is_torrent_pending.
+         *
+         * Info hashes recently found in the database skip the query, and
+         * those recently not found aren't looked up at all.  Neither are
+         * info hashes missing from the catalog's info hash filter.
          *
          * use_extended_pool controls executing lookups in a backend torrent database
          *		via a plugin::on_find_torrent call.  This is important to avoid an
          *		infinite call loop when activating offline torrents.
+         *
+         * Info hashes outside of this session's shard are never looked up.
          */
         virtual boost::weak_ptr<torrent> on_find_torrent(sha1_hash const& info_hash, boost::weak_ptr<torrent> t_old, bool use_extended_pool)
         {
 #if MONGODB_PLUGIN_DEBUG
             std::cout << "on_find_torrent (" << info_hash << ", " << use_extended_pool << ")" << std::endl;
 #endif
-            boost::weak_ptr<torrent> t_new;
             try {
                 // Only look for torrent if one was not already found
-                if (use_extended_pool && t_old.expired()) {
-                    t_new = _find_and_add_torrent(info_hash);
-                } else {
-                    t_new = t_old;
+                if (use_extended_pool && t_old.expired() && _in_shard(info_hash)) {
+                    if (m_filter && !m_filter->find(info_hash)) {
+                        ++m_filter_rejects;
+                        return t_old;
+                    }
+                    cache_entry* entry = _cache_find(info_hash);
+                    if (!entry) {
+                        ++m_misses;
+                        _queue_lookup(info_hash, entry);
+                    } else if (entry->found) {
+                        ++m_positive_hits;
+                        _queue_lookup(info_hash, entry);
+                    } else {
+                        ++m_negative_hits;
+                    }
                 }
             } catch (std::exception& e) {
-                boost::shared_ptr<aux::session_impl> ses;
-                ses = m_ses.lock();
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    stringstream ss;
-                    ss << "ERROR: caught exception in on_find_torrent: " << e.what();
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::unclassified_error, ss.str()));
+                stringstream ss;
+                ss << "ERROR: caught exception in on_find_torrent: " << e.what();
+                _post_alert(mongodb_alert_code::unclassified_error, ss.str());
+            }
+            return t_old;
+        }
+
+        virtual bool is_torrent_pending(sha1_hash const& info_hash)
+        {
+            return m_pending.find(info_hash) != m_pending.end();
+        }
+
+        /**
+         * Messages from session::send_extension_message:
+         *      action=invalidate, info_hash=<hex>: drop the cache entries, e.g.
+         *          after the torrent was added to or removed from the catalog
+         *      action=clear_cache: drop all cache entries
+         *      action=refresh_filter: rebuild the info hash filter from the
+         *          torrent collection
+         *
+         * Invalidated info hashes are also added to the info hash filter,
+         * so new torrents can be found before the next rebuild.
+         */
+        virtual void on_extension_message(string_map const& message)
+        {
+            string_map::const_iterator action = message.find("action");
+            if (action == message.end()) return;
+
+            if (action->second == "invalidate") {
+                string_map::const_iterator ih_hex = message.find("info_hash");
+                sha1_hash info_hash;
+                if (ih_hex == message.end() || ih_hex->second.size() != 40
+                    || !from_hex(ih_hex->second.c_str(), 40, (char*)&info_hash[0])) {
+                    _post_alert(mongodb_alert_code::unclassified_error, "ERROR: invalid info hash in cache invalidate message");
+                    return;
                 }
-                t_new = t_old;
+                _cache_erase(info_hash);
+                if (m_torrent_info_cache) m_torrent_info_cache->erase(info_hash);
+                ++m_invalidations;
+                ++m_cache_generation;
+                if (m_filter_fpr > 0) {
+                    if (m_filter) m_filter->set(info_hash);
+                    mutex::scoped_lock l(m_queue_mutex);
+                    m_filter_additions.push_back(std::make_pair(info_hash, m_filter_builds_started));
+                }
+            } else if (action->second == "clear_cache") {
+                m_invalidations += m_cache.size();
+                m_cache.clear();
+                m_cache_lru.clear();
+                if (m_torrent_info_cache) m_torrent_info_cache->clear();
+                ++m_cache_generation;
+            } else if (action->second == "refresh_filter") {
+                if (m_filter_fpr <= 0) return;
+                mutex::scoped_lock l(m_queue_mutex);
+                m_filter_rebuild_requested = true;
+                m_queue_cond.signal_all(l);
+            }
+        }
+
+        /**
+         * Network thread.  Stop the workers while the session's io_service
+         * is still alive.  A worker in the middle of a query finishes it
+         * first, at most query_timeout seconds.
+         */
+        virtual void on_abort()
+        {
+            _stop_workers();
+        }
+
+        virtual void on_tick()
+        {
+            if (m_metrics_interval > 0 && ++m_metrics_ticks >= m_metrics_interval) {
+                m_metrics_ticks = 0;
+                _post_metrics();
+            }
+            if (m_cache_stats_interval > 0 && ++m_ticks >= m_cache_stats_interval) {
+                m_ticks = 0;
+                _post_cache_stats();
+            }
+        }
+
+        /**
+         * Lookup outcome counts and stage latencies since startup, as a
+         * JSON document in a lookup_metrics alert.  Lookups refused by the
+         * info hash filter or the negative cache never reach a stage.
+         */
+        void _post_metrics()
+        {
+            stringstream ss;
+            ss << "{\"outcomes\": {\"activated\": " << m_activated
+                << ", \"not_found\": " << m_not_found
+                << ", \"invalid_file\": " << m_invalid_file
+                << ", \"db_failure\": " << m_db_failures
+                << ", \"error\": " << m_errors
+                << ", \"filter_rejected\": " << m_filter_rejects
+                << ", \"negative_cache_hit\": " << m_negative_hits
+                << "}, \"pending\": " << m_pending.size()
+                << ", \"latency\": {\"db_query\": ";
+            m_query_latency.write_json(ss);
+            ss << ", \"torrent_parse\": ";
+            m_parse_latency.write_json(ss);
+            ss << ", \"add_torrent\": ";
+            m_add_latency.write_json(ss);
+            ss << ", \"total\": ";
+            m_total_latency.write_json(ss);
+            ss << "}}";
+            _post_alert(mongodb_alert_code::lookup_metrics, ss.str());
+        }
+
+        void _post_cache_stats()
+        {
+            stringstream ss;
+            ss << "Lookup cache size: " << m_cache.size()
+                << ", positive hits: " << m_positive_hits
+                << ", negative hits: " << m_negative_hits
+                << ", misses: " << m_misses
+                << ", evictions: " << m_evictions
+                << ", invalidations: " << m_invalidations;
+            if (m_filter) {
+                // lookups let through by the filter that weren't in the catalog
+                boost::uint64_t filtered = m_filter_rejects + m_filter_false_positives;
+                ss << ", filter rejects: " << m_filter_rejects
+                    << ", filter false positives: " << m_filter_false_positives
+                    << ", observed false positive rate: "
+                    << (filtered ? double(m_filter_false_positives) / filtered : 0.0);
+            }
+            if (m_torrent_info_cache) {
+                torrent_info_cache::stats ti_stats;
+                m_torrent_info_cache->get_stats(ti_stats);
+                ss << ", torrent_info cache size: " << ti_stats.entries
+                    << " (" << ti_stats.bytes / 1024 << " KiB)"
+                    << ", hits: " << ti_stats.hits
+                    << ", misses: " << ti_stats.misses
+                    << ", stale: " << ti_stats.stale
+                    << ", evictions: " << ti_stats.evictions;
+            }
+            if (m_pool) {
+                mongodb_connection_pool::stats pool_stats;
+                m_pool->get_stats(pool_stats);
+                ss << ", db connections: " << pool_stats.open
+                    << " (" << pool_stats.idle << " idle)"
+                    << ", connects: " << pool_stats.connects
+                    << ", connect failures: " << pool_stats.connect_failures
+                    << ", health check failures: " << pool_stats.health_check_failures
+                    << ", query failures: " << pool_stats.query_failures
+                    << ", circuit: " << (pool_stats.circuit_open ? "open" : "closed")
+                    << ", circuit opens: " << pool_stats.circuit_opens
+                    << ", refused: " << pool_stats.rejected;
             }
-            return t_new;
+            _post_alert(mongodb_alert_code::cache_stats, ss.str());
         }
 
     private:
         string_map m_param_map;
-        mongo::DBClientConnection m_db_connection;
+        string m_connection_string;
+        string m_torrentdb_ns;
+        string m_torrent_file_root;
         boost::weak_ptr<aux::session_impl> m_ses;
+        io_service* m_io_service;
+
+        // workers post to the network thread through a locked m_self, so
+        // a worker never calls shared_from_this on a plugin being released
+        boost::weak_ptr<mongodb_torrent_db_plugin> m_self;
+        int m_shard_index;
+        int m_shard_count;
+        int m_lookup_threads;
+
+        // database connections shared by the worker threads
+        mongodb_connection_pool::params m_pool_params;
+        boost::shared_ptr<mongodb_connection_pool> m_pool;
+
+        // local catalog backend, null when using mongodb
+        boost::shared_ptr<catalog_index> m_catalog_index;
+
+        // parsed torrent files shared by the worker threads, null if disabled
+        boost::shared_ptr<torrent_info_cache> m_torrent_info_cache;
+
+        // info hashes queued or being looked up.  Network thread only.
+        std::set<sha1_hash> m_pending;
+
+        // lookup cache, most recently used first.  Network thread only.
+        std::map<sha1_hash, cache_entry> m_cache;
+        std::list<sha1_hash> m_cache_lru;
+        int m_cache_size;
+        int m_cache_ttl;
+        int m_cache_negative_ttl;
+        int m_cache_generation;
+        int m_cache_stats_interval;
+        int m_ticks;
+        boost::uint64_t m_positive_hits;
+        boost::uint64_t m_negative_hits;
+        boost::uint64_t m_misses;
+        boost::uint64_t m_evictions;
+        boost::uint64_t m_invalidations;
+
+        // lookup metrics.  Network thread only.
+        int m_metrics_interval;
+        int m_metrics_ticks;
+        boost::uint64_t m_activated;
+        boost::uint64_t m_not_found;
+        boost::uint64_t m_invalid_file;
+        boost::uint64_t m_db_failures;
+        boost::uint64_t m_errors;
+        latency_histogram m_query_latency;
+        latency_histogram m_parse_latency;
+        latency_histogram m_add_latency;
+        latency_histogram m_total_latency; // queued to activated
+
+        // info hash filter and hashes added since the last rebuild was
+        // requested, each with the number of builds started before it was
+        // added.  Network thread only.
+        boost::shared_ptr<info_hash_filter> m_filter;
+        std::vector<std::pair<sha1_hash, int> > m_filter_additions;
+        double m_filter_fpr;
+        boost::uint64_t m_filter_rejects;
+        boost::uint64_t m_filter_false_positives;
+
+        // lookup queue shared with the workers
+        std::deque<boost::shared_ptr<lookup_result> > m_lookup_queue;
+        mutex m_queue_mutex;
+        condition m_queue_cond;
+        bool m_filter_rebuild_requested;
+        int m_filter_builds_started;
+        bool m_abort;
+        std::vector<boost::shared_ptr<thread> > m_workers;
 
         /**
-         *
+         * Each shard owns an equal range of the leading 32 bits of the info
+         * hash.  Must agree with seedbank.server.shard.get_shard_index.
+         */
+        bool _in_shard(sha1_hash const& info_hash) const
+        {
+            if (m_shard_count <= 1) return true;
+            boost::uint64_t prefix = (boost::uint64_t(info_hash[0]) << 24)
+                | (boost::uint64_t(info_hash[1]) << 16)
+                | (boost::uint64_t(info_hash[2]) << 8)
+                | boost::uint64_t(info_hash[3]);
+            return int((prefix * m_shard_count) >> 32) == m_shard_index;
+        }
+
+        /**
+         * Network thread.  Repeated requests for a torrent that is already
+         * being looked up share the one lookup.  `entry` is a cached
+         * database record or null.
+         */
+        void _queue_lookup(sha1_hash const& info_hash, cache_entry const* entry)
+        {
+            if (!m_pending.insert(info_hash).second) return;
+            boost::shared_ptr<lookup_result> result(new lookup_result(info_hash, m_cache_generation));
+            if (entry) {
+                result->cached = true;
+                result->ih_hex = entry->ih_hex;
+                result->data_root = entry->data_root;
+            }
+            mutex::scoped_lock l(m_queue_mutex);
+            m_lookup_queue.push_back(result);
+            m_queue_cond.signal_all(l);
+        }
+
+        /**
+         * Returns the unexpired cache entry for info_hash and marks it most
+         * recently used, or null.
+         */
+        cache_entry* _cache_find(sha1_hash const& info_hash)
+        {
+            std::map<sha1_hash, cache_entry>::iterator i = m_cache.find(info_hash);
+            if (i == m_cache.end()) return 0;
+            if (i->second.expires <= time_now()) {
+                m_cache_lru.erase(i->second.lru);
+                m_cache.erase(i);
+                return 0;
+            }
+            m_cache_lru.splice(m_cache_lru.begin(), m_cache_lru, i->second.lru);
+            return &i->second;
+        }
+
+        void _cache_insert(lookup_result const& result, bool found)
+        {
+            int ttl = found ? m_cache_ttl : m_cache_negative_ttl;
+            if (m_cache_size == 0 || ttl <= 0) return;
+            _cache_erase(result.info_hash);
+
+            m_cache_lru.push_front(result.info_hash);
+            cache_entry& entry = m_cache[result.info_hash];
+            entry.found = found;
+            entry.ih_hex = result.ih_hex;
+            entry.data_root = result.data_root;
+            entry.expires = time_now() + seconds(ttl);
+            entry.lru = m_cache_lru.begin();
+
+            while (int(m_cache.size()) > m_cache_size) {
+                m_cache.erase(m_cache_lru.back());
+                m_cache_lru.pop_back();
+                ++m_evictions;
+            }
+        }
+
+        void _cache_erase(sha1_hash const& info_hash)
+        {
+            std::map<sha1_hash, cache_entry>::iterator i = m_cache.find(info_hash);
+            if (i == m_cache.end()) return;
+            m_cache_lru.erase(i->second.lru);
+            m_cache.erase(i);
+        }
+
+        void _stop_workers()
+        {
+            {
+                mutex::scoped_lock l(m_queue_mutex);
+                m_abort = true;
+                m_queue_cond.signal_all(l);
+            }
+            if (m_pool) m_pool->abort();
+            for (std::vector<boost::shared_ptr<thread> >::iterator i = m_workers.begin()
+                , end(m_workers.end()); i != end; ++i)
+            {
+                (*i)->join();
+            }
+            m_workers.clear();
+        }
+
+        /**
+         * Worker thread.  Runs the blocking database query and torrent file
+         * parse, then hands the result to the network thread.
+         */
+        void _lookup_worker()
+        {
+            for (;;) {
+                boost::shared_ptr<lookup_result> result;
+                {
+                    mutex::scoped_lock l(m_queue_mutex);
+                    while (m_lookup_queue.empty() && !m_abort) m_queue_cond.wait(l);
+                    if (m_abort) return;
+                    result = m_lookup_queue.front();
+                    m_lookup_queue.pop_front();
+                }
+
+                try {
+                    _look_up_torrent(*result);
+                } catch (std::exception& e) {
+                    stringstream ss;
+                    ss << "ERROR: caught exception in torrent lookup: " << e.what();
+                    result->code = mongodb_alert_code::unclassified_error;
+                    result->msg = ss.str();
+                }
+                boost::shared_ptr<mongodb_torrent_db_plugin> self = _lock_for_post();
+                if (!self) return;
+                m_io_service->post(boost::bind(&mongodb_torrent_db_plugin::_on_lookup_done, self, result));
+            }
+        }
+
+        /**
+         * Filter worker thread.  Rebuilds the info hash filter from the
+         * torrent collection whenever one is requested.  A rebuild that
+         * fails is retried after the circuit breaker reset interval.
+         */
+        void _filter_worker()
+        {
+            for (;;) {
+                int generation;
+                {
+                    mutex::scoped_lock l(m_queue_mutex);
+                    while (!m_filter_rebuild_requested && !m_abort) m_queue_cond.wait(l);
+                    if (m_abort) return;
+                    m_filter_rebuild_requested = false;
+                    generation = ++m_filter_builds_started;
+                }
+
+                boost::shared_ptr<info_hash_filter> filter;
+                ptime start = time_now_hires();
+                if (m_catalog_index) {
+                    filter = _build_local_filter();
+                } else {
+                    mongodb_connection_pool::connection_ptr c = m_pool->acquire();
+                    if (c) {
+                        try {
+                            filter = _build_filter(*c);
+                            m_pool->release(c, true);
+                        } catch (std::exception& e) {
+                            m_pool->release(c, !c->isFailed());
+                            stringstream ss;
+                            ss << "ERROR: caught exception building info hash filter: " << e.what();
+                            _post_alert_async(mongodb_alert_code::unclassified_error, ss.str());
+                        }
+                    }
+                }
+
+                if (!filter) {
+                    if (_wait_for_abort(m_pool_params.breaker_reset)) return;
+                    mutex::scoped_lock l(m_queue_mutex);
+                    m_filter_rebuild_requested = true;
+                    continue;
+                }
+
+                int elapsed = total_milliseconds(time_now_hires() - start);
+                boost::shared_ptr<mongodb_torrent_db_plugin> self = _lock_for_post();
+                if (!self) return;
+                m_io_service->post(boost::bind(&mongodb_torrent_db_plugin::_on_filter_built, self, filter, generation, elapsed));
+            }
+        }
+
+        /**
+         * Worker thread.  Sleep for up to `secs` seconds, returns true if the
+         * plugin is shutting down.
+         */
+        bool _wait_for_abort(int secs)
+        {
+            for (int i = 0; i < secs * 10; ++i) {
+                {
+                    mutex::scoped_lock l(m_queue_mutex);
+                    if (m_abort) return true;
+                }
+                libtorrent::sleep(100);
+            }
+            mutex::scoped_lock l(m_queue_mutex);
+            return m_abort;
+        }
+
+        /**
+         * Filter worker thread.  Sized with headroom for torrents added
+         * before the next rebuild.
+         */
+        boost::shared_ptr<info_hash_filter> _build_filter(mongo::DBClientConnection& db_connection)
+        {
+            int count = int(db_connection.count(m_torrentdb_ns));
+            boost::shared_ptr<info_hash_filter> filter(new info_hash_filter(
+                (std::max)(1024, count + count / 4), m_filter_fpr));
+
+            mongo::BSONObj fields = BSON("info_hash" << 1);
+            std::auto_ptr<mongo::DBClientCursor> cursor = db_connection.query(
+                m_torrentdb_ns, mongo::Query(), 0, 0, &fields);
+            while (cursor->more()) {
+                mongo::BSONObj record = cursor->next();
+                if (!record["info_hash"].ok()) continue;
+                string ih_hex = record["info_hash"].str();
+                sha1_hash info_hash;
+                if (ih_hex.size() != 40
+                    || !from_hex(ih_hex.c_str(), 40, (char*)&info_hash[0])) continue;
+                filter->set(info_hash);
+            }
+            return filter;
+        }
+
+        /**
+         * Filter worker thread.  Null if the catalog index can't be read.
+         */
+        boost::shared_ptr<info_hash_filter> _build_local_filter()
+        {
+            error_code ec;
+            int count = m_catalog_index->count(ec);
+            boost::shared_ptr<info_hash_filter> filter(new info_hash_filter(
+                (std::max)(1024, count + count / 4), m_filter_fpr));
+            if (!ec) {
+                m_catalog_index->for_each(boost::bind(&info_hash_filter::set, filter.get(), _1), ec);
+            }
+            if (ec) {
+                stringstream ss;
+                ss << "ERROR: unable to read catalog index " << m_catalog_index->path() << ": " << ec.message();
+                _post_alert_async(mongodb_alert_code::unclassified_error, ss.str());
+                filter.reset();
+            }
+            return filter;
+        }
+
+        /**
+         * Network thread.  Swap in the new filter, keeping info hashes
+         * added since it started.  Additions from before the build started
+         * are in the catalog it read and can be dropped; later ones wait
+         * for a build that started after them, so a refresh requested
+         * while a build is running never loses one.
          */
-        virtual boost::weak_ptr<torrent> _find_and_add_torrent(sha1_hash const& info_hash)
+        void _on_filter_built(boost::shared_ptr<info_hash_filter> filter, int generation, int elapsed)
+        {
+            std::vector<std::pair<sha1_hash, int> > remaining;
+            for (std::vector<std::pair<sha1_hash, int> >::iterator i = m_filter_additions.begin()
+                , end(m_filter_additions.end()); i != end; ++i)
+            {
+                filter->set(i->first);
+                if (i->second >= generation) remaining.push_back(*i);
+            }
+            m_filter_additions.swap(remaining);
+            m_filter = filter;
+
+            stringstream ss;
+            ss << "Info hash filter rebuilt in " << elapsed << " ms"
+                << ", torrents: " << filter->count()
+                << ", bits: " << filter->num_bits()
+                << ", hashes: " << filter->num_hashes()
+                << ", estimated false positive rate: " << filter->estimated_false_positive_rate();
+            _post_alert(mongodb_alert_code::filter_rebuilt, ss.str());
+        }
+
+        /**
+         * Worker thread.  Fills in the torrent_info and data root, or the
+         * error code and message.
+         */
+        void _look_up_torrent(lookup_result& result)
         {
 #if MONGODB_PLUGIN_DEBUG
-            std::cout << "_find_and_add_torrent (" << info_hash << ")" << std::endl;
+            std::cout << "_look_up_torrent (" << result.info_hash << ")" << std::endl;
 #endif
-            boost::weak_ptr<torrent> new_torrent;
+            ptime start = time_now_hires();
+            if (!result.cached && m_catalog_index) {
+                _look_up_local(result);
+                result.query_us = total_microseconds(time_now_hires() - start);
+                if (result.code) return;
+            } else if (!result.cached) {
+                mongo::BSONObj torrent_record = _look_up_info_hash(result);
+                result.query_us = total_microseconds(time_now_hires() - start);
+                if (result.code) return;
+
+                if (torrent_record["info_hash"].ok()) {
+                    result.ih_hex = torrent_record["info_hash"].str();
+                }
+                if (torrent_record["data_root"].ok()) {
+                    result.data_root = torrent_record["data_root"].str();
+                }
+            }
+
+            if (!result.ih_hex.empty()) {
+                start = time_now_hires();
+                result.ti = _convert_to_torrent_info(result);
+                result.parse_us = total_microseconds(time_now_hires() - start);
+            }
+
+            if (!result.code && !(result.ti && result.ti.get())) {
+                stringstream ss;
+                ss << "ERROR: got null torrent_info from look_up_torrent: " << result.ih_hex;
+                result.code = mongodb_alert_code::unclassified_error;
+                result.msg = ss.str();
+            }
+        }
+
+        /**
+         * Network thread.  Update the cache, activate the torrent and let
+         * any connections waiting for it continue.
+         */
+        void _on_lookup_done(boost::shared_ptr<lookup_result> result)
+        {
+            m_pending.erase(result->info_hash);
             boost::shared_ptr<aux::session_impl> ses;
             ses = m_ses.lock();
+            if (!ses) return;
 
-            mongo::BSONObj torrent_record;
-            boost::intrusive_ptr<torrent_info> ti;
-            torrent_record = _look_up_info_hash(ses, info_hash);
-
-            string ih_hex;
-            string data_root;
-            if (torrent_record["info_hash"].ok()) {
-                ih_hex = torrent_record["info_hash"].str();
+            if (result->cache_generation == m_cache_generation) {
+                if (result->code == mongodb_alert_code::torrent_not_found) {
+                    _cache_insert(*result, false);
+                } else if (result->code == 0 && !result->cached) {
+                    _cache_insert(*result, true);
+                }
+            }
+            if (result->code == mongodb_alert_code::torrent_not_found && m_filter) {
+                ++m_filter_false_positives;
             }
-            if (torrent_record["data_root"].ok()) {
-                data_root = torrent_record["data_root"].str();
+            if (result->code && result->cached) {
+                // stale record, e.g. the torrent file was removed
+                _cache_erase(result->info_hash);
             }
 
-            if (!ih_hex.empty()) {
-                ti = _convert_to_torrent_info(ses, ih_hex);
+            if (result->query_us >= 0) m_query_latency.record(result->query_us);
+            if (result->parse_us >= 0) m_parse_latency.record(result->parse_us);
+
+            if (result->code) {
+                _count_failure(result->code);
+                _post_alert(result->code, result->msg);
+            } else if (ses->m_torrents.find(result->info_hash) == ses->m_torrents.end()) {
+                ptime start = time_now_hires();
+                bool activated = _add_found_torrent(ses, *result);
+                ptime now = time_now_hires();
+                m_add_latency.record(total_microseconds(now - start));
+                if (activated) {
+                    ++m_activated;
+                    m_total_latency.record(total_microseconds(now - result->queued));
+                } else {
+                    ++m_errors;
+                }
+            }
+            ses->resume_parked_connections(result->info_hash);
+        }
+
+        void _count_failure(int code)
+        {
+            switch (code) {
+                case mongodb_alert_code::torrent_not_found: ++m_not_found; break;
+                case mongodb_alert_code::invalid_torrent_file: ++m_invalid_file; break;
+                case mongodb_alert_code::db_connection_failed: ++m_db_failures; break;
+                default: ++m_errors; break;
             }
+        }
 
-            if (ti && ti.get()) {
+        /**
+         * Returns true if the torrent was added and started
+         */
+        bool _add_found_torrent(boost::shared_ptr<aux::session_impl> ses, lookup_result const& result)
+        {
 #if MONGODB_PLUGIN_DEBUG
             std::cout << "found torrent, about to add to session" << std::endl;
 #endif
-                torrent_handle th = _activate_torrent(ses, ti, data_root);
+            torrent_handle th = _activate_torrent(ses, result.ti, result.data_root);
 
-                // Seems like there should be a way to get a torrent from a torrent_handle,
-                // but there's not.
-                std::map<sha1_hash, boost::shared_ptr<torrent> >::iterator i = ses->m_torrents.find(info_hash);
-                if (i != ses->m_torrents.end()) {
-                    new_torrent = i->second;
-                    boost::shared_ptr<torrent> t_shared = new_torrent.lock();
+            // Seems like there should be a way to get a torrent from a torrent_handle,
+            // but there's not.
+            std::map<sha1_hash, boost::shared_ptr<torrent> >::iterator i = ses->m_torrents.find(result.info_hash);
+            if (i != ses->m_torrents.end()) {
+                boost::shared_ptr<torrent> t_shared = i->second;
 
-                    // disable communication with trackers by clearing the list
-                    std::vector<announce_entry> tracker_list = std::vector<announce_entry>();
-                    t_shared->replace_trackers(tracker_list);
+                // disable communication with trackers by clearing the list
+                std::vector<announce_entry> tracker_list = std::vector<announce_entry>();
+                t_shared->replace_trackers(tracker_list);
 
-                    // force into seeding state
-                    t_shared->completed();
+                // force into seeding state
+                t_shared->completed();
 
-                    // setup complete, enable connections
-                    // allow_peers = true, graceful_pause_mode = false
-                    t_shared->set_allow_peers(true, false);
+                // setup complete, enable connections
+                // allow_peers = true, graceful_pause_mode = false
+                t_shared->set_allow_peers(true, false);
 
-                    if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                    {
-                        stringstream ss;
-                        ss << "Activated new torrent: " << ih_hex;
-                        ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::torrent_activated, ss.str()));
-                    }
-                } else {
-                    if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                    {
-                        stringstream ss;
-                        ss << "ERROR: didn't find torrent in ses.m_torrents: " << ih_hex;
-                        ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::unclassified_error, ss.str()));
-                    }
-                }
+                stringstream ss;
+                ss << "Activated new torrent: " << result.ih_hex;
+                _post_alert(mongodb_alert_code::torrent_activated, ss.str());
+                return true;
             } else {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    stringstream ss;
-                    ss << "ERROR: got null torrent_info from look_up_torrent: " << ih_hex;
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::unclassified_error, ss.str()));
-                }
+                stringstream ss;
+                ss << "ERROR: didn't find torrent in ses.m_torrents: " << result.ih_hex;
+                _post_alert(mongodb_alert_code::unclassified_error, ss.str());
+                return false;
             }
-
-            return new_torrent;
         }
 
         /**
-         * Query mongodb for given info_hash.  Return BSONObj if found, null otherwise.
+         * Query mongodb for the info_hash in `result`.  Return BSONObj if
+         * found, otherwise set the result's error code.  A query that fails
+         * with a connection error is retried once on another connection.
+         * Worker thread.
          */
-        virtual mongo::BSONObj _look_up_info_hash(
-            boost::shared_ptr<aux::session_impl> ses,
-            sha1_hash const& info_hash)
+        virtual mongo::BSONObj _look_up_info_hash(lookup_result& result)
         {
             mongo::BSONObj torrent_record;
             char ih_hex[41];
-            to_hex((char const*)&info_hash[0], sha1_hash::size, ih_hex);
+            to_hex((char const*)&result.info_hash[0], sha1_hash::size, ih_hex);
 
-            if (m_db_connection.isFailed()) {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
+            for (int attempt = 0; attempt < 2; ++attempt) {
+                result.code = 0;
+                result.msg.clear();
+
+                mongodb_connection_pool::connection_ptr c = m_pool->acquire();
+                if (!c) {
                     stringstream ss;
-                    ss << "Connection in failed state: " << ih_hex;
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::db_connection_failed, ss.str()));
+                    ss << "Database unavailable, lookup refused: " << ih_hex;
+                    result.code = mongodb_alert_code::db_connection_failed;
+                    result.msg = ss.str();
+                    break;
                 }
-            } else {
-                std::auto_ptr<mongo::DBClientCursor> cursor = m_db_connection.query(m_param_map["torrentdb_ns"], QUERY("info_hash" << ih_hex));
-                bool found_results = false;
 
-                while (cursor->more()) {
-                    // TODO: verify no more than one record returned?
-                    torrent_record = cursor->next();
-                    found_results = true;
-                }
+                try {
+                    std::auto_ptr<mongo::DBClientCursor> cursor = c->query(m_torrentdb_ns, QUERY("info_hash" << ih_hex));
+                    if (!cursor.get()) {
+                        // the driver returns no cursor when the send fails
+                        m_pool->release(c, false);
+                        stringstream ss;
+                        ss << "Connection failed: " << ih_hex;
+                        result.code = mongodb_alert_code::db_connection_failed;
+                        result.msg = ss.str();
+                        continue;
+                    }
 
-                if (!found_results) {
-                    if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                    {
+                    bool found_results = false;
+                    while (cursor->more()) {
+                        // TODO: verify no more than one record returned?
+                        torrent_record = cursor->next().getOwned();
+                        found_results = true;
+                    }
+                    m_pool->release(c, true);
+
+                    if (!found_results) {
                         stringstream ss;
                         ss << "Torrent not found: " << ih_hex;
-                        ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::torrent_not_found, ss.str()));
+                        result.code = mongodb_alert_code::torrent_not_found;
+                        result.msg = ss.str();
                     }
+                    break;
+                } catch (mongo::DBException& e) {
+                    // socket errors and timeouts leave the connection failed
+                    bool failed = c->isFailed();
+                    m_pool->release(c, !failed);
+                    if (!failed) throw;
+                    stringstream ss;
+                    ss << "Connection failed (" << e.what() << "): " << ih_hex;
+                    result.code = mongodb_alert_code::db_connection_failed;
+                    result.msg = ss.str();
                 }
             }
             return torrent_record;
         }
 
         /**
-         * Create torrent_info object for given info_hash.  This comes after a
-         * successful lookup in mongodb.
+         * Look up the info_hash in `result` in the local catalog index and
+         * fill in the info hash and data root, or the error code.  Worker
+         * thread.
          */
-        virtual boost::intrusive_ptr<torrent_info> _convert_to_torrent_info(boost::shared_ptr<aux::session_impl> ses, string const& ih_hex)
+        void _look_up_local(lookup_result& result)
         {
-            // TODO: assert valid info hash
-            if (ih_hex.empty()) {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    stringstream ss;
-                    ss << "ERROR: got empty ih_hex in _convert_to_torrent_info";
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::unclassified_error, ss.str()));
-                }
+            char ih_hex[41];
+            to_hex((char const*)&result.info_hash[0], sha1_hash::size, ih_hex);
+
+            catalog_index::record record;
+            error_code ec;
+            if (m_catalog_index->find(result.info_hash, record, ec)) {
+                result.ih_hex = ih_hex;
+                result.data_root = record.data_root;
+                return;
             }
 
+            stringstream ss;
+            if (ec) {
+                ss << "Unable to read catalog index " << m_catalog_index->path() << " (" << ec.message() << "): " << ih_hex;
+                result.code = mongodb_alert_code::db_connection_failed;
+            } else {
+                ss << "Torrent not found: " << ih_hex;
+                result.code = mongodb_alert_code::torrent_not_found;
+            }
+            result.msg = ss.str();
+        }
+
+        /**
+         * Create torrent_info object for the result's info hash.  This comes
+         * after a successful lookup in mongodb.  Torrents activated again
+         * after expiring are usually in the torrent_info cache, unless the
+         * torrent file changed since.  Worker thread.
+         */
+        virtual boost::intrusive_ptr<torrent_info> _convert_to_torrent_info(lookup_result& result)
+        {
+            string const& ih_hex = result.ih_hex;
             stringstream torrent_file;
             string subpath = _get_torrent_subpath(ih_hex);
 
-            torrent_file << m_param_map["torrent_file_root"] << subpath << "/" << ih_hex << ".torrent";
+            torrent_file << m_torrent_file_root << subpath << "/" << ih_hex << ".torrent";
 
             boost::intrusive_ptr<torrent_info> ti;
+            file_status st;
+            error_code ec;
+            if (m_torrent_info_cache) {
+                stat_file(torrent_file.str(), &st, ec);
+                if (!ec) {
+                    ti = m_torrent_info_cache->find(result.info_hash, st.mtime);
+                    if (ti) return ti;
+                }
+            }
+
             try {
                 ti = boost::intrusive_ptr<torrent_info>(new torrent_info(torrent_file.str()));
-            } catch (invalid_torrent_file e) {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    stringstream ss;
-                    ss << "Exception from new torrent_info (" << e.what() << ") when adding torrent " << ih_hex << " (" << torrent_file.str() << ")";
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::invalid_torrent_file, ss.str()));
+                if (m_torrent_info_cache && !ec) {
+                    m_torrent_info_cache->insert(result.info_hash, st.mtime, st.file_size, ti);
+                    ti = boost::intrusive_ptr<torrent_info>(new torrent_info(*ti));
                 }
+            } catch (invalid_torrent_file e) {
+                stringstream ss;
+                ss << "Exception from new torrent_info (" << e.what() << ") when adding torrent " << ih_hex << " (" << torrent_file.str() << ")";
+                result.code = mongodb_alert_code::invalid_torrent_file;
+                result.msg = ss.str();
             }
 
             return ti;
@@ -351,17 +1161,63 @@ namespace
 
             // TODO: What to do with ec > no_error here?
             if (ec) {
-                if (ses->m_alerts.should_post<mongodb_plugin_alert>())
-                {
-                    stringstream ss;
-                    ss << "ERROR: ec from session_impl::add_torrent: " << ec;
-                    ses->m_alerts.post_alert(mongodb_plugin_alert(mongodb_alert_code::unclassified_error, ss.str()));
-                }
+                stringstream ss;
+                ss << "ERROR: ec from session_impl::add_torrent: " << ec;
+                _post_alert(mongodb_alert_code::unclassified_error, ss.str());
             }
 
             return th;
         }
 
+        /**
+         * Network thread
+         */
+        void _post_alert(int code, string const& msg)
+        {
+            boost::shared_ptr<aux::session_impl> ses;
+            ses = m_ses.lock();
+            if (ses && ses->m_alerts.should_post<mongodb_plugin_alert>())
+            {
+                ses->m_alerts.post_alert(mongodb_plugin_alert(code, msg));
+            }
+        }
+
+        /**
+         * Worker threads post alerts through the network thread
+         */
+        void _post_alert_async(int code, string const& msg)
+        {
+            boost::shared_ptr<mongodb_torrent_db_plugin> self = _lock_for_post();
+            if (!self) return;
+            m_io_service->post(boost::bind(&mongodb_torrent_db_plugin::_post_alert, self, code, msg));
+        }
+
+        /**
+         * Connection pool alert callback.  The pool only holds a weak
+         * reference to the plugin.
+         */
+        static void _post_alert_from(boost::weak_ptr<mongodb_torrent_db_plugin> plugin, int code, string const& msg)
+        {
+            boost::shared_ptr<mongodb_torrent_db_plugin> p = plugin.lock();
+            if (p) p->_post_alert_async(code, msg);
+        }
+
+        /**
+         * Worker threads.  Returns the plugin to bind into a handler posted
+         * to the network thread, or nothing once shutdown has started.
+         * on_abort joins the workers before the session stops its
+         * io_service, so the io_service outlives every post.
+         */
+        boost::shared_ptr<mongodb_torrent_db_plugin> _lock_for_post()
+        {
+            {
+                mutex::scoped_lock l(m_queue_mutex);
+                if (m_abort) return boost::shared_ptr<mongodb_torrent_db_plugin>();
+            }
+            if (m_ses.expired()) return boost::shared_ptr<mongodb_torrent_db_plugin>();
+            return m_self.lock();
+        }
+
     };
 } }
 
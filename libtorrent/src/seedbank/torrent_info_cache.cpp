@@ -0,0 +1,120 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#include "libtorrent/pch.hpp"
+#include "libtorrent/seedbank/torrent_info_cache.hpp"
+#include "libtorrent/file_storage.hpp" // internal_file_entry
+
+namespace libtorrent
+{
+    torrent_info_cache::torrent_info_cache(boost::uint64_t max_bytes)
+        : m_max_bytes(max_bytes)
+        , m_bytes(0)
+        , m_hits(0)
+        , m_misses(0)
+        , m_stale(0)
+        , m_evictions(0)
+    {}
+
+    /**
+     * The copy is made without holding the lock
+     */
+    boost::intrusive_ptr<torrent_info> torrent_info_cache::find(sha1_hash const& info_hash, std::time_t mtime)
+    {
+        boost::intrusive_ptr<torrent_info> cached;
+        {
+            mutex::scoped_lock l(m_mutex);
+            std::map<sha1_hash, entry>::iterator i = m_entries.find(info_hash);
+            if (i == m_entries.end()) {
+                ++m_misses;
+                return boost::intrusive_ptr<torrent_info>();
+            }
+            if (i->second.mtime != mtime) {
+                ++m_misses;
+                ++m_stale;
+                _erase(i);
+                return boost::intrusive_ptr<torrent_info>();
+            }
+            ++m_hits;
+            m_lru.splice(m_lru.begin(), m_lru, i->second.lru);
+            cached = i->second.ti;
+        }
+        return boost::intrusive_ptr<torrent_info>(new torrent_info(*cached));
+    }
+
+    /**
+     * Memory use is estimated from the torrent file size, which covers the
+     * info section buffer, plus the per file entries.
+     */
+    void torrent_info_cache::insert(sha1_hash const& info_hash, std::time_t mtime
+        , boost::uint64_t file_size, boost::intrusive_ptr<torrent_info> const& ti)
+    {
+        boost::uint64_t bytes = file_size
+            + boost::uint64_t(ti->num_files()) * sizeof(internal_file_entry);
+        if (bytes > m_max_bytes) return;
+
+        mutex::scoped_lock l(m_mutex);
+        std::map<sha1_hash, entry>::iterator i = m_entries.find(info_hash);
+        if (i != m_entries.end()) _erase(i);
+
+        m_lru.push_front(info_hash);
+        entry& e = m_entries[info_hash];
+        e.ti = ti;
+        e.mtime = mtime;
+        e.bytes = bytes;
+        e.lru = m_lru.begin();
+        m_bytes += bytes;
+
+        while (m_bytes > m_max_bytes) {
+            _erase(m_entries.find(m_lru.back()));
+            ++m_evictions;
+        }
+    }
+
+    void torrent_info_cache::erase(sha1_hash const& info_hash)
+    {
+        mutex::scoped_lock l(m_mutex);
+        std::map<sha1_hash, entry>::iterator i = m_entries.find(info_hash);
+        if (i != m_entries.end()) _erase(i);
+    }
+
+    void torrent_info_cache::clear()
+    {
+        mutex::scoped_lock l(m_mutex);
+        m_entries.clear();
+        m_lru.clear();
+        m_bytes = 0;
+    }
+
+    void torrent_info_cache::get_stats(stats& s) const
+    {
+        mutex::scoped_lock l(m_mutex);
+        s.entries = int(m_entries.size());
+        s.bytes = m_bytes;
+        s.hits = m_hits;
+        s.misses = m_misses;
+        s.stale = m_stale;
+        s.evictions = m_evictions;
+    }
+
+    void torrent_info_cache::_erase(std::map<sha1_hash, entry>::iterator i)
+    {
+        m_bytes -= i->second.bytes;
+        m_lru.erase(i->second.lru);
+        m_entries.erase(i);
+    }
+}
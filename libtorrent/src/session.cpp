@@ -485,6 +485,11 @@ namespace libtorrent
     {
         TORRENT_ASYNC_CALL2(add_ses_extension, func, param_map);
     }
+
+    void session::send_extension_message(string_map const& message)
+    {
+        TORRENT_ASYNC_CALL1(send_extension_message, message);
+    }
     /* seed bank -- end mod */
 #endif
 
@@ -1042,6 +1047,13 @@ namespace libtorrent
 		m_impl->pop_alerts(alerts);
 	}
 
+    /* seed bank -- begin mod */
+    boost::uint64_t session::num_dropped_alerts() const
+    {
+        return m_impl->num_dropped_alerts();
+    }
+    /* seed bank -- end mod */
+
 	alert const* session::wait_for_alert(time_duration max_wait)
 	{
 		return m_impl->wait_for_alert(max_wait);
@@ -1671,6 +1671,18 @@ namespace aux {
         std::string type = typeid(ext).name();
         add_ses_extension(ext);
     }
+
+    void session_impl::send_extension_message(string_map const& message)
+    {
+        TORRENT_ASSERT(is_network_thread());
+        for (ses_extension_list_t::const_iterator extension_iter = m_ses_extensions.begin()
+            , end(m_ses_extensions.end()); extension_iter != end; ++extension_iter)
+        {
+            TORRENT_TRY {
+                (*extension_iter)->on_extension_message(message);
+            } TORRENT_CATCH(std::exception& e) {}
+        }
+    }
     /* seed bank -- end mod */
 #endif
 
@@ -1770,6 +1782,19 @@ namespace aux {
 #endif
 		// abort the main thread
 		m_abort = true;
+
+		/* seed bank -- begin mod */
+#ifndef TORRENT_DISABLE_EXTENSIONS
+		for (ses_extension_list_t::const_iterator i = m_ses_extensions.begin()
+			, end(m_ses_extensions.end()); i != end; ++i)
+		{
+			TORRENT_TRY {
+				(*i)->on_abort();
+			} TORRENT_CATCH(std::exception&) {}
+		}
+#endif
+		/* seed bank -- end mod */
+
 		error_code ec;
 #if TORRENT_USE_I2P
 		m_i2p_conn.close(ec);
@@ -4787,6 +4812,47 @@ retry:
     {
         return find_torrent(info_hash, true);
 	}
+
+    bool session_impl::is_torrent_pending(sha1_hash const& info_hash) const
+    {
+#ifndef TORRENT_DISABLE_EXTENSIONS
+        for (ses_extension_list_t::const_iterator extension_iter = m_ses_extensions.begin()
+            , end(m_ses_extensions.end()); extension_iter != end; ++extension_iter)
+        {
+            if ((*extension_iter)->is_torrent_pending(info_hash)) return true;
+        }
+#endif
+        return false;
+    }
+
+    void session_impl::park_connection(sha1_hash const& info_hash, peer_connection* p)
+    {
+        TORRENT_ASSERT(is_network_thread());
+        m_parked_connections.insert(std::make_pair(info_hash, boost::intrusive_ptr<peer_connection>(p)));
+    }
+
+    /**
+     * Called by a plugin on the network thread once a pending lookup has
+     * finished, whether or not the torrent was activated.  Connections that
+     * still can't find their torrent are disconnected by attach_to_torrent.
+     */
+    void session_impl::resume_parked_connections(sha1_hash const& info_hash)
+    {
+        TORRENT_ASSERT(is_network_thread());
+        std::pair<parked_connection_map::iterator, parked_connection_map::iterator> range
+            = m_parked_connections.equal_range(info_hash);
+        std::vector<boost::intrusive_ptr<peer_connection> > parked;
+        for (parked_connection_map::iterator i = range.first; i != range.second; ++i)
+            parked.push_back(i->second);
+        m_parked_connections.erase(range.first, range.second);
+
+        for (std::vector<boost::intrusive_ptr<peer_connection> >::iterator i = parked.begin()
+            , end(parked.end()); i != end; ++i)
+        {
+            if ((*i)->is_disconnecting()) continue;
+            (*i)->resume_attach();
+        }
+    }
     /* seed bank -- end mod */
 
 	boost::weak_ptr<torrent> session_impl::find_torrent(std::string const& uuid)
@@ -5379,6 +5445,10 @@ retry:
 		s.num_unchoked = m_num_unchoked;
 		s.allowed_upload_slots = m_allowed_upload_slots;
 
+		/* seed bank -- begin mod */
+		s.num_torrents = (int)m_torrents.size();
+		/* seed bank -- end mod */
+
 		s.total_redundant_bytes = m_total_redundant_bytes;
 		s.total_failed_bytes = m_total_failed_bytes;
 
@@ -5859,6 +5929,13 @@ retry:
 		m_alerts.get_all(alerts);
 	}
 
+    /* seed bank -- begin mod */
+    boost::uint64_t session_impl::num_dropped_alerts() const
+    {
+        return m_alerts.num_dropped_alerts();
+    }
+    /* seed bank -- end mod */
+
 	alert const* session_impl::wait_for_alert(time_duration max_wait)
 	{
 		return m_alerts.wait_for_alert(max_wait);
@@ -37,6 +37,12 @@ POSSIBILITY OF SUCH DAMAGE.
 #include <kernel/OS.h>
 #endif
 
+/* seed bank -- begin mod */
+#ifdef BOOST_HAS_PTHREADS
+#include <sys/time.h> // for gettimeofday
+#endif
+/* seed bank -- end mod */
+
 namespace libtorrent
 {
 	void sleep(int milliseconds)
@@ -69,6 +75,23 @@ namespace libtorrent
 		pthread_cond_wait(&m_cond, (::pthread_mutex_t*)&l.mutex());
 	}
 
+	/* seed bank -- begin mod */
+	void condition::timed_wait(mutex::scoped_lock& l, int milliseconds)
+	{
+		TORRENT_ASSERT(l.locked());
+		// pthread_cond_timedwait takes an absolute deadline
+		// against the realtime clock
+		timeval now;
+		gettimeofday(&now, 0);
+		boost::int64_t nsec = boost::int64_t(now.tv_usec) * 1000
+			+ boost::int64_t(milliseconds) * 1000000;
+		timespec deadline;
+		deadline.tv_sec = now.tv_sec + time_t(nsec / 1000000000);
+		deadline.tv_nsec = long(nsec % 1000000000);
+		pthread_cond_timedwait(&m_cond, (::pthread_mutex_t*)&l.mutex(), &deadline);
+	}
+	/* seed bank -- end mod */
+
 	void condition::signal_all(mutex::scoped_lock& l)
 	{
 		TORRENT_ASSERT(l.locked());
@@ -96,6 +119,18 @@ namespace libtorrent
 		--m_num_waiters;
 	}
 
+	/* seed bank -- begin mod */
+	void condition::timed_wait(mutex::scoped_lock& l, int milliseconds)
+	{
+		TORRENT_ASSERT(l.locked());
+		++m_num_waiters;
+		l.unlock();
+		WaitForSingleObject(m_sem, milliseconds);
+		l.lock();
+		--m_num_waiters;
+	}
+	/* seed bank -- end mod */
+
 	void condition::signal_all(mutex::scoped_lock& l)
 	{
 		TORRENT_ASSERT(l.locked());
@@ -123,6 +158,19 @@ namespace libtorrent
 		--m_num_waiters;
 	}
 
+	/* seed bank -- begin mod */
+	void condition::timed_wait(mutex::scoped_lock& l, int milliseconds)
+	{
+		TORRENT_ASSERT(l.locked());
+		++m_num_waiters;
+		l.unlock();
+		acquire_sem_etc(m_sem, 1, B_RELATIVE_TIMEOUT
+			, bigtime_t(milliseconds) * 1000);
+		l.lock();
+		--m_num_waiters;
+	}
+	/* seed bank -- end mod */
+
 	void condition::signal_all(mutex::scoped_lock& l)
 	{
 		TORRENT_ASSERT(l.locked());
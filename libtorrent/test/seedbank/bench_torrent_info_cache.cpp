@@ -0,0 +1,227 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Activation latency under torrent churn, with and without the parsed
+ * torrent_info cache.  Mirrors the plugin's _convert_to_torrent_info:
+ * stat the torrent file, try the cache, otherwise read and parse it and
+ * cache a copy.
+ *
+ * Torrents are activated in a skewed order, so popular torrents are
+ * evicted and reactivated often, like TorrentManager expiring idle
+ * torrents that peers come back for.
+ *
+ *     bench_torrent_info_cache [torrents] [files per torrent] [activations] [cache MB]
+ */
+
+#include "libtorrent/seedbank/torrent_info_cache.hpp"
+#include "libtorrent/torrent_info.hpp"
+#include "libtorrent/entry.hpp"
+#include "libtorrent/bencode.hpp"
+#include "libtorrent/file.hpp"
+#include "libtorrent/time.hpp"
+#include "libtorrent/hasher.hpp"
+
+#include <algorithm> // sort, min
+#include <cstdio>
+#include <cstdlib> // atoi, rand
+#include <fstream>
+#include <iterator>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <unistd.h> // getpid
+
+using namespace libtorrent;
+
+namespace
+{
+    struct test_torrent
+    {
+        std::string path;
+        sha1_hash info_hash;
+    };
+
+    /**
+     * Write a multi-file torrent with made up piece hashes
+     */
+    test_torrent write_torrent(std::string const& dir, int index, int num_files)
+    {
+        std::stringstream name;
+        name << "torrent-" << index;
+
+        entry info(entry::dictionary_t);
+        info["name"] = name.str();
+        int piece_length = 256 * 1024;
+        info["piece length"] = piece_length;
+        entry::list_type& files = info["files"].list();
+        boost::int64_t total = 0;
+        for (int i = 0; i < num_files; ++i) {
+            entry f(entry::dictionary_t);
+            boost::int64_t size = 100000 + (std::rand() % 5000000);
+            f["length"] = size;
+            std::stringstream file_name;
+            file_name << "file-" << i << ".dat";
+            entry::list_type& path = f["path"].list();
+            path.push_back(entry("data"));
+            path.push_back(entry(file_name.str()));
+            files.push_back(f);
+            total += size;
+        }
+        int num_pieces = int((total + piece_length - 1) / piece_length);
+        std::string pieces(num_pieces * 20, '\0');
+        for (std::string::iterator i = pieces.begin(); i != pieces.end(); ++i)
+            *i = char(std::rand());
+        info["pieces"] = pieces;
+
+        entry torrent(entry::dictionary_t);
+        torrent["info"] = info;
+        torrent["announce"] = "http://tracker.example.com/announce";
+
+        std::vector<char> info_buf;
+        bencode(std::back_inserter(info_buf), info);
+
+        test_torrent t;
+        t.info_hash = hasher(&info_buf[0], int(info_buf.size())).final();
+        t.path = combine_path(dir, name.str() + ".torrent");
+        std::vector<char> buf;
+        bencode(std::back_inserter(buf), torrent);
+        std::ofstream out(t.path.c_str(), std::ios::binary);
+        out.write(&buf[0], buf.size());
+        return t;
+    }
+
+    /**
+     * The plugin's activation path, see _convert_to_torrent_info
+     */
+    boost::intrusive_ptr<torrent_info> activate(test_torrent const& t, torrent_info_cache* cache
+        , bool& hit)
+    {
+        boost::intrusive_ptr<torrent_info> ti;
+        file_status st;
+        error_code ec;
+        hit = false;
+        if (cache) {
+            stat_file(t.path, &st, ec);
+            if (!ec) {
+                ti = cache->find(t.info_hash, st.mtime);
+                hit = ti;
+                if (ti) return ti;
+            }
+        }
+        ti = new torrent_info(t.path);
+        if (cache && !ec) {
+            cache->insert(t.info_hash, st.mtime, st.file_size, ti);
+            ti = new torrent_info(*ti);
+        }
+        return ti;
+    }
+
+    /**
+     * Index in [0, n), torrents near the front much more likely
+     */
+    int pick_skewed(int n)
+    {
+        double r = double(std::rand()) / RAND_MAX;
+        return (std::min)(n - 1, int(n * r * r * r));
+    }
+
+    void print_latency(char const* label, std::vector<boost::int64_t>& latency)
+    {
+        if (latency.empty()) {
+            std::printf("  %-8s %8d\n", label, 0);
+            return;
+        }
+        std::sort(latency.begin(), latency.end());
+        boost::int64_t sum = 0;
+        for (std::vector<boost::int64_t>::iterator i = latency.begin(); i != latency.end(); ++i)
+            sum += *i;
+        int n = int(latency.size());
+        std::printf("  %-8s %8d  mean %6d us  p50 %6d us  p90 %6d us  p99 %6d us\n"
+            , label, n, int(sum / n), int(latency[n / 2]), int(latency[n * 90 / 100])
+            , int(latency[n * 99 / 100]));
+    }
+
+    void run(char const* label, std::vector<test_torrent> const& torrents
+        , int activations, torrent_info_cache* cache)
+    {
+        std::srand(1);
+        std::vector<boost::int64_t> all;
+        std::vector<boost::int64_t> hits;
+        std::vector<boost::int64_t> misses;
+        all.reserve(activations);
+        ptime start = time_now_hires();
+        for (int i = 0; i < activations; ++i) {
+            test_torrent const& t = torrents[pick_skewed(int(torrents.size()))];
+            bool hit;
+            ptime before = time_now_hires();
+            // the torrent_info is dropped again right away, like an expired torrent
+            boost::intrusive_ptr<torrent_info> ti = activate(t, cache, hit);
+            boost::int64_t us = total_microseconds(time_now_hires() - before);
+            if (!ti || ti->info_hash() != t.info_hash) {
+                std::fprintf(stderr, "%s: bad torrent_info for %s\n", label, t.path.c_str());
+                std::exit(1);
+            }
+            all.push_back(us);
+            (hit ? hits : misses).push_back(us);
+        }
+        boost::int64_t total = total_milliseconds(time_now_hires() - start);
+
+        std::printf("%s: %d activations in %d ms\n", label, activations, int(total));
+        print_latency("all", all);
+        if (!cache) return;
+        print_latency("hit", hits);
+        print_latency("parse", misses);
+        torrent_info_cache::stats s;
+        cache->get_stats(s);
+        std::printf("  evictions %d, %d entries (%d KB) cached\n"
+            , int(s.evictions), s.entries, int(s.bytes / 1024));
+    }
+}
+
+int main(int argc, char const* argv[])
+{
+    int num_torrents = argc > 1 ? std::atoi(argv[1]) : 500;
+    int num_files = argc > 2 ? std::atoi(argv[2]) : 200;
+    int activations = argc > 3 ? std::atoi(argv[3]) : 5000;
+    int cache_mb = argc > 4 ? std::atoi(argv[4]) : 64;
+
+    std::stringstream dir;
+    dir << "/tmp/bench_torrent_info_cache." << getpid();
+    error_code ec;
+    create_directory(dir.str(), ec);
+    if (ec) {
+        std::fprintf(stderr, "unable to create %s: %s\n", dir.str().c_str(), ec.message().c_str());
+        return 1;
+    }
+
+    std::srand(0);
+    std::vector<test_torrent> torrents;
+    for (int i = 0; i < num_torrents; ++i)
+        torrents.push_back(write_torrent(dir.str(), i, num_files));
+    file_status st;
+    stat_file(torrents[0].path, &st, ec);
+    std::printf("%d torrents, %d files each, %d KB per torrent file, %d MB cache\n"
+        , num_torrents, num_files, int(st.file_size / 1024), cache_mb);
+
+    run("no cache", torrents, activations, 0);
+    torrent_info_cache cache(boost::uint64_t(cache_mb) * 1024 * 1024);
+    run("cache", torrents, activations, &cache);
+
+    remove_all(dir.str(), ec);
+    return 0;
+}
@@ -0,0 +1,45 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#ifndef SEEDBANK_TEST_HPP_INCLUDED
+#define SEEDBANK_TEST_HPP_INCLUDED
+
+#include <cstdio>
+
+/**
+ * Minimal checks for the seed bank tests and benchmarks.  Failures are
+ * reported and counted, and the test continues.
+ */
+
+inline int& test_failure_count()
+{
+    static int failures = 0;
+    return failures;
+}
+
+inline int test_failures() { return test_failure_count(); }
+
+inline void report_failure(char const* expr, char const* file, int line)
+{
+    std::fprintf(stderr, "%s:%d: TEST_CHECK failed: %s\n", file, line, expr);
+    ++test_failure_count();
+}
+
+#define TEST_CHECK(x) \
+    do { if (!(x)) report_failure(#x, __FILE__, __LINE__); } while (false)
+
+#endif // SEEDBANK_TEST_HPP_INCLUDED
@@ -0,0 +1,135 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Stand-in for the parts of the mongodb C++ driver the connection pool
+ * uses, backed by an in-process fake server that tests can kill and
+ * restart.  Connections opened before a kill fail on their next command,
+ * like sockets to a restarted mongod.
+ */
+
+#ifndef SEEDBANK_TEST_STUB_DBCLIENT_H_INCLUDED
+#define SEEDBANK_TEST_STUB_DBCLIENT_H_INCLUDED
+
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include <boost/cstdint.hpp>
+#include "libtorrent/thread.hpp"
+#include "libtorrent/time.hpp"
+
+#define BSON(x) mongo::BSONObj()
+
+namespace mongo
+{
+    struct DBException : std::runtime_error
+    {
+        DBException(std::string const& msg) : std::runtime_error(msg) {}
+    };
+
+    struct BSONObj {};
+
+    class stand_in_server
+    {
+    public:
+        stand_in_server() : m_up(true), m_epoch(0), m_connects(0), m_commands(0) {}
+
+        void kill()
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            m_up = false;
+            ++m_epoch;
+        }
+
+        void restart()
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            m_up = true;
+        }
+
+        // returns the epoch of the new connection, throws if down
+        int connect()
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            ++m_connects;
+            m_connect_times.push_back(libtorrent::time_now_hires());
+            if (!m_up) throw DBException("connection refused");
+            return m_epoch;
+        }
+
+        bool command(int epoch)
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            ++m_commands;
+            return m_up && epoch == m_epoch;
+        }
+
+        int connect_attempts() const
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            return m_connects;
+        }
+
+        std::vector<libtorrent::ptime> connect_times() const
+        {
+            libtorrent::mutex::scoped_lock l(m_mutex);
+            return m_connect_times;
+        }
+
+    private:
+        mutable libtorrent::mutex m_mutex;
+        bool m_up;
+        int m_epoch;
+        int m_connects;
+        boost::uint64_t m_commands;
+        std::vector<libtorrent::ptime> m_connect_times;
+    };
+
+    // defined by the test
+    extern stand_in_server stand_in;
+
+    class DBClientConnection
+    {
+    public:
+        DBClientConnection(bool auto_reconnect, void* handler, double so_timeout)
+            : m_failed(true), m_epoch(-1)
+        {}
+
+        void connect(std::string const& server)
+        {
+            m_epoch = stand_in.connect();
+            m_failed = false;
+        }
+
+        bool isFailed() const { return m_failed; }
+
+        bool runCommand(std::string const& db, BSONObj const& cmd, BSONObj& info)
+        {
+            if (m_failed || !stand_in.command(m_epoch)) {
+                m_failed = true;
+                throw DBException("socket exception");
+            }
+            return true;
+        }
+
+    private:
+        bool m_failed;
+        int m_epoch;
+    };
+}
+
+#endif // SEEDBANK_TEST_STUB_DBCLIENT_H_INCLUDED
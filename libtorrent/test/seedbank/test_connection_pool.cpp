@@ -0,0 +1,268 @@
+/**
+ * Copyright 2012 ibiblio
+ * All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * mongodb_connection_pool against the stand-in server in
+ * stub/mongo/client/dbclient.h.  Worker threads keep running queries
+ * while the server is killed and restarted, checking the reconnect
+ * backoff, the circuit breaker and recovery after the restart.
+ */
+
+#include "libtorrent/seedbank/mongodb_connection_pool.hpp"
+#include "libtorrent/seedbank/mongodb_alert_code.hpp"
+#include "libtorrent/thread.hpp"
+#include "libtorrent/time.hpp"
+#include "seedbank_test.hpp"
+
+#include <boost/bind.hpp>
+#include <boost/shared_ptr.hpp>
+#include <algorithm> // count
+#include <cstdio>
+#include <vector>
+
+using namespace libtorrent;
+
+mongo::stand_in_server mongo::stand_in;
+
+namespace
+{
+    mutex alert_mutex;
+    std::vector<int> alerts;
+
+    void on_alert(int code, std::string const& msg)
+    {
+        mutex::scoped_lock l(alert_mutex);
+        alerts.push_back(code);
+    }
+
+    int alert_count(int code)
+    {
+        mutex::scoped_lock l(alert_mutex);
+        return int(std::count(alerts.begin(), alerts.end(), code));
+    }
+
+    /**
+     * Worker threads running pings through the pool, like the plugin's
+     * lookup workers
+     */
+    class pool_load
+    {
+    public:
+        pool_load(mongodb_connection_pool& pool, int threads)
+            : m_pool(pool)
+            , m_stop(false)
+            , m_successes(0)
+            , m_failures(0)
+            , m_rejected(0)
+        {
+            for (int i = 0; i < threads; ++i) {
+                m_threads.push_back(boost::shared_ptr<thread>(
+                    new thread(boost::bind(&pool_load::run, this))));
+            }
+        }
+
+        ~pool_load() { stop(); }
+
+        void stop()
+        {
+            {
+                mutex::scoped_lock l(m_mutex);
+                m_stop = true;
+            }
+            for (std::vector<boost::shared_ptr<thread> >::iterator i = m_threads.begin()
+                , end(m_threads.end()); i != end; ++i)
+            {
+                (*i)->join();
+            }
+            m_threads.clear();
+        }
+
+        int successes() const { mutex::scoped_lock l(m_mutex); return m_successes; }
+        int failures() const { mutex::scoped_lock l(m_mutex); return m_failures; }
+        int rejected() const { mutex::scoped_lock l(m_mutex); return m_rejected; }
+
+    private:
+        void run()
+        {
+            for (;;) {
+                {
+                    mutex::scoped_lock l(m_mutex);
+                    if (m_stop) return;
+                }
+                mongodb_connection_pool::connection_ptr c = m_pool.acquire();
+                if (!c) {
+                    mutex::scoped_lock l(m_mutex);
+                    ++m_rejected;
+                } else {
+                    bool ok;
+                    try {
+                        mongo::BSONObj info;
+                        ok = c->runCommand("seedbank", BSON("ping" << 1), info);
+                    } catch (mongo::DBException&) {
+                        ok = false;
+                    }
+                    m_pool.release(c, ok);
+                    mutex::scoped_lock l(m_mutex);
+                    if (ok) ++m_successes;
+                    else ++m_failures;
+                }
+                libtorrent::sleep(1);
+            }
+        }
+
+        mongodb_connection_pool& m_pool;
+        mutable mutex m_mutex;
+        bool m_stop;
+        int m_successes;
+        int m_failures;
+        int m_rejected;
+        std::vector<boost::shared_ptr<thread> > m_threads;
+    };
+
+    /**
+     * Wait up to `timeout_ms` for more successful queries than `count`.
+     * Returns the milliseconds waited, or -1.
+     */
+    int wait_for_successes(pool_load const& load, int count, int timeout_ms)
+    {
+        ptime start = time_now_hires();
+        for (;;) {
+            int elapsed = int(total_milliseconds(time_now_hires() - start));
+            if (load.successes() > count) return elapsed;
+            if (elapsed > timeout_ms) return -1;
+            libtorrent::sleep(5);
+        }
+    }
+
+    /**
+     * With the breaker disabled, reconnects to a dead server back off
+     * exponentially up to backoff_max instead of following every acquire.
+     */
+    void test_backoff()
+    {
+        mongodb_connection_pool::params p;
+        p.size = 2;
+        p.backoff_min = 20;
+        p.backoff_max = 160;
+        p.breaker_threshold = 0;
+        mongodb_connection_pool pool(p, &on_alert);
+
+        mongo::stand_in.kill();
+        int attempts_before = mongo::stand_in.connect_attempts();
+        pool_load load(pool, 4);
+        libtorrent::sleep(1500);
+
+        int attempts = mongo::stand_in.connect_attempts() - attempts_before;
+        std::printf("backoff: %d connect attempts, %d acquires rejected in 1.5 s\n"
+            , attempts, load.rejected());
+        // at least backoff_max / 2 between rounds once the backoff tops
+        // out, and at most one attempt per pool slot per round
+        TEST_CHECK(attempts >= 5);
+        TEST_CHECK(attempts <= 45);
+        TEST_CHECK(load.rejected() > attempts * 10);
+        TEST_CHECK(load.successes() == 0);
+
+        // later rounds are further apart than the first ones
+        std::vector<ptime> times = mongo::stand_in.connect_times();
+        times.erase(times.begin(), times.begin() + attempts_before);
+        TEST_CHECK(times.size() >= 5);
+        if (times.size() >= 5) {
+            int first = int(total_milliseconds(times[2] - times[0]));
+            int last = int(total_milliseconds(times[times.size() - 1] - times[times.size() - 3]));
+            std::printf("backoff: first two gaps %d ms, last two gaps %d ms\n", first, last);
+            TEST_CHECK(last > first);
+            TEST_CHECK(last >= p.backoff_max / 2);
+        }
+
+        // a restarted server is reconnected to within one backoff
+        int successes = load.successes();
+        mongo::stand_in.restart();
+        int recovered = wait_for_successes(load, successes, 1000);
+        std::printf("backoff: reconnected %d ms after restart\n", recovered);
+        TEST_CHECK(recovered >= 0);
+        TEST_CHECK(recovered <= p.backoff_max + 100);
+        load.stop();
+        pool.abort();
+    }
+
+    /**
+     * Kill the server under load: the circuit opens after
+     * breaker_threshold failures, connects stop, and after the restart a
+     * trial request closes the circuit and the pool reconnects.
+     */
+    void test_breaker()
+    {
+        mongodb_connection_pool::params p;
+        p.size = 4;
+        p.backoff_min = 20;
+        p.backoff_max = 200;
+        p.breaker_threshold = 5;
+        p.breaker_reset = 1;
+        mongodb_connection_pool pool(p, &on_alert);
+
+        mongo::stand_in.restart();
+        pool_load load(pool, 4);
+        libtorrent::sleep(300);
+
+        mongodb_connection_pool::stats s;
+        pool.get_stats(s);
+        TEST_CHECK(load.successes() > 0);
+        TEST_CHECK(load.failures() == 0);
+        TEST_CHECK(!s.circuit_open);
+        std::printf("breaker: %d queries before kill, %d connections open\n", load.successes(), s.open);
+
+        // kill mid-load
+        mongo::stand_in.kill();
+        int attempts_before = mongo::stand_in.connect_attempts();
+        libtorrent::sleep(1500);
+        pool.get_stats(s);
+        int attempts = mongo::stand_in.connect_attempts() - attempts_before;
+        std::printf("breaker: %d failures, %d rejected, %d connect attempts while down\n"
+            , load.failures(), load.rejected(), attempts);
+        TEST_CHECK(s.circuit_open);
+        TEST_CHECK(s.circuit_opens == 1);
+        TEST_CHECK(alert_count(mongodb_alert_code::db_circuit_open) == 1);
+        TEST_CHECK(s.open == 0);
+        TEST_CHECK(load.rejected() > 100);
+        // the failures that opened the circuit, then one trial a second
+        TEST_CHECK(attempts <= 10);
+
+        // restart mid-load
+        int successes = load.successes();
+        boost::uint64_t connects = s.connects;
+        mongo::stand_in.restart();
+        int recovered = wait_for_successes(load, successes, 3000);
+        std::printf("breaker: recovered %d ms after restart\n", recovered);
+        TEST_CHECK(recovered >= 0);
+        TEST_CHECK(recovered <= p.breaker_reset * 1000 + 500);
+
+        libtorrent::sleep(200);
+        pool.get_stats(s);
+        TEST_CHECK(!s.circuit_open);
+        TEST_CHECK(s.connects > connects);
+        TEST_CHECK(alert_count(mongodb_alert_code::db_circuit_closed) == 1);
+        load.stop();
+        pool.abort();
+    }
+}
+
+int main()
+{
+    test_backoff();
+    test_breaker();
+    return test_failures() ? 1 : 0;
+}
@@ -19,10 +19,12 @@ import os
 from seedbank.cli.command import Command
 from seedbank.torrent.torrent import Torrent
 import terasaur.config.config_helper as config_helper
+from seedbank.cli.message_publisher_mixin import MessagePublisherMixin
 
-class AddCommand(Command):
+class AddCommand(Command, MessagePublisherMixin):
     def __init__(self, **kwargs):
         Command.__init__(self, **kwargs)
+        self._verbose = kwargs.get('verbose', False)
         self._torrent_file = kwargs.get('torrent_file', None)
         self._data_root = kwargs.get('data_root', None)
 
@@ -58,6 +60,7 @@ class AddCommand(Command):
         # TODO: delete torrent file if save fails
 
         self._print('Torrent added\n')
+        self.notify_torrent_changed(t.info_hash)
 
     def _check_required_params(self):
         if not self._torrent_file:
@@ -35,6 +35,27 @@ class MessagePublisherMixin(object):
         routing_key = self._config.get(config_helper.MQ_SECTION, 'control_queue')
         return self._create_publisher(routing_key)
 
+    def notify_torrent_changed(self, info_hash):
+        """
+        Tell the seedbank server the catalog entry for a torrent changed, so
+        its cached lookup is dropped.  Cached entries expire on their own if
+        the server can't be reached.
+        """
+        try:
+            self.send_torrent_invalidate(info_hash)
+        except Exception, e:
+            self._println('Unable to notify seedbank server (%s)' % str(e))
+
+    def send_torrent_invalidate(self, info_hash):
+        mq = self.create_seedbank_publisher()
+        message_dict = {
+            'action': 'torrent',
+            'torrent_action': 'invalidate',
+            'info_hash': info_hash
+            }
+        mq.publish(self.encode_message(message_dict))
+        mq.stop()
+
     def encode_message(self, data):
         encoder = bson.BSON()
         return encoder.encode(data)
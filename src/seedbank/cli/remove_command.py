@@ -18,10 +18,12 @@ import os
 from seedbank.cli.command import Command
 from seedbank.torrent.torrent import Torrent
 import terasaur.config.config_helper as config_helper
+from seedbank.cli.message_publisher_mixin import MessagePublisherMixin
 
-class RemoveCommand(Command):
+class RemoveCommand(Command, MessagePublisherMixin):
     def __init__(self, **kwargs):
         Command.__init__(self, **kwargs)
+        self._verbose = kwargs.get('verbose', False)
         self._info_hash = kwargs.get('info_hash', None)
 
         if kwargs.has_key('torrent_root'):
@@ -43,6 +45,7 @@ class RemoveCommand(Command):
         try:
             torrent.delete()
             self._print('Removed torrent %s (%s)\n' % (torrent.name, torrent.info_hash))
+            self.notify_torrent_changed(torrent.info_hash)
         except OSError, e:
             # Common problem is an 'Operation not permitted' error deleting a file
             self._print('Unable to remove torrent (%s)\n' % str(e))
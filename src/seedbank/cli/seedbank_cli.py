@@ -15,7 +15,7 @@
 #
 
 import copy
-import terasaur.db.mongodb_db as mongodb_db
+from seedbank.db import catalog
 from seedbank.cli.command import Command, CommandException
 from seedbank.cli.add_command import AddCommand
 from seedbank.cli.remove_command import RemoveCommand
@@ -51,6 +51,7 @@ class SeedbankCLI(object):
         elif command_str == Command.STATS:
             self._stats(options, args)
         else:
+            self._init_seedbank_db()
             command = self._create_command(command_str,
                                            config=self._config,
                                            verbose=options.verbose)
@@ -101,7 +102,7 @@ class SeedbankCLI(object):
         command.execute()
 
     def _init_seedbank_db(self):
-        mongodb_db.set_connection_params_from_config(self._config)
+        catalog.configure(self._config)
 
     def _create(self, options, args):
         command = self._create_command(Command.CREATE,
@@ -42,11 +42,23 @@ DEFAULT_VALUES = {
         'torrent_file_root': '/var/lib/seedbank/torrents',
         'listen_address': '0.0.0.0',
         'listen_port': '6881',
+        'server_sessions': 1,
         'error_log': '/var/log/seedbank/error.log',
         'log_level': 'info',
         'inactive_torrent_timeout': 60,
+        'max_active_torrents': 0,
+        'popularity_half_life': 3600,
+        'pinned_torrents': '',
         'torrent_manager_exec_interval': 5,
-        'data_volume_root': '/var/lib/seedbank/data'
+        'alert_log_rate_limit': 50,
+        'alert_log_sample_rate': 1,
+        'data_volume_root': '/var/lib/seedbank/data',
+        'session_state_root': '/var/lib/seedbank/state',
+        'warm_start_rate': 50,
+        'warm_start_count': 1000,
+        'last_accessed_flush_interval': 60,
+        'catalog_backend': 'mongodb',
+        'catalog_index_path': '/var/lib/seedbank/catalog.idx'
         },
     UPLOAD_SECTION: {
             'allow_upload': False,
@@ -59,7 +71,22 @@ DEFAULT_VALUES = {
         'db_port': '27017',
         'db_name': 'seedbank',
         'db_user': '',
-        'db_pass': ''
+        'db_pass': '',
+        'lookup_threads': 4,
+        'lookup_cache_size': 10000,
+        'lookup_cache_ttl': 3600,
+        'lookup_cache_negative_ttl': 60,
+        'lookup_filter_fpr': 0.01,
+        'lookup_filter_refresh_interval': 3600,
+        'pool_size': 0,
+        'query_timeout': 5,
+        'reconnect_backoff_min': 100,
+        'reconnect_backoff_max': 30000,
+        'breaker_threshold': 5,
+        'breaker_reset': 30,
+        'health_check_interval': 30,
+        'torrent_info_cache_mb': 256,
+        'lookup_metrics_interval': 10
         },
     config_helper.MQ_SECTION: {
         'host': 'localhost',
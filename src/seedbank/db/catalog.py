@@ -0,0 +1,123 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import calendar
+import datetime
+import terasaur.db.mongodb_db as mongodb_db
+from terasaur.db import torrent_db
+from terasaur.config.config_helper import MAIN_SECTION
+from seedbank.db import torrent_access_db
+from seedbank.db.catalog_index import CatalogIndex
+
+"""
+Torrent catalog backends.  The catalog holds a record for every torrent in
+the seed bank: info_hash, name, size, data_root, added and last_accessed.
+
+    - mongodb: the torrent collection
+    - local: a memory mapped hash index file, for single node seed banks.
+        The libtorrent plugin reads it directly, see catalog_index.
+
+Dates are UTC datetimes for both backends.
+"""
+
+MONGODB_BACKEND = 'mongodb'
+LOCAL_BACKEND = 'local'
+
+_backend = None
+
+class CatalogException(Exception): pass
+
+def configure(config):
+    """
+    Select the backend named by the catalog_backend config value
+    """
+    global _backend
+    mongodb_db.set_connection_params_from_config(config)
+    name = config.get(MAIN_SECTION, 'catalog_backend')
+    if name == MONGODB_BACKEND:
+        _backend = MongodbCatalog()
+    elif name == LOCAL_BACKEND:
+        _backend = LocalCatalog(config.get(MAIN_SECTION, 'catalog_index_path'))
+    else:
+        raise CatalogException('Invalid catalog backend: %s' % name)
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = MongodbCatalog()
+    return _backend
+
+class MongodbCatalog(object):
+    def initialize(self):
+        torrent_db.initialize()
+
+    def get(self, info_hash):
+        return torrent_db.get(info_hash)
+
+    def find(self, query=None):
+        return torrent_db.find(query)
+
+    def save(self, data):
+        torrent_db.save(data)
+
+    def delete(self, info_hash):
+        torrent_db.delete(info_hash)
+
+    def update_last_accessed(self, timestamp, info_hash_list):
+        torrent_access_db.update_last_accessed(timestamp, info_hash_list)
+
+class LocalCatalog(object):
+    def __init__(self, path):
+        self._index = CatalogIndex(path)
+
+    def initialize(self):
+        self._index.create()
+
+    def get(self, info_hash):
+        return self._from_index(self._index.get(info_hash))
+
+    def find(self, query=None):
+        """
+        Returns every record.  Queries need the mongodb backend.
+        """
+        if query:
+            raise CatalogException('Catalog queries are not supported by the local backend')
+        return [self._from_index(record) for record in self._index.iterate()]
+
+    def save(self, data):
+        record = dict(data)
+        record['added'] = self._to_timestamp(data.get('added', None))
+        record['last_accessed'] = self._to_timestamp(data.get('last_accessed', None))
+        self._index.put(record)
+
+    def delete(self, info_hash):
+        self._index.delete(info_hash)
+
+    def update_last_accessed(self, timestamp, info_hash_list):
+        self._index.set_last_accessed(timestamp, info_hash_list)
+
+    def _from_index(self, record):
+        if record is None:
+            return None
+        for key in ('added', 'last_accessed'):
+            if record[key]:
+                record[key] = datetime.datetime.utcfromtimestamp(record[key])
+        return record
+
+    def _to_timestamp(self, value):
+        if value is None:
+            return None
+        return calendar.timegm(value.utctimetuple())
@@ -0,0 +1,351 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import mmap
+import fcntl
+import struct
+import binascii
+
+"""
+Memory mapped hash index of catalog torrent records, read directly by the
+libtorrent mongodb plugin (catalog_index.cpp).  Keep the two in sync.
+
+Layout, little endian:
+    header (HEADER_SIZE bytes): magic, version, record size, slot count,
+        used slots, filled slots (used and deleted)
+    slot_count records (RECORD_SIZE bytes): info hash (20 raw bytes),
+        state, size, added, last_accessed (unix times, 0 for none),
+        data_root and name (NUL padded utf-8)
+
+Records live in an open addressing table, probed linearly from the first
+8 bytes of the info hash.  Writers hold an flock on <path>.lock.  A record
+is written before its state byte, and replaced records are marked deleted
+only after the new copy is in place, so readers never see a partial
+record.  Deleted slots are reclaimed when the table is rebuilt, which
+writes a new file and renames it over the old one.  Readers remap when
+the file's inode changes.
+"""
+
+MAGIC = 'SBCATIDX'
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FORMAT = '<8sIIIII'
+RECORD_SIZE = 256
+RECORD_FORMAT = '<20sB3xQqq104s104s'
+STATE_OFFSET = 20
+LAST_ACCESSED_OFFSET = 40
+MAX_FIELD_LENGTH = 103 # data_root and name, less the NUL terminator
+
+EMPTY = 0
+USED = 1
+DELETED = 2
+
+MIN_SLOTS = 1024
+MAX_LOAD = 0.7
+
+class CatalogIndexException(Exception): pass
+
+class CatalogIndex(object):
+    def __init__(self, path):
+        self._path = path
+        self._lock_path = path + '.lock'
+        self._file = None
+        self._map = None
+        self._inode = None
+        self._writable = False
+        self._slot_count = 0
+
+    def get_path(self):
+        return self._path
+
+    def get(self, info_hash):
+        """
+        Returns the record dict for a hex info hash, or None
+        """
+        key = self._to_key(info_hash)
+        if not self._open(False):
+            return None
+        slot = self._find_slot(key)
+        if slot is None:
+            return None
+        return self._read_record(slot)
+
+    def iterate(self):
+        """
+        Returns a list of all record dicts
+        """
+        records = []
+        if not self._open(False):
+            return records
+        for slot in xrange(self._slot_count):
+            if self._get_state(slot) == USED:
+                records.append(self._read_record(slot))
+        return records
+
+    def count(self):
+        if not self._open(False):
+            return 0
+        return self._read_header()[4]
+
+    def create(self):
+        """
+        Create an empty index if there isn't one
+        """
+        lock_file = self._lock()
+        try:
+            self._open(True)
+        finally:
+            self._unlock(lock_file)
+
+    def put(self, record):
+        """
+        Insert or replace a record.  `record` needs info_hash and data_root,
+        and may have name, size, added and last_accessed.  Names too long
+        for the record are truncated.
+        """
+        key = self._to_key(record['info_hash'])
+        data_root = self._encode(record['data_root'])
+        if len(data_root) > MAX_FIELD_LENGTH:
+            raise CatalogIndexException('data_root longer than %i bytes: %s' % (MAX_FIELD_LENGTH, record['data_root']))
+        name = self._encode(record.get('name', None))[:MAX_FIELD_LENGTH]
+        packed = struct.pack(RECORD_FORMAT, key, EMPTY,
+                             int(record.get('size', None) or 0),
+                             int(record.get('added', None) or 0),
+                             int(record.get('last_accessed', None) or 0),
+                             data_root, name)
+
+        lock_file = self._lock()
+        try:
+            self._open(True)
+            (magic, version, record_size, slot_count, used, filled) = self._read_header()
+            if filled + 1 > slot_count * MAX_LOAD:
+                self._rebuild(used + 1)
+                (magic, version, record_size, slot_count, used, filled) = self._read_header()
+
+            old_slot = self._find_slot(key)
+            slot = self._find_empty_slot(key)
+            offset = self._get_offset(slot)
+            self._map[offset:offset + RECORD_SIZE] = packed
+            self._set_state(slot, USED)
+            used += 1
+            filled += 1
+            if old_slot is not None:
+                self._set_state(old_slot, DELETED)
+                used -= 1
+            self._write_counts(used, filled)
+            self._map.flush()
+        finally:
+            self._unlock(lock_file)
+
+    def delete(self, info_hash):
+        key = self._to_key(info_hash)
+        lock_file = self._lock()
+        try:
+            if not self._open(True):
+                return
+            slot = self._find_slot(key)
+            if slot is None:
+                return
+            self._set_state(slot, DELETED)
+            header = self._read_header()
+            self._write_counts(header[4] - 1, header[5])
+            self._map.flush()
+        finally:
+            self._unlock(lock_file)
+
+    def set_last_accessed(self, timestamp, info_hash_list):
+        """
+        Update last_accessed in place for every listed info hash that's in
+        the index
+        """
+        lock_file = self._lock()
+        try:
+            if not self._open(True):
+                return
+            for info_hash in info_hash_list:
+                slot = self._find_slot(self._to_key(info_hash))
+                if slot is not None:
+                    struct.pack_into('<q', self._map, self._get_offset(slot) + LAST_ACCESSED_OFFSET, int(timestamp))
+            self._map.flush()
+        finally:
+            self._unlock(lock_file)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._inode = None
+
+    def _open(self, writable):
+        """
+        Map the index, or remap it if it was replaced since.  Writers
+        create a missing index.  Returns False if there is no index.
+        """
+        try:
+            inode = os.stat(self._path).st_ino
+        except OSError:
+            inode = None
+
+        if self._map and inode == self._inode and (self._writable or not writable):
+            return True
+        self.close()
+
+        if inode is None:
+            if not writable:
+                return False
+            self._write_new_index([], MIN_SLOTS)
+            inode = os.stat(self._path).st_ino
+
+        if writable:
+            self._file = open(self._path, 'r+b')
+            access = mmap.ACCESS_WRITE
+        else:
+            self._file = open(self._path, 'rb')
+            access = mmap.ACCESS_READ
+        header = struct.unpack(HEADER_FORMAT, self._file.read(struct.calcsize(HEADER_FORMAT)))
+        (magic, version, record_size, slot_count, used, filled) = header
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.close()
+            raise CatalogIndexException('Invalid catalog index: ' + self._path)
+        length = HEADER_SIZE + slot_count * RECORD_SIZE
+        if os.fstat(self._file.fileno()).st_size < length:
+            self.close()
+            raise CatalogIndexException('Truncated catalog index: ' + self._path)
+
+        self._map = mmap.mmap(self._file.fileno(), length, access=access)
+        self._inode = inode
+        self._writable = writable
+        self._slot_count = slot_count
+        return True
+
+    def _rebuild(self, min_used):
+        """
+        Copy used records into a new table with room for at least twice
+        `min_used` records, then swap it in
+        """
+        slot_count = MIN_SLOTS
+        while min_used * 2 > slot_count * MAX_LOAD:
+            slot_count *= 2
+        records = []
+        for slot in xrange(self._slot_count):
+            if self._get_state(slot) == USED:
+                offset = self._get_offset(slot)
+                records.append(self._map[offset:offset + RECORD_SIZE])
+        self.close()
+        self._write_new_index(records, slot_count)
+        self._open(True)
+
+    def _write_new_index(self, records, slot_count):
+        tmp_path = self._path + '.tmp'
+        length = HEADER_SIZE + slot_count * RECORD_SIZE
+        f = open(tmp_path, 'w+b')
+        try:
+            f.truncate(length)
+            m = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_WRITE)
+            try:
+                struct.pack_into(HEADER_FORMAT, m, 0, MAGIC, VERSION, RECORD_SIZE,
+                                 slot_count, len(records), len(records))
+                for packed in records:
+                    slot = self._hash(packed[:20]) % slot_count
+                    while ord(m[self._get_offset(slot) + STATE_OFFSET]) != EMPTY:
+                        slot = (slot + 1) % slot_count
+                    offset = self._get_offset(slot)
+                    m[offset:offset + RECORD_SIZE] = packed
+                m.flush()
+            finally:
+                m.close()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp_path, self._path)
+
+    def _find_slot(self, key):
+        slot = self._hash(key) % self._slot_count
+        for i in xrange(self._slot_count):
+            state = self._get_state(slot)
+            if state == EMPTY:
+                return None
+            if state == USED:
+                offset = self._get_offset(slot)
+                if self._map[offset:offset + 20] == key:
+                    return slot
+            slot = (slot + 1) % self._slot_count
+        return None
+
+    def _find_empty_slot(self, key):
+        """
+        Deleted slots aren't reused, a reader may still be looking at them
+        """
+        slot = self._hash(key) % self._slot_count
+        while self._get_state(slot) != EMPTY:
+            slot = (slot + 1) % self._slot_count
+        return slot
+
+    def _read_record(self, slot):
+        (key, state, size, added, last_accessed, data_root, name) = \
+            struct.unpack_from(RECORD_FORMAT, self._map, self._get_offset(slot))
+        record = {
+            'info_hash': binascii.b2a_hex(key),
+            'name': name.rstrip('\0').decode('utf-8', 'ignore'),
+            'size': size,
+            'data_root': data_root.rstrip('\0').decode('utf-8', 'ignore'),
+            'added': added or None,
+            'last_accessed': last_accessed or None
+            }
+        return record
+
+    def _read_header(self):
+        return struct.unpack_from(HEADER_FORMAT, self._map, 0)
+
+    def _write_counts(self, used, filled):
+        struct.pack_into('<II', self._map, struct.calcsize(HEADER_FORMAT) - 8, used, filled)
+
+    def _get_state(self, slot):
+        return ord(self._map[self._get_offset(slot) + STATE_OFFSET])
+
+    def _set_state(self, slot, state):
+        self._map[self._get_offset(slot) + STATE_OFFSET] = chr(state)
+
+    def _get_offset(self, slot):
+        return HEADER_SIZE + slot * RECORD_SIZE
+
+    def _hash(self, key):
+        return struct.unpack('>Q', key[:8])[0]
+
+    def _to_key(self, info_hash):
+        if not info_hash or len(info_hash) != 40:
+            raise CatalogIndexException('Invalid info hash: %s' % info_hash)
+        return binascii.a2b_hex(info_hash)
+
+    def _encode(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def _lock(self):
+        lock_file = open(self._lock_path, 'a')
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return lock_file
+
+    def _unlock(self, lock_file):
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
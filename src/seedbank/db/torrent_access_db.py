@@ -0,0 +1,43 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import terasaur.db.mongodb_db as mongodb_db
+from terasaur.db.torrent_db import TORRENT_COLLECTION
+
+"""
+Bulk last_accessed updates for torrent records
+"""
+
+# info hashes per update statement
+MAX_BATCH_SIZE = 1000
+
+def update_last_accessed(timestamp, info_hash_list):
+    """
+    Set last_accessed on every listed torrent with one multi-document
+    update per MAX_BATCH_SIZE info hashes.  `timestamp` is a unix time.
+    """
+    last_accessed = datetime.datetime.utcfromtimestamp(timestamp)
+    conn = mongodb_db.get_db_conn()
+    try:
+        collection = conn[mongodb_db.DB_PARAMS['db_name']][TORRENT_COLLECTION]
+        for i in xrange(0, len(info_hash_list), MAX_BATCH_SIZE):
+            batch = info_hash_list[i:i + MAX_BATCH_SIZE]
+            collection.update({'info_hash': {'$in': batch}},
+                              {'$set': {'last_accessed': last_accessed}},
+                              multi=True)
+    finally:
+        conn.end_request()
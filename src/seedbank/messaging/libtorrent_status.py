@@ -117,14 +117,23 @@ class TorrentStatusPrinter(object):
             'downloading', 'finished', 'seeding', 'allocating', 'checking fastresume']
 
     def print_single(self, torrent):
-        label = self._label
         s = torrent.status()
+        self._print_status(torrent.name(), torrent.info_hash(), s)
+        self._print_peers(torrent)
+
+    def print_status(self, s):
+        """
+        Print a cached torrent_status, e.g. from a state_update_alert.
+        Doesn't query the torrent handle.
+        """
+        self._print_status('', s.info_hash, s)
+
+    def _print_status(self, name, info_hash, s):
         print '%s %s (%s): %.2f%% complete (down: %.1f kb/s up: %.1f kB/s peers: %d conns: %d) state: %s, err: %s desc: %s\n' % \
-            (label, torrent.name(), torrent.info_hash(), s.progress * 100, s.download_rate / 1000, s.upload_rate / 1000, \
+            (self._label, name, info_hash, s.progress * 100, s.download_rate / 1000, s.upload_rate / 1000, \
             s.num_peers, s.num_connections, self._state_str[s.state], s.error, ','.join(self._get_torrent_descriptors(s)))
         print '%s times: %i active, %i finished, %i seeding, %i since download, %i since upload' % \
             (self._label, s.active_time, s.finished_time, s.seeding_time, s.time_since_download, s.time_since_upload)
-        self._print_peers(torrent)
 
     def _get_torrent_descriptors(self, status):
         l = []
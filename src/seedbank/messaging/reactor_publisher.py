@@ -0,0 +1,36 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+class ReactorPublisher(object):
+    """
+    Stand-in for a RabbitMQ publisher that can be shared between threads.
+    publish() hands the message to the reactor thread, which is the only
+    thread that touches the wrapped publisher.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `publisher`: Publisher object with publish() and stop()
+            - `reactor`: :class: Reactor
+        """
+        self._publisher = kwargs.get('publisher', None)
+        self._reactor = kwargs.get('reactor', None)
+
+    def publish(self, message, **kwargs):
+        self._reactor.call_soon_threadsafe(self._publisher.publish, message, **kwargs)
+
+    def stop(self):
+        self._publisher.stop()
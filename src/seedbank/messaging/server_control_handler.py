@@ -22,11 +22,32 @@ from seedbank.messaging.server_control_message import ServerPingResponseMessage
 import seedbank.server.shared as seedbank_shared
 
 class SeedbankControlMessageHandler(ControlMessageHandler):
+    def __init__(self, **kwargs):
+        ControlMessageHandler.__init__(self, **kwargs)
+        self._reactor = kwargs.get('reactor', None)
+
     def _handle_action(self, action, data):
+        """
+        Called on the consumer thread.  Actions are handled on the reactor
+        thread so they never race with the server loop.
+        """
+        if self._reactor:
+            self._reactor.call_soon_threadsafe(self._dispatch_action, action, data)
+        else:
+            self._dispatch_action(action, data)
+
+    def _dispatch_action(self, action, data):
+        self._dispatch(action, data)
+        # don't leave queued items waiting for the session manager tick
+        seedbank_shared.session_manager.flush()
+
+    def _dispatch(self, action, data):
         if action == 'publish_stats':
             self._handle_publish_stats(bool(data['enable']))
         elif action == 'upload':
             self._handle_upload(data)
+        elif action == 'torrent':
+            self._handle_torrent(data)
         elif action == 'ping_request':
             self._handle_ping(data)
         else:
@@ -39,7 +60,7 @@ class SeedbankControlMessageHandler(ControlMessageHandler):
         else:
             item = LibtorrentSessionQueueItem('publish_stats', {'enable': False})
         self._log.info('Received publish_stats control message (%s)' % enable)
-        seedbank_shared.session_manager.send('server', item)
+        seedbank_shared.session_manager.send_to_servers(item)
 
     def _handle_upload(self, data):
         if not data.has_key('upload_action'):
@@ -68,8 +89,21 @@ class SeedbankControlMessageHandler(ControlMessageHandler):
         else:
             self._log.error('Invalid upload_action param in upload control message')
 
-    def _handle_torrent(self):
-        pass
+    def _handle_torrent(self, data):
+        if not data.has_key('torrent_action'):
+            self._log.error('Missing torrent_action param in torrent control message')
+            return
+        if not data.has_key('info_hash'):
+            self._log.error('Missing info_hash param in torrent control message')
+            return
+
+        torrent_action = data['torrent_action']
+        info_hash = str(data['info_hash']).lower()
+        if torrent_action == 'invalidate':
+            item = LibtorrentSessionQueueItem('invalidate_torrent', {'info_hash': info_hash})
+            seedbank_shared.session_manager.send_by_info_hash(info_hash, item)
+        else:
+            self._log.error('Invalid torrent_action param in torrent control message')
 
     def _handle_ping(self, data):
         if self._verbose:
@@ -28,7 +28,10 @@ class ServerInitMessage(ServerControlMessage):
     def __init__(self, **kwargs):
         self._dict = {'action': 'seedbank_init',
                       'seedbank_id': kwargs.get('seedbank_id', ''),
-                      'peer_id': kwargs.get('peer_id', '')}
+                      'peer_id': kwargs.get('peer_id', ''),
+                      'listen_port': kwargs.get('listen_port', 0),
+                      'shard_index': kwargs.get('shard_index', 0),
+                      'shard_count': kwargs.get('shard_count', 1)}
 
 class ServerUploadMessage(ServerControlMessage):
     def __init__(self, **kwargs):
@@ -21,35 +21,81 @@ from terasaur.messaging.rabbitmq_publisher import SelfManagingRabbitMQPublisher
 from seedbank.mixin.tick_counter import TickCounterMixin
 from terasaur.mixin.timestamp import TimestampMixin
 
+LATENCY_PERCENTILES = (50, 90, 99)
+
+def summarize_latency(histogram):
+    """
+    Summarize a mongodb plugin latency histogram.  Bucket i counts
+    latencies below 2^(i+1) microseconds, so percentiles are bucket upper
+    bounds, capped at the largest latency seen.
+    """
+    count = histogram['count']
+    summary = {
+        'count': count,
+        'mean_us': 0,
+        'max_us': histogram['max_us'],
+        'buckets': histogram['buckets']
+        }
+    if count:
+        summary['mean_us'] = histogram['sum_us'] / count
+    for percentile in LATENCY_PERCENTILES:
+        summary['p%i_us' % percentile] = _get_percentile(histogram, percentile)
+    return summary
+
+def _get_percentile(histogram, percentile):
+    count = histogram['count']
+    if not count:
+        return 0
+    rank = count * percentile / 100.0
+    seen = 0
+    for (i, bucket_count) in enumerate(histogram['buckets']):
+        seen += bucket_count
+        if seen >= rank:
+            return min(2 ** (i + 1), histogram['max_us'])
+    return histogram['max_us']
+
 class ServerStatsPublisher(SelfManagingRabbitMQPublisher, TickCounterMixin, TimestampMixin):
     def __init__(self, **kwargs):
         """
         Query information from libtorrent session object and publish
-        a server stats message to the stats message queue.  The tick
-        function should be called from the LibtorrentSession event loop.
+        a server stats message to the stats message queue.  The execute
+        function is scheduled from the LibtorrentSession event loop.
         """
         SelfManagingRabbitMQPublisher.__init__(self, **kwargs)
         # self._log comes from RabbitMQPublisher
         TickCounterMixin.__init__(self, **kwargs)
+        self._shard_index = kwargs.get('shard_index', 0)
+        self._shard_count = kwargs.get('shard_count', 1)
 
     def _tick(self, **kwargs):
         """
-        Called from TickCounterMixin::tick
+        Called from TickCounterMixin::tick or TickCounterMixin::execute
 
         :Parameters:
             - `session`: :class: libtorrent.session
+            - `watcher`: :class: AlertWatcher, optional
+            - `torrent_state`: :class: TorrentStateTable, optional
+            - `lookup_metrics`: :dict: from the mongodb plugin, optional
         """
         session = kwargs.get('session', None)
-        message = self._get_stats_message(session)
+        watcher = kwargs.get('watcher', None)
+        torrent_state = kwargs.get('torrent_state', None)
+        lookup_metrics = kwargs.get('lookup_metrics', None)
+        message = self._get_stats_message(session, watcher, torrent_state, lookup_metrics)
         self.publish(message)
 
-    def _get_stats_message(self, session):
+    def _get_stats_message(self, session, watcher=None, torrent_state=None, lookup_metrics=None):
         status = session.status()
-        torrents = session.get_torrents()
+        if torrent_state is not None:
+            num_torrents = len(torrent_state)
+        else:
+            num_torrents = status.num_torrents
         data = {
             'timestamp': self._get_now_timestamp(),
             'peer_id': binascii.a2b_hex(str(session.id())),
-            'num_torrents' : len(torrents),
+            'shard_index': self._shard_index,
+            'shard_count': self._shard_count,
+            'num_torrents' : num_torrents,
             'num_peers' : status.num_peers,
             'num_unchoked' : status.num_unchoked,
             'allowed_upload_slots' : status.allowed_upload_slots,
@@ -74,4 +120,22 @@ class ServerStatsPublisher(SelfManagingRabbitMQPublisher, TickCounterMixin, Time
             'total_tracker_download' : status.total_tracker_download,
             'total_tracker_upload' : status.total_tracker_upload
             }
+        if watcher:
+            data['alert_watcher'] = watcher.get_stats()
+        if lookup_metrics:
+            data['lookup_metrics'] = self._get_lookup_metrics(lookup_metrics)
         return json.dumps(data)
+
+    def _get_lookup_metrics(self, lookup_metrics):
+        """
+        Outcome counts and latency summaries, cumulative since the server
+        session started
+        """
+        latency = {}
+        for (stage, histogram) in lookup_metrics['latency'].iteritems():
+            latency[stage] = summarize_latency(histogram)
+        return {
+            'outcomes': lookup_metrics['outcomes'],
+            'pending': lookup_metrics['pending'],
+            'latency': latency
+            }
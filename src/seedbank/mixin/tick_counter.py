@@ -51,5 +51,16 @@ class TickCounterMixin(object):
         else:
             self._tick_counter -= 1
 
+    def execute(self, **kwargs):
+        """
+        Run the task immediately.  Use from event loops that schedule
+        by deadline instead of calling tick().
+        """
+        self._reset_tick_counter()
+        self._tick(**kwargs)
+
+    def get_exec_interval(self):
+        return self._exec_interval
+
     def _tick(self, **kwargs):
         raise NotImplementedError('Must override TickCounterMixin::_tick')
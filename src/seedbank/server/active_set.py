@@ -0,0 +1,163 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import heapq
+import math
+import time
+
+# longest idle timeout a popular torrent can earn, as a multiple of the
+# configured timeout
+MAX_TIMEOUT_FACTOR = 4
+
+class ActiveSetPolicy(object):
+    """
+    Decides which torrents stay in the session.  Each torrent has a
+    popularity score: a count of accesses (activations and periods of
+    transfer activity) where every access loses half its weight each
+    `half_life` seconds.  Recent and frequent use both raise the score,
+    so it behaves like a blend of LRU and LFU.
+
+    History is kept after a torrent leaves the session, so a torrent that
+    keeps being reactivated builds up a score and is kept longer.
+
+    Pinned torrents are never evicted.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `max_active`: Maximum torrents in the session.  0 disables
+                the limit.
+            - `half_life`: Seconds for an access to lose half its weight
+            - `pinned`: List of info hashes that are never evicted
+            - `history_size`: Maximum torrents to keep history for
+        """
+        self._max_active = int(kwargs.get('max_active', 0))
+        self._half_life = float(kwargs.get('half_life', 3600))
+        self._history_size = int(kwargs.get('history_size', max(10000, 10 * self._max_active)))
+        self._pinned = set()
+        for info_hash in kwargs.get('pinned', []):
+            self.pin(info_hash)
+        self._history = {} # info hash -> [score, last access time]
+        self._evicted = 0
+
+    def record_access(self, info_hash, now=None, weight=1.0):
+        if now is None:
+            now = time.time()
+        entry = self._history.get(info_hash, None)
+        if entry:
+            entry[0] = self._decay(entry[0], now - entry[1]) + weight
+            entry[1] = now
+        else:
+            self._history[info_hash] = [weight, now]
+            if len(self._history) > self._history_size:
+                self._trim_history(now)
+
+    def get_score(self, info_hash, now=None):
+        entry = self._history.get(info_hash, None)
+        if not entry:
+            return 0.0
+        if now is None:
+            now = time.time()
+        return self._decay(entry[0], now - entry[1])
+
+    def _decay(self, score, age):
+        if age <= 0:
+            return score
+        return score * math.pow(0.5, age / self._half_life)
+
+    def get_timeout(self, info_hash, timeout, now=None):
+        """
+        Idle timeout for a torrent.  A torrent with a score of n gets up
+        to n extra timeouts, capped at MAX_TIMEOUT_FACTOR.
+        """
+        factor = min(MAX_TIMEOUT_FACTOR, 1 + int(self.get_score(info_hash, now)))
+        return timeout * factor
+
+    def pin(self, info_hash):
+        self._pinned.add(info_hash.lower())
+
+    def unpin(self, info_hash):
+        self._pinned.discard(info_hash.lower())
+
+    def is_pinned(self, info_hash):
+        return info_hash in self._pinned
+
+    def select_evictions(self, info_hash_list, now=None, exclude=None):
+        """
+        Returns the lowest scoring torrents that must leave the session to
+        bring `info_hash_list` within the budget.  Pinned torrents and
+        those in `exclude` are never selected.
+        """
+        if self._max_active <= 0 or len(info_hash_list) <= self._max_active:
+            return []
+        if now is None:
+            now = time.time()
+        candidates = []
+        for info_hash in info_hash_list:
+            if self.is_pinned(info_hash) or (exclude and exclude.has_key(info_hash)):
+                continue
+            candidates.append((self.get_score(info_hash, now), info_hash))
+        count = len(info_hash_list) - self._max_active
+        evictions = [info_hash for (score, info_hash) in heapq.nsmallest(count, candidates)]
+        self._evicted += len(evictions)
+        return evictions
+
+    def get_ranking(self, limit, now=None):
+        """
+        Returns up to `limit` info hashes, highest score first
+        """
+        return [info_hash for (info_hash, score) in self.get_scores(limit, now)]
+
+    def get_scores(self, limit, now=None):
+        """
+        Returns up to `limit` (info hash, score) tuples, highest score first
+        """
+        if now is None:
+            now = time.time()
+        scores = [(self._decay(score, now - last), info_hash)
+                  for (info_hash, (score, last)) in self._history.iteritems()]
+        return [(info_hash, score) for (score, info_hash) in heapq.nlargest(limit, scores)]
+
+    def load_scores(self, score_list, now=None):
+        """
+        Seed the history from saved (info hash, score) tuples, e.g. after
+        a restart.  Existing history is kept.
+        """
+        if now is None:
+            now = time.time()
+        for (info_hash, score) in score_list:
+            if not self._history.has_key(info_hash):
+                self._history[info_hash] = [score, now]
+
+    def _trim_history(self, now):
+        """
+        Drop the lowest scoring tenth of the history
+        """
+        keep = self.get_ranking(int(self._history_size * 0.9), now)
+        history = {}
+        for info_hash in keep:
+            history[info_hash] = self._history[info_hash]
+        self._history = history
+
+    def get_stats(self):
+        stats = {
+            'max_active': self._max_active,
+            'pinned': len(self._pinned),
+            'history_size': len(self._history),
+            'budget_evictions': self._evicted
+            }
+        return stats
@@ -0,0 +1,154 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import threading
+from Queue import Queue, Empty, Full
+from seedbank.server.alert_match import AlertMatch
+import terasaur.log.log_helper as log_helper
+
+class AlertLogWriter(threading.Thread):
+    def __init__(self, **kwargs):
+        """
+        Background writer for alert log lines.  AlertMatch objects hand
+        matched alerts to write(), which never blocks.  Alerts are formatted
+        and logged from this thread.
+
+        Lines are dropped and counted as suppressed when:
+            - the match object's log sample rate skips the alert
+            - the per alert type rate limit is exceeded
+            - the queue is full
+
+        :Parameters:
+            - `label`: String used to identify the writer in log output
+            - `queue_size`: Maximum number of queued log lines
+            - `rate_limit`: Maximum log lines per second for each alert
+                type.  0 disables rate limiting.
+            - `report_interval`: Seconds between suppressed line reports
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._label = kwargs.get('label', '')
+        self._queue = Queue(int(kwargs.get('queue_size', 10000)))
+        self._rate_limit = float(kwargs.get('rate_limit', 50))
+        self._report_interval = kwargs.get('report_interval', 60)
+        self._run = True
+        self._log = log_helper.get_logger(self.__class__.__name__)
+
+        # only touched from the calling thread in write()
+        self._buckets = {} # alert type -> [tokens, last refill time]
+        self._sample_counts = {} # alert type -> number of alerts seen
+
+        # shared with the writer thread
+        self._suppressed_lock = threading.Lock()
+        self._suppressed = {} # alert type -> lines suppressed since last report
+        self._total_suppressed = 0
+        self._total_written = 0
+
+    def write(self, match, alert):
+        """
+        Queue a matched alert for logging.  Called from the alert loop.
+        """
+        alert_type = match.get_type()
+        if alert_type == AlertMatch.ANY_TYPE:
+            alert_type = alert.what()
+
+        if not self._is_sampled(alert_type, match.get_log_sample_rate()) \
+                or not self._take_token(alert_type):
+            self._suppress(alert_type)
+            return
+
+        try:
+            self._queue.put_nowait((match, alert))
+        except Full:
+            self._suppress(alert_type)
+
+    def _is_sampled(self, alert_type, sample_rate):
+        if sample_rate <= 1:
+            return True
+        count = self._sample_counts.get(alert_type, 0)
+        self._sample_counts[alert_type] = count + 1
+        return count % sample_rate == 0
+
+    def _take_token(self, alert_type):
+        """
+        Token bucket allowing bursts of up to one second's worth of lines
+        """
+        if self._rate_limit <= 0:
+            return True
+        now = time.time()
+        bucket = self._buckets.get(alert_type)
+        if bucket is None:
+            bucket = [self._rate_limit, now]
+            self._buckets[alert_type] = bucket
+        else:
+            bucket[0] = min(self._rate_limit, bucket[0] + (now - bucket[1]) * self._rate_limit)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _suppress(self, alert_type):
+        self._suppressed_lock.acquire()
+        try:
+            self._suppressed[alert_type] = self._suppressed.get(alert_type, 0) + 1
+            self._total_suppressed += 1
+        finally:
+            self._suppressed_lock.release()
+
+    def run(self):
+        next_report = time.time() + self._report_interval
+        while self._run or not self._queue.empty():
+            try:
+                (match, alert) = self._queue.get(True, 1.0)
+                self._log.info(match.format_alert(alert))
+                self._total_written += 1
+            except Empty:
+                pass
+            except Exception, e:
+                self._log.error('(%s) Error writing alert log line: %s' % (self._label, str(e)))
+
+            if time.time() >= next_report:
+                self._report_suppressed()
+                next_report = time.time() + self._report_interval
+        self._report_suppressed()
+
+    def _report_suppressed(self):
+        self._suppressed_lock.acquire()
+        try:
+            suppressed = self._suppressed
+            self._suppressed = {}
+        finally:
+            self._suppressed_lock.release()
+
+        if suppressed:
+            counts = ', '.join(['%s: %i' % (k, v) for (k, v) in sorted(suppressed.items())])
+            self._log.info('(%s) Suppressed %i alert log lines (%s)' % (self._label, sum(suppressed.values()), counts))
+
+    def stop(self):
+        """
+        Writer thread exits after draining the queue
+        """
+        self._run = False
+
+    def get_stats(self):
+        stats = {
+            'log_lines_written': self._total_written,
+            'log_lines_suppressed': self._total_suppressed,
+            'log_queue_size': self._queue.qsize()
+            }
+        return stats
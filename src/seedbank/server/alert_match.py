@@ -14,6 +14,8 @@
 # limitations under the License.
 #
 
+import json
+import libtorrent as lt
 import terasaur.log.log_helper as log_helper
 
 class AlertMatchException(Exception): pass
@@ -21,7 +23,15 @@ class AlertMatchException(Exception): pass
 class AlertMatch(object):
     """
     Abstract class.  Do not instantiate directly.
+
+    Set type to ANY_TYPE to match alerts of every type.
+
+    Derived classes can restrict matches with field matches on typed
+    alert attributes (see _add_field_match), which are cheaper and more
+    stable than comparing formatted alert messages.
     """
+    ANY_TYPE = '*'
+
     def __init__(self, **kwargs):
         self._type = None
         self._message = None
@@ -29,6 +39,9 @@ class AlertMatch(object):
         self._match_count = 0
         self._expires_after = 1
         self._log_on_match = False
+        self._log_sample_rate = 1
+        self._log_writer = None
+        self._field_matches = [] # list of (name, getter, expected value)
         self._log = log_helper.get_logger(self.__class__.__name__)
         self.__init_from_kwargs(**kwargs)
 
@@ -46,34 +59,64 @@ class AlertMatch(object):
             self._expires_after = int(kwargs['expires_after'])
         if kwargs.has_key('log_on_match'):
             self._log_on_match = bool(kwargs['log_on_match'])
+        if kwargs.has_key('log_sample_rate'):
+            self._log_sample_rate = int(kwargs['log_sample_rate'])
 
-    def match(self, alert):
+    def match(self, alert, what=None):
         """
         Attempt match for given alert.  Returns True if matched, false
         otherwise.  Successful match also increments the match counter.
 
         Alert type must always match.  Alert message is only matched if
         a message is set in the match object.
+
+        Callers that already have the alert type string can pass it as
+        `what` to avoid another alert.what() call.
         """
         if not alert:
             raise AlertMatchException('Got null alert in AlertMatch::match')
 
-        matched = self._is_match(alert)
+        if what is None:
+            what = alert.what()
+        matched = self._is_match(alert, what)
         if matched:
             if not self.expired():
                 self._on_match(alert)
             self._match_count += 1
         return matched
 
-    def _is_match(self, alert):
+    def _is_match(self, alert, what):
         matched = True
-        if self._is_type_match(alert):
-            if self._message and not self._is_message_match(alert):
+        if self._is_type_match(what):
+            if self._field_matches and not self._is_field_match(alert):
+                matched = False
+            elif self._message and not self._is_message_match(alert):
                 matched = False
         else:
             matched = False
         return matched
 
+    def _add_field_match(self, name, getter, expected):
+        """
+        Require a typed alert attribute to equal an expected value.
+        `getter` is a function that takes the alert and returns the
+        attribute value.  Field matches are evaluated in the order added.
+        """
+        self._field_matches.append((name, getter, expected))
+
+    def _is_field_match(self, alert):
+        for (name, getter, expected) in self._field_matches:
+            try:
+                value = getter(alert)
+            except (AttributeError, RuntimeError):
+                # RuntimeError: handle accessors on an invalid torrent handle
+                value = None
+            if value != expected:
+                if self._verbose:
+                    self._log.info('***** Field mismatch (%s): %s != %s' % (name, value, expected))
+                return False
+        return True
+
     def _on_match(self, alert):
         """
         Override to trigger events when an alert is matched.
@@ -82,7 +125,26 @@ class AlertMatch(object):
             - the match object is not expired
         """
         if self._log_on_match:
-            self._log.info(self._get_alert_string(alert))
+            if self._log_writer:
+                self._log_writer.write(self, alert)
+            else:
+                self._log.info(self._get_alert_string(alert))
+
+    def set_log_writer(self, log_writer):
+        """
+        Send log_on_match output through an AlertLogWriter instead of
+        logging synchronously from the alert loop.
+        """
+        self._log_writer = log_writer
+
+    def get_log_sample_rate(self):
+        """
+        Log one of every N matched alerts when using an AlertLogWriter
+        """
+        return self._log_sample_rate
+
+    def format_alert(self, alert):
+        return self._get_alert_string(alert)
 
     def _get_alert_string(self, alert):
         """
@@ -97,9 +159,11 @@ class AlertMatch(object):
         else:
             return False
 
-    def _is_type_match(self, alert):
-        what = alert.what()
-        if str(what) == self._type:
+    def get_type(self):
+        return self._type
+
+    def _is_type_match(self, what):
+        if self._type == AlertMatch.ANY_TYPE or str(what) == self._type:
             return True
         else:
             if self._verbose:
@@ -121,6 +185,23 @@ class AlertMatch(object):
         s = 'AlertMatch: %s: %s' % (self._type, self._message)
         return s
 
+# mongodb_alert_code.hpp
+LOOKUP_METRICS_CODE = 206
+
+def _get_mongodb_alert_code(alert):
+    """
+    mongodb_plugin_alert isn't bound in python, the code is the "(code) "
+    prefix of the alert message
+    """
+    msg = alert.message()
+    end = msg.find(') ')
+    if not msg.startswith('(') or end < 0:
+        return None
+    try:
+        return int(msg[1:end])
+    except ValueError:
+        return None
+
 class MongodbAlertMatch(AlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'mongodb_plugin_alert'
@@ -130,19 +211,48 @@ class MongodbAlertMatch(AlertMatch):
             kwargs['message'] = '(%i) %s' % (self.code, kwargs['msg'])
         AlertMatch.__init__(self, **kwargs)
 
-class TorrentFinishedAlertMatch(AlertMatch):
+    def _on_match(self, alert):
+        # periodic lookup metrics go to the stats queue, not the log
+        if _get_mongodb_alert_code(alert) == LOOKUP_METRICS_CODE:
+            return
+        AlertMatch._on_match(self, alert)
+
+def _get_torrent_name(alert):
+    return alert.handle.name()
+
+def _get_info_hash(alert):
+    return str(alert.handle.info_hash())
+
+def _get_ip_address(alert):
+    return alert.ip[0]
+
+def _get_error_message(alert):
+    return alert.error.message()
+
+class TorrentAlertMatch(AlertMatch):
+    """
+    Base class for alerts about a single torrent.  Supports matching on
+    the torrent name (`torrent`) and `info_hash`.
+    """
+    def __init__(self, **kwargs):
+        AlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('torrent'):
+            self._add_field_match('torrent', _get_torrent_name, kwargs['torrent'])
+        if kwargs.has_key('info_hash'):
+            self._add_field_match('info_hash', _get_info_hash, str(kwargs['info_hash']))
+
+class TorrentFinishedAlertMatch(TorrentAlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'torrent_finished_alert'
-        if kwargs.has_key('torrent'):
-            kwargs['message'] = '%s torrent finished downloading' % (kwargs['torrent'])
-        AlertMatch.__init__(self, **kwargs)
+        TorrentAlertMatch.__init__(self, **kwargs)
 
 class ListenSucceededAlertMatch(AlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'listen_succeeded_alert'
-        if kwargs.has_key('ip_address') and kwargs.has_key('port'):
-            kwargs['message'] = 'successfully listening on %s:%i' % (kwargs['ip_address'], kwargs['port'])
         AlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('ip_address') and kwargs.has_key('port'):
+            endpoint = (kwargs['ip_address'], int(kwargs['port']))
+            self._add_field_match('endpoint', lambda alert: alert.endpoint, endpoint)
 
 class ListenFailedAlertMatch(AlertMatch):
     def __init__(self, **kwargs):
@@ -165,83 +275,66 @@ class IncomingConnectionAlertMatch(AlertMatch):
 
     def __init__(self, **kwargs):
         kwargs['type'] = 'incoming_connection_alert'
-        message = self.__get_message(**kwargs)
-        if message is not None:
-            kwargs['message'] = message
         AlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('ip_address') and kwargs.has_key('port'):
+            ip = (kwargs['ip_address'], int(kwargs['port']))
+            self._add_field_match('ip', lambda alert: alert.ip, ip)
+        if kwargs.has_key('socket_type'):
+            socket_type = self.__get_socket_type(kwargs['socket_type'])
+            self._add_field_match('socket_type', lambda alert: alert.socket_type, socket_type)
 
-    def __get_message(self, **kwargs):
-        if not (kwargs.has_key('ip_address') and kwargs.has_key('port') and kwargs.has_key('socket_type')):
-            return None
-        socket_type_str = IncomingConnectionAlertMatch._SOCKET_TYPE_LIST[kwargs['socket_type']]
-        message = 'incoming connection from %s:%u (%s)' % (kwargs['ip_address'], kwargs['port'], socket_type_str)
-        return message
+    def __get_socket_type(self, socket_type):
+        """
+        Accepts a socket type index or name (e.g. 'uTP')
+        """
+        if isinstance(socket_type, basestring):
+            return IncomingConnectionAlertMatch._SOCKET_TYPE_LIST.index(socket_type)
+        return int(socket_type)
 
-class PeerConnectAlertMatch(AlertMatch):
+class PeerAlertMatch(TorrentAlertMatch):
+    """
+    Base class for peer alerts.  Adds matching on the peer `ip_address`
+    and `client` name.
+    """
     def __init__(self, **kwargs):
-        kwargs['type'] = 'peer_connect_alert'
-        message = self.__get_message(**kwargs)
-        if message is not None:
-            kwargs['message'] = message
-        AlertMatch.__init__(self, **kwargs)
-
-    def __get_message(self, **kwargs):
-        if not kwargs.has_key('ip_address'):
-            return None
+        TorrentAlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('ip_address'):
+            self._add_field_match('ip_address', _get_ip_address, kwargs['ip_address'])
+        if kwargs.has_key('client'):
+            self._add_field_match('client', lambda alert: lt.identify_client(alert.pid), kwargs['client'])
 
-        client = kwargs.get('client', 'Unknown')
-        message = 'peer (%s, %s) connecting to peer' % (kwargs['ip_address'], client)
-        if kwargs.has_key('torrent'):
-            message = kwargs['torrent'] + ' ' + message
-        else:
-            message = ' -  ' + message
-        return message
+class PeerConnectAlertMatch(PeerAlertMatch):
+    def __init__(self, **kwargs):
+        kwargs['type'] = 'peer_connect_alert'
+        PeerAlertMatch.__init__(self, **kwargs)
 
-class PeerDisconnectedAlertMatch(AlertMatch):
+class PeerDisconnectedAlertMatch(PeerAlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'peer_disconnected_alert'
-        message = self.__get_message(**kwargs)
-        if message is not None:
-            kwargs['message'] = message
-        AlertMatch.__init__(self, **kwargs)
-
-    def __get_message(self, **kwargs):
-        if not (kwargs.has_key('ip_address') and kwargs.has_key('reason')):
-            return None
+        PeerAlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('reason'):
+            self._add_field_match('reason', _get_error_message, kwargs['reason'])
 
-        client = kwargs.get('client', 'Unknown')
-        message = 'peer (%s, %s) disconnecting: %s' % (kwargs['ip_address'], client, kwargs['reason'])
-        if kwargs.has_key('torrent'):
-            message = kwargs['torrent'] + ' ' + message
-        else:
-            message = ' -  ' + message
-        return message
-
-class FileErrorAlertMatch(AlertMatch):
+class FileErrorAlertMatch(TorrentAlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'file_error_alert'
-        message = self.__get_message(**kwargs)
-        if message is not None:
-            kwargs['message'] = message
-        AlertMatch.__init__(self, **kwargs)
-
-    def __get_message(self, **kwargs):
-        if not (kwargs.has_key('filename') and kwargs.has_key('filepath')):
-            return None
-
+        if kwargs.has_key('filename'):
+            kwargs['torrent'] = kwargs['filename']
+        TorrentAlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('filepath'):
+            self._add_field_match('filepath', lambda alert: alert.file, kwargs['filepath'])
         if kwargs.has_key('error'):
-            error = kwargs['error']
-        else:
-            error = 'No such file or directory'
-        message = '%s file (%s) error: %s' % (kwargs['filename'], kwargs['filepath'], error)
-        return message
+            self._add_field_match('error', _get_error_message, kwargs['error'])
+        elif kwargs.has_key('filename') and kwargs.has_key('filepath'):
+            # a match for a specific file waits for it to go missing
+            self._add_field_match('error', _get_error_message, 'No such file or directory')
 
-class TorrentErrorAlertMatch(AlertMatch):
+class TorrentErrorAlertMatch(TorrentAlertMatch):
     def __init__(self, **kwargs):
         kwargs['type'] = 'torrent_error_alert'
-        if kwargs.has_key('torrent') and kwargs.has_key('error'):
-            kwargs['message'] = '%s ERROR: %s' % (kwargs['torrent'], kwargs['error'])
-        AlertMatch.__init__(self, **kwargs)
+        TorrentAlertMatch.__init__(self, **kwargs)
+        if kwargs.has_key('error'):
+            self._add_field_match('error', _get_error_message, kwargs['error'])
 
 class TorrentStatsAlertMatch(AlertMatch):
     def __init__(self, **kwargs):
@@ -262,3 +355,38 @@ class TrackerErrorAlertMatch(AlertMatch):
         return s
 
 
+
+class CallbackAlertMatch(AlertMatch):
+    """
+    Hands every matched alert to `callback`.  The callback runs on the
+    alert watcher thread and must not block.
+    """
+    def __init__(self, **kwargs):
+        AlertMatch.__init__(self, **kwargs)
+        self._callback = kwargs.get('callback', None)
+        if not self._callback:
+            raise AlertMatchException('Missing callback in CallbackAlertMatch')
+
+    def _on_match(self, alert):
+        AlertMatch._on_match(self, alert)
+        self._callback(alert)
+
+class LookupMetricsAlertMatch(CallbackAlertMatch):
+    """
+    Hands the mongodb plugin's periodic lookup metrics, decoded from the
+    alert's JSON payload, to `callback`
+    """
+    def __init__(self, **kwargs):
+        kwargs['type'] = 'mongodb_plugin_alert'
+        CallbackAlertMatch.__init__(self, **kwargs)
+        self._add_field_match('code', _get_mongodb_alert_code, LOOKUP_METRICS_CODE)
+
+    def _on_match(self, alert):
+        AlertMatch._on_match(self, alert)
+        msg = alert.message()
+        try:
+            metrics = json.loads(msg[msg.find(') ') + 2:])
+        except ValueError, e:
+            self._log.error('Invalid lookup metrics alert: %s' % str(e))
+            return
+        self._callback(metrics)
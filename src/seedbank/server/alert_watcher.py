@@ -15,10 +15,10 @@
 #
 
 import sys
-import time
 import threading
 import libtorrent as lt
 from seedbank.server.alert_match import AlertMatch
+from seedbank.server.alert_log_writer import AlertLogWriter
 import terasaur.log.log_helper as log_helper
 
 class AlertWatcherException(Exception): pass
@@ -45,10 +45,19 @@ class AbstractAlertWatcher(object):
                 the end of every watch loop iteration.
             - `loop_limit`: Force stop after the given number of watch loop
                 iterations.  Useful for catching errors in automated tests.
-            - `tick_interval`: Number of seconds to sleep between watch loop
-                iterations.  Can be less than 1.  e.g. .001 == 1 millisecond
+            - `tick_interval`: Maximum number of seconds to block waiting
+                for a new alert between watch loop iterations.  The loop
+                wakes as soon as an alert is posted.  Can be less than 1.
+                e.g. .001 == 1 millisecond
             - `purge_expired`: Remove expired match objects from the list.
-                Necessary for long-running operation.
+                Necessary for long-running operation.  Defaults to True.
+                Expired match objects never see alerts either way.
+            - `async_logging`: Write log_on_match output from a background
+                :class:`AlertLogWriter` thread.  Defaults to True.
+            - `log_rate_limit`: Maximum log lines per second for each alert
+                type when `async_logging` is enabled.  0 disables the limit.
+            - `log_queue_size`: Maximum number of pending log lines when
+                `async_logging` is enabled.
 
         Raises :class:`AlertWatcherException` if `label` is empty
         """
@@ -56,14 +65,30 @@ class AbstractAlertWatcher(object):
         self._session = kwargs.get('session', None)
         self._verbose = bool(kwargs.get('verbose', False))
         self._match_list = {}
+        self._dispatch_table = {} # alert type -> list of (name, AlertMatch)
+        self._wildcard_matches = [] # (name, AlertMatch) for AlertMatch.ANY_TYPE
+        self._unexpired_count = 0
+        self._purged_count = 0
         self._match_all = bool(kwargs.get('match_all', True))
         self._watch_loop_callback = kwargs.get('watch_loop_callback', None)
         self._loop_limit = int(kwargs.get('loop_limit', 250))
         self._tick_interval = kwargs.get('tick_interval', 0.1)
-        self._purge_expired = bool(kwargs.get('purge_expired', False))
+        self._purge_expired = bool(kwargs.get('purge_expired', True))
         self._run = True
         self._log = log_helper.get_logger(self.__class__.__name__)
         self._log_all_alerts = False
+        self._log_writer = None
+        if kwargs.get('async_logging', True):
+            self._log_writer = AlertLogWriter(label=self._label,
+                                              rate_limit=kwargs.get('log_rate_limit', 50),
+                                              queue_size=kwargs.get('log_queue_size', 10000))
+
+        # alert batch counters, see get_stats()
+        self._alert_batches = 0
+        self._alerts_received = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._dropped_alerts = 0
 
         if kwargs.has_key('match_list'):
             self._add_match_items(kwargs['match_list'])
@@ -89,9 +114,11 @@ class AbstractAlertWatcher(object):
             - the loop count limit is reached
         """
         idx = 0
+        if self._log_writer:
+            self._log_writer.start()
         if self._verbose:
             self._log.info('(%s) Starting AlertWatcher' % self._label)
-            self._log.debug('(%s) Sleep interval: %s' % (self._label, str(self._tick_interval)))
+            self._log.debug('(%s) Alert wait interval: %s' % (self._label, str(self._tick_interval)))
         while self._run:
             if self._loop_limit > 0 and idx >= self._loop_limit:
                 if self._verbose:
@@ -108,22 +135,55 @@ class AbstractAlertWatcher(object):
                     self._log.info('(%s) Fully matched, exiting.' % self._label)
                 break
 
-            # TODO: purge expired here
-
             if self._watch_loop_callback is not None:
                 self._watch_loop_callback()
 
-            time.sleep(self._tick_interval)
+            self._wait_for_alert()
             if self._loop_limit > 0:
                 idx += 1
 
+        if self._log_writer:
+            self._log_writer.stop()
+
+    def _wait_for_alert(self):
+        """
+        Block until the session has a pending alert or the tick interval
+        passes.  The python binding releases the GIL while waiting.
+        """
+        self._session.wait_for_alert(int(self._tick_interval * 1000))
+
     def _match_alert(self, alert):
+        """
+        Only the match objects registered for the alert type (and wildcard
+        match objects) see the alert.  Match objects that expire are taken
+        out of the dispatch table.
+        """
+        what = alert.what()
         if self._log_all_alerts:
-            self._log.info('(%s) (%s) %s' % (self._label, alert.what(), alert.message()))
-        for name, match_item in self._match_list.iteritems():
-            matched = match_item.match(alert)
-            if matched and not self._match_all:
-                break
+            self._log.info('(%s) (%s) %s' % (self._label, what, alert.message()))
+        expired = []
+        for match_list in (self._dispatch_table.get(what, ()), self._wildcard_matches):
+            for (name, match_item) in match_list:
+                matched = match_item.match(alert, what)
+                if matched and match_item.expired():
+                    expired.append(name)
+                if matched and not self._match_all:
+                    break
+            else:
+                continue
+            break
+
+        for name in expired:
+            self._expire_match(name)
+
+    def _expire_match(self, name):
+        self._remove_from_dispatch_table(name, self._match_list[name])
+        self._unexpired_count -= 1
+        if self._purge_expired:
+            del self._match_list[name]
+            self._purged_count += 1
+            if self._verbose:
+                self._log.info('(%s) Purged expired alert match item (%s)' % (self._label, name))
 
     def stop(self):
         self._log.info('(%s) Stopping' % self._label)
@@ -132,19 +192,54 @@ class AbstractAlertWatcher(object):
         self._run = False
 
     def _get_alerts(self, ses):
-        alerts = []
-        alert = True
-        while alert:
-            alert = ses.pop_alert()
-            self.__get_alerts_handle_alert(alerts, alert)
+        """
+        Drain the whole session alert queue in one binding call
+        """
+        alerts = ses.pop_alerts()
+        self._update_batch_counters(ses, len(alerts))
+        if self._verbose:
+            for alert in alerts:
+                self._print_alert(alert)
         return alerts
 
-    def __get_alerts_handle_alert(self, alerts, alert):
-        if not alert:
+    def _update_batch_counters(self, ses, batch_size):
+        self._last_batch_size = batch_size
+        if batch_size == 0:
             return
-        alerts.append(alert)
-        if self._verbose:
-            self._print_alert(alert)
+        self._alert_batches += 1
+        self._alerts_received += batch_size
+        if batch_size > self._max_batch_size:
+            self._max_batch_size = batch_size
+
+        dropped = ses.num_dropped_alerts()
+        if dropped > self._dropped_alerts:
+            self._log.warning('(%s) Alert queue overflow, %i alerts dropped' % (self._label, dropped - self._dropped_alerts))
+            self._dropped_alerts = dropped
+
+    def get_last_batch_size(self):
+        return self._last_batch_size
+
+    def get_stats(self):
+        """
+        Returns a dict of alert batch and match object counters.
+        `dropped_alerts` counts alerts libtorrent discarded because the
+        alert queue was full.  `memory_estimate` is an approximate byte
+        count for the match objects and lookup tables.
+        """
+        stats = {
+            'alert_batches': self._alert_batches,
+            'alerts_received': self._alerts_received,
+            'last_batch_size': self._last_batch_size,
+            'max_batch_size': self._max_batch_size,
+            'dropped_alerts': self._dropped_alerts,
+            'match_count': len(self._match_list),
+            'unexpired_match_count': self._unexpired_count,
+            'purged_match_count': self._purged_count,
+            'memory_estimate': self._get_memory_estimate()
+            }
+        if self._log_writer:
+            stats.update(self._log_writer.get_stats())
+        return stats
 
     def _print_alert(self, alert):
         # stats alerts are too verbose
@@ -152,13 +247,22 @@ class AbstractAlertWatcher(object):
             return
         self._log.info('(%s) (%s): %s' % (self._label, alert.what(), alert.message()))
 
+    def _get_memory_estimate(self):
+        """
+        Approximate bytes held by the match containers and match objects
+        """
+        size = sys.getsizeof(self._match_list) + sys.getsizeof(self._dispatch_table) \
+            + sys.getsizeof(self._wildcard_matches)
+        for match_list in self._dispatch_table.itervalues():
+            size += sys.getsizeof(match_list)
+        for match in self._match_list.itervalues():
+            size += sys.getsizeof(match)
+            if hasattr(match, '__dict__'):
+                size += sys.getsizeof(match.__dict__)
+        return size
+
     def is_fully_matched(self):
-        match_done = True
-        for name, m in self._match_list.iteritems():
-            if not m.expired():
-                match_done = False
-                break
-        return match_done
+        return self._unexpired_count == 0
 
     def add_match(self, param_tuple):
         (name, klass, kwargs) = param_tuple
@@ -166,19 +270,49 @@ class AbstractAlertWatcher(object):
             raise AlertWatcherException('Duplicate alert match name: %s' % name)
 
         match = klass(**kwargs)
+        if self._log_writer:
+            match.set_log_writer(self._log_writer)
         self._match_list[name] = match
+        self._add_to_dispatch_table(name, match)
+        self._unexpired_count += 1
         if self._verbose:
             self._log.info('(%s) Added new alert match item (%s: %s)' % (self._label, name, klass.__name__))
 
     def remove_match(self, name):
         if self._match_list.has_key(name):
+            match = self._match_list[name]
+            # expired match objects are already out of the dispatch table
+            if not match.expired():
+                self._remove_from_dispatch_table(name, match)
+                self._unexpired_count -= 1
             del self._match_list[name]
 
+    def _add_to_dispatch_table(self, name, match):
+        match_type = match.get_type()
+        if match_type == AlertMatch.ANY_TYPE:
+            self._wildcard_matches.append((name, match))
+        else:
+            self._dispatch_table.setdefault(match_type, []).append((name, match))
+
+    def _remove_from_dispatch_table(self, name, match):
+        match_type = match.get_type()
+        if match_type == AlertMatch.ANY_TYPE:
+            self._wildcard_matches[:] = [e for e in self._wildcard_matches if e[0] != name]
+        else:
+            match_list = [e for e in self._dispatch_table[match_type] if e[0] != name]
+            if match_list:
+                self._dispatch_table[match_type] = match_list
+            else:
+                del self._dispatch_table[match_type]
+
     def has_match(self, name):
         return self._match_list.has_key(name)
 
     def _clear_matches(self):
         self._match_list.clear()
+        self._dispatch_table.clear()
+        del self._wildcard_matches[:]
+        self._unexpired_count = 0
 
 class UnthreadedAlertWatcher(AbstractAlertWatcher):
     def start(self):
@@ -216,3 +350,11 @@ class ThreadedAlertWatcher(AbstractAlertWatcher, threading.Thread):
         self._alert_list_lock.acquire()
         AbstractAlertWatcher._clear_matches(self)
         self._alert_list_lock.release()
+
+    def get_stats(self):
+        self._alert_list_lock.acquire()
+        try:
+            stats = AbstractAlertWatcher.get_stats(self)
+        finally:
+            self._alert_list_lock.release()
+        return stats
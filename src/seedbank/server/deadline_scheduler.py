@@ -0,0 +1,95 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import heapq
+import time
+
+class DeadlineScheduler(object):
+    """
+    Runs named periodic tasks from an event loop based on wall clock
+    deadlines.  The event loop blocks for get_timeout() seconds on its
+    own event source, then calls run() to execute any tasks that are due.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `max_wait`: Upper bound in seconds for get_timeout(), used
+                when no task is scheduled.
+        """
+        self._max_wait = kwargs.get('max_wait', 1.0)
+        self._heap = [] # (deadline, token, name)
+        self._tasks = {} # name -> (interval, callback, token)
+        self._token = 0
+
+    def add(self, name, interval, callback, delay=None):
+        """
+        Schedule callback to run every `interval` seconds.  The first run
+        happens after `delay` seconds, or after `interval` if not given.
+        Adding a task with an existing name replaces it.
+        """
+        if interval <= 0:
+            raise ValueError('Invalid scheduler interval for %s' % name)
+        if delay is None:
+            delay = interval
+        self._token += 1
+        self._tasks[name] = (interval, callback, self._token)
+        heapq.heappush(self._heap, (time.time() + delay, self._token, name))
+
+    def remove(self, name):
+        """
+        Stale heap entries are skipped in run()
+        """
+        if self._tasks.has_key(name):
+            del self._tasks[name]
+
+    def has_task(self, name):
+        return self._tasks.has_key(name)
+
+    def get_timeout(self):
+        """
+        Seconds until the next task is due, bounded by max_wait
+        """
+        self._discard_stale()
+        if not self._heap:
+            return self._max_wait
+        timeout = self._heap[0][0] - time.time()
+        return max(0, min(timeout, self._max_wait))
+
+    def run(self):
+        """
+        Execute every task whose deadline has passed.  Tasks are rescheduled
+        before they run so an exception doesn't stop the timer.
+        """
+        now = time.time()
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            (deadline, token, name) = heapq.heappop(self._heap)
+            (interval, callback, unused_token) = self._tasks[name]
+            next_deadline = deadline + interval
+            if next_deadline <= now:
+                # fell behind; don't try to catch up with missed runs
+                next_deadline = now + interval
+            heapq.heappush(self._heap, (next_deadline, token, name))
+            callback()
+            self._discard_stale()
+
+    def _discard_stale(self):
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _is_current(self, entry):
+        (deadline, token, name) = entry
+        return self._tasks.has_key(name) and self._tasks[name][2] == token
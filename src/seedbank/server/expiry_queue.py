@@ -0,0 +1,69 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import heapq
+
+class ExpiryQueue(object):
+    """
+    Min-heap of (deadline, key).  Each key has at most one current
+    deadline; rescheduling or removing a key leaves a stale heap entry
+    that is skipped when it reaches the top.  The heap is rebuilt when
+    stale entries outnumber current ones.
+    """
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {} # key -> current deadline
+
+    def schedule(self, key, deadline):
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        self._compact()
+
+    def remove(self, key):
+        if self._deadlines.has_key(key):
+            del self._deadlines[key]
+
+    def has_key(self, key):
+        return self._deadlines.has_key(key)
+
+    def pop_due(self, now):
+        """
+        Remove and return keys whose deadline is at or before `now`,
+        earliest first.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            (deadline, key) = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    def next_deadline(self):
+        while self._heap:
+            (deadline, key) = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, key) for (key, deadline) in self._deadlines.iteritems()]
+            heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._deadlines)
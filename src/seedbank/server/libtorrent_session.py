@@ -14,9 +14,11 @@
 # limitations under the License.
 #
 #@PydevCodeAnalysisIgnore
+import sys
 import time
 import binascii
 import multiprocessing
+from Queue import Empty
 
 import libtorrent as lt
 from seedbank.server.libtorrent_settings import get_server_settings
@@ -29,7 +31,11 @@ from seedbank.messaging.server_stats_publisher import ServerStatsPublisher
 from seedbank.server.torrent_manager import TorrentManager
 import terasaur.config.config_helper as config_helper
 from seedbank.server.session_queue_handler import ServerQueueHandler, ClientQueueHandler
-from seedbank.server.session_queue_item import LibtorrentSessionQueueItem
+from seedbank.server.session_queue_item import LibtorrentSessionQueueItem, BatchingQueueWriter, SessionQueueException, unpack_batch
+from seedbank.server.deadline_scheduler import DeadlineScheduler
+from seedbank.server.session_state import SessionStateFile
+from seedbank.server.torrent_state_table import TorrentStateTable
+from seedbank.server.alert_match import CallbackAlertMatch, LookupMetricsAlertMatch
 
 ALERT_MASK_DEFAULT = lt.alert.category_t.all_categories | lt.alert.category_t.stats_notification
 ALERT_MASK_STATS = lt.alert.category_t.all_categories
@@ -49,30 +55,50 @@ class LibtorrentSession(multiprocessing.Process):
 
         self._in_q = kwargs.get('in_queue', None) # Process.Queue
         self._out_q = kwargs.get('out_queue', None) # Process.Queue
+        self._out_writer = None
+        if self._out_q:
+            # outbound items are sent in one batch per event loop pass
+            self._out_writer = BatchingQueueWriter(self._out_q)
         self._queue_handler = None
         self._mongodb_plugin_params = kwargs.get('mongodb_plugin_params', None)
         self._peer_id = kwargs.get('peer_id', None)
         self._verbose = bool(kwargs.get('verbose', False))
         self._tick_interval = kwargs.get('tick_interval', 0.1)
         self._server_stats_publisher = None
+        self._lookup_metrics = None # latest mongodb plugin lookup metrics
         self._listen_min = int(kwargs.get('listen_min', 0))
         self._listen_max = int(kwargs.get('listen_max', 0))
+        self._shard_index = int(kwargs.get('shard_index', 0))
+        self._shard_count = int(kwargs.get('shard_count', 1))
 
-        # send updates to the session manager
-        self._update_counter = 0
-        self._update_interval = 10 # number of ticks between updates
+        # timers for the event loop
+        self._scheduler = DeadlineScheduler(max_wait=self._tick_interval * 10)
+
+        # counters shared with the session manager, see SessionTelemetry
+        self._telemetry = kwargs.get('telemetry', None)
+        self._telemetry_interval = kwargs.get('telemetry_interval', 1) # seconds
+        self._watcher_check_interval = 1 # seconds
+
+        # torrent status cache, fed by state_update_alert
+        self._torrent_state = TorrentStateTable()
+        self._torrent_update_interval = 1 # seconds
 
         # alert watcher
         self._watcher = None
         self._watcher_class = UnthreadedAlertWatcher # can override this in derived class
         self._watcher_loop_limit = int(kwargs.get('watcher_loop_limit', 250))
         self._watcher_match_list = kwargs.get('watcher_match_list', [])
+        self._alert_log_rate_limit = kwargs.get('alert_log_rate_limit', 50)
         self._stop_on_watcher_exit = bool(kwargs.get('stop_on_watcher_exit', False))
 
         # torrent manager
         self._torrent_manager = None
         self._torrent_manager_exec_interval = kwargs.get('torrent_manager_exec_interval', None) # seconds
         self._inactive_torrent_timeout = kwargs.get('inactive_torrent_timeout', None) # seconds
+        self._max_active_torrents = int(kwargs.get('max_active_torrents', 0))
+        self._popularity_half_life = kwargs.get('popularity_half_life', 3600) # seconds
+        self._pinned_torrents = kwargs.get('pinned_torrents', [])
+        self._report_torrent_access = False
 
     def run(self):
         """
@@ -83,6 +109,8 @@ class LibtorrentSession(multiprocessing.Process):
             self._run_pre()
             self._ses = self._create_session(self._listen_min, self._listen_max)
             self._watcher = self._create_alert_watcher()
+            for match_tuple in self._get_torrent_state_match_list():
+                self._watcher.add_match(match_tuple)
             self._torrent_manager = self._create_torrent_manager()
             self._run_before_loop()
             self._run_loop()
@@ -91,11 +119,14 @@ class LibtorrentSession(multiprocessing.Process):
             if self._verbose:
                 self._log.info('%s caught KeyboardInterrupt, exiting.' % self._label)
         except Exception, e:
-            if self._out_q:
-                item = LibtorrentSessionQueueItem(e.__class__.__name__, str(e))
-                self._out_q.put(item)
+            if self._out_writer:
+                data = {'exception': e.__class__.__name__, 'message': str(e)}
+                self._out_writer.put(LibtorrentSessionQueueItem('session_error', data))
+                self._out_writer.flush()
             if self._verbose:
                 self._log.error(str(e))
+            # non-zero exit code tells the session manager this was a crash
+            sys.exit(1)
 
     def _create_session(self, port_min, port_max):
         flags = 0
@@ -121,6 +152,7 @@ class LibtorrentSession(multiprocessing.Process):
                                 match_list=self._watcher_match_list,
                                 loop_limit=self._watcher_loop_limit,
                                 tick_interval=self._tick_interval,
+                                log_rate_limit=self._alert_log_rate_limit,
                                 verbose=self._verbose)
         return w
 
@@ -129,9 +161,14 @@ class LibtorrentSession(multiprocessing.Process):
             return None
         tm = TorrentManager(label=self._label,
                             verbose=self._verbose,
+                            torrent_state=self._torrent_state,
                             tick_interval=self._tick_interval,
                             exec_interval=self._torrent_manager_exec_interval,
-                            inactive_torrent_timeout=self._inactive_torrent_timeout
+                            inactive_torrent_timeout=self._inactive_torrent_timeout,
+                            max_active_torrents=self._max_active_torrents,
+                            popularity_half_life=self._popularity_half_life,
+                            pinned_torrents=self._pinned_torrents,
+                            report_access=self._report_torrent_access
                             )
         return tm
 
@@ -144,6 +181,53 @@ class LibtorrentSession(multiprocessing.Process):
     def _run_loop(self):
         pass
 
+    def _event_loop(self):
+        """
+        Block on the inbound control queue until a message arrives or the
+        next timer is due.  Alerts are handled by the watcher thread, which
+        blocks on the libtorrent alert queue.
+        """
+        self._init_timers()
+        while self._run:
+            self._handle_queue(self._scheduler.get_timeout())
+            if self._run:
+                self._scheduler.run()
+            self._out_writer.flush()
+            if self._telemetry:
+                self._telemetry.touch()
+
+    def _init_timers(self):
+        if self._telemetry:
+            self._scheduler.add('update_telemetry', self._telemetry_interval, self._update_telemetry, delay=0)
+        self._scheduler.add('check_watcher', self._watcher_check_interval, self._check_watcher)
+        self._scheduler.add('post_torrent_updates', self._torrent_update_interval, self._ses.post_torrent_updates)
+        if self._torrent_manager:
+            self._scheduler.add('torrent_manager',
+                                self._torrent_manager.get_exec_interval(),
+                                self._run_torrent_manager)
+
+    def _run_torrent_manager(self):
+        self._torrent_manager.execute(session=self)
+
+    def _get_torrent_state_match_list(self):
+        """
+        Keep the torrent state table in sync from the alert watcher thread
+        """
+        return [
+            ('torrent_state_update', CallbackAlertMatch, {'type': 'state_update_alert', 'expires_after': 0, 'callback': self._on_state_update}),
+            ('torrent_state_added', CallbackAlertMatch, {'type': 'torrent_added_alert', 'expires_after': 0, 'callback': self._on_torrent_added}),
+            ('torrent_state_removed', CallbackAlertMatch, {'type': 'torrent_removed_alert', 'expires_after': 0, 'callback': self._on_torrent_removed})
+            ]
+
+    def _on_state_update(self, alert):
+        self._torrent_state.update(alert.status)
+
+    def _on_torrent_added(self, alert):
+        self._torrent_state.add(alert.handle)
+
+    def _on_torrent_removed(self, alert):
+        self._torrent_state.remove(str(alert.info_hash))
+
     def _run_post(self):
         self._log.info('%s exiting...' % self._label)
         if self._verbose:
@@ -155,42 +239,62 @@ class LibtorrentSession(multiprocessing.Process):
             self._log.info('%s stopping' % self._label)
         self._run = False
 
-    def tick(self):
-        self._handle_queue()
-        self._check_watcher()
-        if self._torrent_manager:
-            self._torrent_manager.tick(session=self)
-        self._update_session_manager()
-
     def _check_watcher(self):
         """
         Common logic for checking the watcher and taking appropriate
-        action. Executed during tick().
+        action. Executed from the event loop scheduler.
         """
         if self._watcher.is_fully_matched():
-            self._out_q.put(LibtorrentSessionQueueItem('watcher_exited', True))
+            self._out_writer.put(LibtorrentSessionQueueItem('watcher_exited', True))
 
         if not self._watcher.is_alive() and self._stop_on_watcher_exit:
             self._log.info('Internal stop after alert watcher exit')
             self.stop()
 
-    def _handle_queue(self):
+    def _handle_queue(self, timeout):
+        """
+        Wait up to `timeout` seconds for an inbound batch, then handle its
+        items and anything else already queued.
+        """
         if not self._queue_handler:
             self._log.error('Missing queue handler in LibtorrentSession')
 
-        while self._in_q and not self._in_q.empty():
-            item = self._in_q.get()
-            self._queue_handler.handle(item)
-
-    def _update_session_manager(self):
-        if self._update_counter == 0:
-            # send update and reset counter
-            torrents = self._ses.get_torrents()
-            data = {'torrent_count': len(torrents)}
-            self._out_q.put(LibtorrentSessionQueueItem('update', data))
-            self._update_counter = self._update_interval
-        else:
-            self._update_counter -= 1
+        if not self._in_q:
+            time.sleep(timeout)
+            return
+
+        try:
+            envelope = self._in_q.get(block=True, timeout=timeout)
+            while envelope:
+                for item in unpack_batch(envelope):
+                    self._queue_handler.handle(item)
+                envelope = self._in_q.get(block=False)
+        except Empty:
+            pass
+        except IOError:
+            # Occurs when a signal is received while waiting in queue.get()
+            pass
+        except SessionQueueException, e:
+            self._log.error('Discarding inbound queue batch: %s' % str(e))
+
+    def _update_telemetry(self):
+        status = self._ses.status()
+        self._telemetry.update(torrent_count=len(self._torrent_state),
+                               num_peers=status.num_peers,
+                               upload_rate=status.upload_rate,
+                               download_rate=status.download_rate,
+                               up_bandwidth_queue=status.up_bandwidth_queue,
+                               down_bandwidth_queue=status.down_bandwidth_queue,
+                               in_queue_depth=self._get_in_queue_depth(),
+                               out_queue_depth=self._out_writer.get_pending_count(),
+                               alert_batch_size=self._watcher.get_last_batch_size())
+
+    def _get_in_queue_depth(self):
+        try:
+            return self._in_q.qsize()
+        except NotImplementedError:
+            # not available on every platform
+            return 0
 
     def _enable_stats(self, params):
         """
@@ -201,6 +305,13 @@ class LibtorrentSession(multiprocessing.Process):
             self._enable_torrent_stats(config)
         if not self._server_stats_publisher:
             self._server_stats_publisher = self._create_server_stats_publisher(config)
+            self._scheduler.add('server_stats_publisher',
+                                self._server_stats_publisher.get_exec_interval(),
+                                self._run_server_stats_publisher)
+
+    def _run_server_stats_publisher(self):
+        self._server_stats_publisher.execute(session=self._ses, watcher=self._watcher, torrent_state=self._torrent_state,
+                                             lookup_metrics=self._lookup_metrics)
 
     def _enable_torrent_stats(self, config):
         routing_key = config.get(config_helper.MQ_SECTION, 'stats_queue')
@@ -220,6 +331,8 @@ class LibtorrentSession(multiprocessing.Process):
                                          config=config,
                                          routing_key=routing_key,
                                          exec_interval=exec_interval,
+                                         shard_index=self._shard_index,
+                                         shard_count=self._shard_count,
                                          tick_interval=self._tick_interval,
                                          verbose=self._verbose)
         return publisher
@@ -227,6 +340,7 @@ class LibtorrentSession(multiprocessing.Process):
     def _disable_stats(self):
         self._ses.set_alert_mask(ALERT_MASK_DEFAULT)
         self._watcher.remove_match('torrent_stats_publisher')
+        self._scheduler.remove('server_stats_publisher')
         self._server_stats_publisher = None
 
 class LibtorrentServerSession(LibtorrentSession):
@@ -235,6 +349,17 @@ class LibtorrentServerSession(LibtorrentSession):
         LibtorrentSession.__init__(self, **kwargs)
         self._watcher_class = ThreadedAlertWatcher
         self._queue_handler = ServerQueueHandler(self)
+        self._report_torrent_access = True
+
+        # saved session state for warm restarts
+        self._state_file = None
+        if kwargs.get('state_file', None):
+            self._state_file = SessionStateFile(kwargs['state_file'])
+        self._state_save_interval = kwargs.get('state_save_interval', 60) # seconds
+        self._warm_start_rate = int(kwargs.get('warm_start_rate', 50)) # torrents per second
+        self._warm_start_count = int(kwargs.get('warm_start_count', 1000))
+        self._warm_start_list = []
+        self._filter_refresh_interval = int(kwargs.get('filter_refresh_interval', 3600)) # seconds
 
     def _run_before_loop(self):
         if not self._mongodb_plugin_params:
@@ -248,9 +373,12 @@ class LibtorrentServerSession(LibtorrentSession):
             self._log.info('torrent_file_root: ' + self._mongodb_plugin_params['torrent_file_root'])
 
         self._ses.add_extension('mongodb_torrent_db', self._mongodb_plugin_params)
+        self._watcher.add_match(('lookup_metrics', LookupMetricsAlertMatch,
+                                 {'expires_after': 0, 'callback': self._on_lookup_metrics}))
         self._log.info('Peer id: ' + binascii.a2b_hex(str(self._ses.id())))
         if self._verbose:
             self._log.info('Listening on ' + str(self._listen_min))
+            self._log.info('Shard %i of %i' % (self._shard_index + 1, self._shard_count))
 
         # additional plugins
         self._ses.add_extension('ut_metadata')
@@ -261,24 +389,117 @@ class LibtorrentServerSession(LibtorrentSession):
         #self._ses.add_extension('ut_pex')
         #self._ses.add_extension('lt_trackers')
 
+        self._load_saved_state()
+
+    def _on_lookup_metrics(self, metrics):
+        """
+        Runs on the alert watcher thread.  Replacing the reference is
+        atomic, the stats publisher reads whichever dict is current.
+        """
+        self._lookup_metrics = metrics
+
+    def _load_saved_state(self):
+        """
+        Restore DHT state and queue pinned torrents, then the most popular
+        torrents, for activation.  A bad state file shouldn't keep the
+        session from starting.
+        """
+        if not self._state_file:
+            return
+        try:
+            state = self._state_file.load()
+        except Exception, e:
+            self._log.error('Unable to load session state from %s: %s' % (self._state_file.get_path(), str(e)))
+            return
+        if not state:
+            return
+        self._ses.load_state(state['session'])
+        ranking = state['ranking']
+        if ranking:
+            if self._torrent_manager:
+                self._torrent_manager.get_active_set().load_scores(ranking)
+            warm_start_list = [info_hash for (info_hash, score) in ranking]
+        else:
+            # state saved before popularity ranking existed
+            warm_start_list = list(state['torrents'])
+        # pinned torrents go first
+        pinned = list(self._pinned_torrents)
+        warm_start_list = pinned + [info_hash for info_hash in warm_start_list if info_hash not in pinned]
+        self._warm_start_list = warm_start_list[:self._get_warm_start_limit()]
+        self._log.info('Loaded session state, %i torrents to activate' % len(self._warm_start_list))
+
+    def _get_warm_start_limit(self):
+        """
+        Don't warm start more torrents than the active torrent limit
+        allows, they would only be evicted again.
+        """
+        if self._max_active_torrents > 0:
+            return min(self._warm_start_count, self._max_active_torrents)
+        return self._warm_start_count
+
+    def _init_timers(self):
+        LibtorrentSession._init_timers(self)
+        if self._state_file:
+            self._scheduler.add('save_state', self._state_save_interval, self._save_state)
+        if self._warm_start_list:
+            self._scheduler.add('warm_start', 1, self._activate_saved_torrents, delay=0)
+        if self._filter_refresh_interval > 0:
+            self._scheduler.add('refresh_filter', self._filter_refresh_interval, self._refresh_filter)
+
+    def _activate_saved_torrents(self):
+        """
+        Activate a limited number of saved torrents per second through the
+        mongodb plugin, so a warm start doesn't flood the database.
+        """
+        batch = self._warm_start_list[:self._warm_start_rate]
+        del self._warm_start_list[:self._warm_start_rate]
+        for info_hash in batch:
+            # a peer may have activated it already
+            if self._torrent_state.get_idle_time(info_hash) is None:
+                # saved info hashes are hex, big_number wants the raw digest
+                self._ses.find_torrent(lt.big_number(binascii.a2b_hex(info_hash)))
+        if not self._warm_start_list:
+            self._scheduler.remove('warm_start')
+            if self._verbose:
+                self._log.info('Finished activating saved torrents')
+
+    def _refresh_filter(self):
+        """
+        The mongodb plugin rebuilds its info hash filter from the torrent
+        collection in the background
+        """
+        self._ses.send_extension_message({'action': 'refresh_filter'})
+
+    def _save_state(self):
+        info_hash_list = self._torrent_state.get_info_hashes()
+        ranking = None
+        if self._torrent_manager:
+            ranking = self._torrent_manager.get_active_set().get_scores(self._warm_start_count)
+        try:
+            self._state_file.save(self._ses, info_hash_list, ranking)
+        except Exception, e:
+            self._log.error('Unable to save session state to %s: %s' % (self._state_file.get_path(), str(e)))
+
+    def _run_post(self):
+        if self._state_file:
+            self._save_state()
+        LibtorrentSession._run_post(self)
+
     def _run_loop(self):
         if not self._run:
             return
         self._watcher.start()
         self._send_server_init_message()
-
-        while self._run:
-            self.tick()
-            time.sleep(self._tick_interval)
+        self._event_loop()
 
     def _send_server_init_message(self):
-        peer_id = str(self._ses.id())
-        self._out_q.put(LibtorrentSessionQueueItem('server_init', {'peer_id': peer_id}))
-
-    def tick(self):
-        super(LibtorrentServerSession, self).tick()
-        if self._server_stats_publisher:
-            self._server_stats_publisher.tick(session=self._ses)
+        data = {
+            'peer_id': str(self._ses.id()),
+            'listen_port': self._ses.listen_port(),
+            'shard_index': self._shard_index,
+            'shard_count': self._shard_count
+            }
+        self._out_writer.put(LibtorrentSessionQueueItem('server_init', data))
 
     def stop(self):
         super(LibtorrentServerSession, self).stop()
@@ -305,9 +526,7 @@ class LibtorrentClientSession(LibtorrentSession):
         if not self._run:
             return
         self._watcher.start()
-        while self._run:
-            self.tick()
-            time.sleep(self._tick_interval)
+        self._event_loop()
 
     def stop(self):
         super(LibtorrentClientSession, self).stop()
@@ -0,0 +1,172 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import fcntl
+import errno
+import select
+import threading
+import traceback
+import terasaur.log.log_helper as log_helper
+from seedbank.server.deadline_scheduler import DeadlineScheduler
+
+class Reactor(object):
+    """
+    select() based event loop for the SeedbankServer main thread.  Owns:
+        - readers: objects with a fileno(), handled when readable
+        - calls handed over from other threads with call_soon_threadsafe()
+        - named periodic timers, see DeadlineScheduler
+
+    Other threads never act on shared state themselves.  They queue a call,
+    which writes a byte to a wakeup pipe so select() returns immediately.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `max_wait`: Upper bound in seconds for a single select() wait
+            - `verbose`: Print tracebacks for callback errors
+        """
+        self._scheduler = DeadlineScheduler(max_wait=kwargs.get('max_wait', 1.0))
+        self._verbose = bool(kwargs.get('verbose', False))
+        self._reader_sources = [] # (source, callback)
+        self._calls = []
+        # reentrant, stop() may be called from a signal handler
+        self._calls_lock = threading.RLock()
+        (self._wake_r, self._wake_w) = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._run = False
+        self._log = log_helper.get_logger(self.__class__.__name__)
+
+    def add_reader_source(self, source, callback):
+        """
+        `source` is called before each wait and returns the objects to wait
+        on.  `callback` receives the list of readable objects from that
+        source.  Lets the owner of a changing set of pipes (e.g. the
+        SessionManager) keep ownership of it.
+        """
+        self._reader_sources.append((source, callback))
+
+    def add_timer(self, name, interval, callback, delay=None):
+        self._scheduler.add(name, interval, callback, delay)
+
+    def remove_timer(self, name):
+        self._scheduler.remove(name)
+
+    def call_soon_threadsafe(self, callback, *args, **kwargs):
+        """
+        Run callback on the reactor thread.  Safe to call from any thread.
+        """
+        self._calls_lock.acquire()
+        try:
+            self._calls.append((callback, args, kwargs))
+        finally:
+            self._calls_lock.release()
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError, e:
+            # pipe full means a wakeup is already pending
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        """
+        Loop until stop() is called.  Calls queued before the stop are
+        still run.
+        """
+        self._run = True
+        while self._run:
+            try:
+                self._run_once()
+            except Exception, e:
+                if self._verbose:
+                    traceback.print_exc()
+                self._log.error(str(e))
+        self._run_calls()
+
+    def stop(self):
+        """
+        Safe to call from any thread
+        """
+        self._run = False
+        self._wake()
+
+    def _run_once(self):
+        sources = [(source(), callback) for (source, callback) in self._reader_sources]
+        readers = [self._wake_r]
+        for (objects, callback) in sources:
+            readers.extend(objects)
+
+        try:
+            (ready, unused_w, unused_x) = select.select(readers, [], [], self._get_timeout())
+        except select.error, e:
+            # Occurs when a signal is received while waiting in select()
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = []
+
+        if self._wake_r in ready:
+            self._drain_wake_pipe()
+        self._run_calls()
+        for (objects, callback) in sources:
+            ready_objects = [obj for obj in objects if obj in ready]
+            if ready_objects:
+                callback(ready_objects)
+        self._scheduler.run()
+
+    def _get_timeout(self):
+        if self._calls:
+            return 0
+        return self._scheduler.get_timeout()
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def run_pending(self):
+        """
+        Run queued calls without waiting.  For use after run() returns,
+        e.g. to deliver publishes queued during shutdown.
+        """
+        self._run_calls()
+
+    def _run_calls(self):
+        self._calls_lock.acquire()
+        try:
+            calls = self._calls
+            self._calls = []
+        finally:
+            self._calls_lock.release()
+
+        for (callback, args, kwargs) in calls:
+            try:
+                callback(*args, **kwargs)
+            except Exception, e:
+                if self._verbose:
+                    traceback.print_exc()
+                self._log.error('Error in reactor call %s: %s' % (getattr(callback, '__name__', str(callback)), str(e)))
+
+    def close(self):
+        os.close(self._wake_r)
+        os.close(self._wake_w)
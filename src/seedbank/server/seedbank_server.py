@@ -14,20 +14,21 @@
 # limitations under the License.
 #
 
-import time
-import traceback
-
 from terasaur.log.log_init import LogInitMixin
 from terasaur.config.config_helper import MAIN_SECTION, MQ_SECTION
+from seedbank.config.config_defaults import UPLOAD_SECTION
 from terasaur.messaging.rabbitmq_consumer import RabbitMQConsumer
 from seedbank.messaging.server_control_handler import SeedbankControlMessageHandler
 from terasaur.messaging.rabbitmq_publisher import SelfManagingRabbitMQPublisher
 from seedbank.messaging.server_control_message import ServerInitMessage
 from terasaur.messaging.rabbitmq_connector import CONTENT_TYPE_BINARY
-from terasaur.db import mongodb_db, torrent_db
-from seedbank.db import upload_db
+from seedbank.db import catalog, upload_db
 from seedbank.server.session_manager import SessionManager
 from seedbank.server.upload_manager import UploadManager
+from seedbank.server.reactor import Reactor
+from seedbank.server.task_executor import TaskExecutor
+from seedbank.server.torrent_access_writer import TorrentAccessWriter
+from seedbank.messaging.reactor_publisher import ReactorPublisher
 import seedbank.server.shared as seedbank_shared
 
 class SeedbankServerException(Exception): pass
@@ -36,6 +37,10 @@ class SeedbankServer(LogInitMixin):
     def __init__(self, **kwargs):
         self.__init_from_kwargs(**kwargs)
         self._tick_interval = 0.5
+        self._summary_interval = 60 # seconds
+        self._reactor = None
+        self._executor = None
+        self._access_writer = None
         self._log = None
 
     def __init_from_kwargs(self, **kwargs):
@@ -52,31 +57,53 @@ class SeedbankServer(LogInitMixin):
         self._init_log(config)
         self._init_seedbank_db(config)
         seedbank_shared.session_manager = SessionManager(config=config, verbose=self._verbose, debug=self._debug)
-        seedbank_shared.session_manager.create('server', session_type='server', config=config, tick_interval=self._tick_interval)
+        seedbank_shared.session_manager.create_servers(config=config, tick_interval=self._tick_interval)
         seedbank_shared.upload_manager = UploadManager(config=config, verbose=self._verbose)
+        self._access_flush_interval = config.getint(MAIN_SECTION, 'last_accessed_flush_interval')
+        self._access_writer = TorrentAccessWriter(resolution=self._access_flush_interval)
+        self._reactor = self._create_reactor()
+        self._executor = TaskExecutor(label='worker', verbose=self._verbose)
+        self._executor.start()
         self._start_mq_connectors()
 
         try:
-            while seedbank_shared.session_manager.is_alive('server'):
-                try:
-                    self._handle_session_queues()
-                    seedbank_shared.session_manager.tick()
-                except Exception, e:
-                    if self._verbose:
-                        traceback.print_exc()
-                    self._log.error(str(e))
-                time.sleep(self._tick_interval)
-
+            self._reactor.run()
         except KeyboardInterrupt:
             pass
 
         self._stop_mq_connectors()
+        self._reactor.close()
         seedbank_shared.session_manager.join()
+        self._log.info('Session manager lock stats: %s' % seedbank_shared.session_manager.get_lock_stats())
         self._log.info('Exiting...')
 
     def stop(self):
         self._log.info('Stopping')
-        seedbank_shared.session_manager.stop()
+        if self._reactor:
+            self._reactor.call_soon_threadsafe(seedbank_shared.session_manager.stop)
+        else:
+            seedbank_shared.session_manager.stop()
+
+    def _create_reactor(self):
+        """
+        Everything that touches the session manager runs on the reactor
+        thread: session queue reads, control messages and periodic jobs.
+        """
+        reactor = Reactor(max_wait=self._tick_interval, verbose=self._verbose)
+        reactor.add_reader_source(seedbank_shared.session_manager.get_instances, self._handle_session_queues)
+        reactor.add_timer('session_manager', self._tick_interval, self._tick_session_manager)
+        reactor.add_timer('torrent_access', self._access_flush_interval, self._flush_access_times)
+        reactor.add_timer('server_summary', self._summary_interval, self._log_server_summary)
+        return reactor
+
+    def _flush_access_times(self):
+        if self._access_writer.get_pending_count() > 0:
+            self._executor.submit(self._access_writer.flush)
+
+    def _tick_session_manager(self):
+        seedbank_shared.session_manager.tick()
+        if not seedbank_shared.session_manager.has_live_server():
+            self._reactor.stop()
 
     def _get_config(self):
         return self._config_helper.get_config()
@@ -85,20 +112,40 @@ class SeedbankServer(LogInitMixin):
         LogInitMixin.__init__(self, config=config)
 
     def _init_seedbank_db(self, config):
-        mongodb_db.set_connection_params_from_config(config)
-        torrent_db.initialize()
-        upload_db.initialize()
+        """
+        Uploads are always tracked in mongodb, so a seed bank using the
+        local catalog without uploads runs with no database service.
+        """
+        catalog.configure(config)
+        catalog.get_backend().initialize()
+        if config.getboolean(UPLOAD_SECTION, 'allow_upload'):
+            upload_db.initialize()
 
-    def _handle_session_queues(self):
-        queue_items = seedbank_shared.session_manager.check_queues()
+    def _handle_session_queues(self, ready):
+        queue_items = seedbank_shared.session_manager.read_ready_queues(ready)
         for item in queue_items:
             if item.type == 'torrent_finished':
-                seedbank_shared.upload_manager.convert_to_torrent(info_hash=item.value['info_hash'])
+                # slow database and file work, keep it off the reactor thread
+                self._executor.submit(seedbank_shared.upload_manager.convert_to_torrent, info_hash=item.value['info_hash'])
+            if item.type == 'torrent_access':
+                self._access_writer.record(item.value)
             if item.type == 'server_init':
                 config = self._get_config()
-                msg = ServerInitMessage(seedbank_id=config.get(MAIN_SECTION, 'terasaur_seedbank_id'), peer_id=item.value['peer_id'])
+                msg = ServerInitMessage(seedbank_id=config.get(MAIN_SECTION, 'terasaur_seedbank_id'),
+                                        peer_id=item.value['peer_id'],
+                                        listen_port=item.value['listen_port'],
+                                        shard_index=item.value['shard_index'],
+                                        shard_count=item.value['shard_count'])
                 seedbank_shared.mq_out.publish(str(msg))
 
+    def _log_server_summary(self):
+        """
+        Log totals across server shards and session manager lock contention
+        """
+        summary = seedbank_shared.session_manager.get_server_summary()
+        self._log.info('Server sessions: %s' % summary)
+        self._log.info('Session manager lock stats: %s' % seedbank_shared.session_manager.get_lock_stats())
+
     """
     Message queue functions
     """
@@ -111,6 +158,11 @@ class SeedbankServer(LogInitMixin):
     def _stop_mq_connectors(self):
         """ Stop rabbitmq connections """
         self._stop_mq_in(seedbank_shared.mq_in)
+        # uploads being converted may still publish messages
+        self._executor.stop()
+        self._executor.join()
+        self._access_writer.flush()
+        self._reactor.run_pending()
         self._stop_mq_out(seedbank_shared.mq_out)
 
     def _start_mq_in(self, config):
@@ -118,7 +170,7 @@ class SeedbankServer(LogInitMixin):
         Initiate inbound consumer connection to rabbitmq
         """
         queue_name = config.get(MQ_SECTION, 'control_queue')
-        handler = SeedbankControlMessageHandler(server=self, verbose=self._verbose)
+        handler = SeedbankControlMessageHandler(server=self, reactor=self._reactor, verbose=self._verbose)
         seedbank_shared.mq_in = RabbitMQConsumer(config=config,
                                        handler=handler,
                                        queue_name=queue_name,
@@ -128,14 +180,16 @@ class SeedbankServer(LogInitMixin):
 
     def _start_mq_out(self, config):
         """
-        Initiate outbound publisher connection to rabbitmq
+        Initiate outbound publisher connection to rabbitmq.  Publishing from
+        any thread goes through the reactor thread.
         """
         routing_key = config.get(MQ_SECTION, 'terasaur_queue')
-        seedbank_shared.mq_out = SelfManagingRabbitMQPublisher(config=config,
-                                                     routing_key=routing_key,
-                                                     content_type=CONTENT_TYPE_BINARY,
-                                                     verbose=self._verbose,
-                                                     debug=self._debug)
+        publisher = SelfManagingRabbitMQPublisher(config=config,
+                                                  routing_key=routing_key,
+                                                  content_type=CONTENT_TYPE_BINARY,
+                                                  verbose=self._verbose,
+                                                  debug=self._debug)
+        seedbank_shared.mq_out = ReactorPublisher(publisher=publisher, reactor=self._reactor)
 
     def _stop_mq_in(self, mq_in):
         if self._debug:
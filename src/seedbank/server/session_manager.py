@@ -14,22 +14,32 @@
 # limitations under the License.
 #
 
+import os
 import multiprocessing
-import threading
 import time
 from Queue import Empty
 import terasaur.log.log_helper as log_helper
 from terasaur.config.config_helper import MAIN_SECTION, MONGODB_SECTION
 from seedbank.config.config_defaults import UPLOAD_SECTION
 from seedbank.server.libtorrent_session import LibtorrentServerSession, LibtorrentClientSession, LibtorrentSessionQueueItem
+from seedbank.server.session_queue_item import BatchingQueueWriter, unpack_batch
 import seedbank.server.alert_match as alert_match
 from terasaur.db.torrent_db import TORRENT_COLLECTION
 from terasaur.mixin.timestamp import TimestampMixin
+from seedbank.server.timed_lock import TimedLock
+from seedbank.server.session_telemetry import SessionTelemetry
+import seedbank.server.shard as shard
+
+class SessionManagerException(Exception): pass
 
 # Synchronization is cleaner when implemented at the module level
 # with a decorator.  The only caveat is that we can only have one
 # session manager.
-_SESSION_LOCK = threading.Semaphore()
+_SESSION_LOCK = TimedLock()
+_SESSION_LOCK_TIMEOUT = 1.0
+
+# telemetry counters added up across server shards
+_SUMMED_STATUS_FIELDS = ('torrent_count', 'num_peers', 'upload_rate', 'download_rate')
 
 def threading_guard(func):
     """
@@ -37,25 +47,15 @@ def threading_guard(func):
     block and risk deadlock.
     """
     def _wrap(*args, **kwargs):
+        # Fail, don't deadlock
+        if not _SESSION_LOCK.acquire(_SESSION_LOCK_TIMEOUT):
+            raise SessionManagerException('Unable to acquire session manager lock')
         try:
-            locked = False
-            count = 0
-            stop = 10
-            # Fail, don't deadlock
-            while locked is False and count < stop:
-                locked = _SESSION_LOCK.acquire(False)
-                time.sleep(0.1)
-                count += 1
-            if not locked:
-
-                raise Exception('Unable to acquire session manager lock')
             return func(*args, **kwargs)
         finally:
             _SESSION_LOCK.release()
     return _wrap
 
-class SessionManagerException(Exception): pass
-
 # TODO: do we really need threading guards on instances?
 class SessionInstance(TimestampMixin):
     def __init__(self, params):
@@ -66,16 +66,18 @@ class SessionInstance(TimestampMixin):
         """
         self.in_q = multiprocessing.Queue()
         self.out_q = multiprocessing.Queue()
-        self._queue_timeout = 0.5
+        self._in_writer = BatchingQueueWriter(self.in_q)
+        self.telemetry = SessionTelemetry()
         self._key = params['key']
         self._session_type = params['session_type']
-        self._torrent_count = 0
         self._stop_sent = False
+        self._last_error = None
         self.__init_session_process(params)
 
     def __init_session_process(self, params):
         params['in_queue'] = self.in_q
         params['out_queue'] = self.out_q
+        params['telemetry'] = self.telemetry
         if self.is_server():
             self.proc = LibtorrentServerSession(**params)
         else:
@@ -87,33 +89,77 @@ class SessionInstance(TimestampMixin):
 
     def stop(self):
         if self.in_q and not self._stop_sent:
-            self.in_q.put(LibtorrentSessionQueueItem('stop', True))
+            self.put(LibtorrentSessionQueueItem('stop', True))
             self._stop_sent = True
 
-    def check_queue(self):
-        item = None
-        try:
-            item = self.out_q.get(block=True, timeout=self._queue_timeout)
-        except Empty:
-            pass
-        except IOError:
-            # Occurs when a SIGTERM is received while waiting in queue.get()
-            pass
-
-        # intercept updates for the session manager
-        if item and item.type == 'update':
-            self._handle_update(item)
-            item = None
-        return item
-
-    def _handle_update(self, item):
-        self._torrent_count = item.value['torrent_count']
+    def put(self, item):
+        """
+        Buffer an item for the session process.  Sent on the next flush().
+        """
+        self._in_writer.put(item)
+
+    def flush(self):
+        self._in_writer.flush()
+
+    def fileno(self):
+        """
+        File descriptor of the reading end of the out queue pipe.  Allows
+        passing SessionInstance objects directly to select().
+        """
+        return self.out_q._reader.fileno()
+
+    def read_queue(self):
+        """
+        Drain all batches currently available in the out queue without
+        blocking.  Returns a list of queue items.
+        """
+        items = []
+        while True:
+            try:
+                envelope = self.out_q.get(block=False)
+            except Empty:
+                break
+            except IOError:
+                # Occurs when a SIGTERM is received while reading the queue
+                break
+
+            for item in unpack_batch(envelope):
+                # intercept crash reports for the session manager
+                if item.type == 'session_error':
+                    self._last_error = item.value
+                else:
+                    items.append(item)
+        return items
+
+    def get_last_error(self):
+        """
+        Returns the exception reported by the session process, or None
+        """
+        return self._last_error
+
+    def get_status(self):
+        """
+        Returns a snapshot of the session telemetry counters
+        """
+        return self.telemetry.read()
+
+    def get_key(self):
+        return self._key
 
     def is_server(self):
         return self._session_type == 'server'
 
     def has_active_torrents(self):
-        return self._torrent_count > 0
+        return self.telemetry.get_torrent_count() > 0
+
+    def is_stalled(self, timeout):
+        """
+        True if the session event loop hasn't run for `timeout` seconds
+        """
+        since_tick = self.telemetry.seconds_since_tick()
+        if since_tick is None:
+            return self.age() > timeout
+        return since_tick > timeout
 
     def age(self):
         """
@@ -130,6 +176,17 @@ class SessionManager(object):
     process has in and out queues for communication.
     """
     CLEANUP_MIN_AGE = 30
+    STALL_TIMEOUT = 60
+
+    # server session restart backoff, in seconds
+    RESTART_MIN_DELAY = 1
+    RESTART_MAX_DELAY = 300
+    # a session that ran this long before exiting starts over at the
+    # minimum delay
+    RESTART_RESET_AGE = 600
+
+    # queue items replayed to a restarted session, latest of each type
+    REPLAY_ITEM_TYPES = ('publish_stats',)
 
     def __init__(self, **kwargs):
         self._sessions = {}
@@ -137,6 +194,12 @@ class SessionManager(object):
         self._verbose = kwargs.get('verbose', False)
         self._debug = kwargs.get('debug', False)
         self._config = kwargs.get('config', None)
+        self._server_keys = []
+        self._stalled = {} # keys of sessions with a stalled event loop
+        self._session_kwargs = {} # key -> create() kwargs, for restarts
+        self._replay_items = {} # key -> {item type: LibtorrentSessionQueueItem}
+        self._pending_restarts = {} # key -> restart timestamp
+        self._restart_failures = {} # key -> consecutive crash count
         self._run = True
 
     @threading_guard
@@ -144,11 +207,26 @@ class SessionManager(object):
         if self._sessions.has_key(key):
             raise SessionManagerException('Session manager key already in use')
         self._sessions[key] = self._create_session(key, **kwargs)
+        self._session_kwargs[key] = kwargs
+
+    def create_servers(self, **kwargs):
+        """
+        Create one server session process per shard.  The number of shards
+        comes from the server_sessions config value.
+        """
+        config = kwargs.get('config', None)
+        shard_count = max(1, config.getint(MAIN_SECTION, 'server_sessions'))
+        self._server_keys = shard.get_server_keys(shard_count)
+        for index, key in enumerate(self._server_keys):
+            self.create(key, session_type='server', shard_index=index, shard_count=shard_count, **kwargs)
+
+    def get_server_keys(self):
+        return list(self._server_keys)
 
     def _create_session(self, key, **kwargs):
         s_type = kwargs.get('session_type', None)
         if s_type == 'server':
-            params = self._get_server_params(**kwargs)
+            params = self._get_server_params(key=key, **kwargs)
         else:
             params = self._get_client_params(**kwargs)
         params['key'] = key
@@ -160,13 +238,38 @@ class SessionManager(object):
     def send(self, key, item):
         """
         Put a LibtorrentSessionQueueItem in the inbound queue for the given
-        session instance key.
+        session instance key.  Items sent during one tick reach the session
+        process as a single batch, unless flush() is called sooner.
         """
         if self._sessions.has_key(key):
-            self._sessions[key].in_q.put(item)
+            self._sessions[key].put(item)
+            if item.type in SessionManager.REPLAY_ITEM_TYPES:
+                self._replay_items.setdefault(key, {})[item.type] = item
+        elif self._pending_restarts.has_key(key):
+            # delivered after the restart
+            if item.type in SessionManager.REPLAY_ITEM_TYPES:
+                self._replay_items.setdefault(key, {})[item.type] = item
         else:
             self._log.error('Cannot send message to a process that does not exist (%s)' % key)
 
+    def send_to_servers(self, item):
+        """
+        Put a queue item in the inbound queue of every server shard.
+        """
+        for key in self._server_keys:
+            self.send(key, item)
+
+    def send_by_info_hash(self, info_hash, item):
+        """
+        Put a queue item in the inbound queue of the server shard that owns
+        the given hex info hash.
+        """
+        if not self._server_keys:
+            self._log.error('Cannot send message for %s, no server sessions' % info_hash)
+            return
+        index = shard.get_shard_index(info_hash, len(self._server_keys))
+        self.send(self._server_keys[index], item)
+
     def stop(self, key=None):
         """
         Stop a session instance for the given key.  If no key is provided, stop
@@ -184,9 +287,42 @@ class SessionManager(object):
         else:
             self._log.error('Cannot stop a process that does not exist (%s)' % key)
 
+    def get_lock_stats(self):
+        """
+        Returns a dict of acquisition and contention counters for the
+        session manager lock.  See TimedLock.
+        """
+        return _SESSION_LOCK.get_stats()
+
     def is_alive(self, key):
         return self._sessions.has_key(key) and self._sessions[key].proc.is_alive()
 
+    def has_live_server(self):
+        """
+        True while any server session is running or waiting to restart
+        """
+        for key in self._server_keys:
+            if self.is_alive(key) or self._pending_restarts.has_key(key):
+                return True
+        return False
+
+    @threading_guard
+    def get_server_summary(self):
+        """
+        Returns totals of the telemetry counters across server shards.
+        """
+        summary = {'server_sessions': len(self._server_keys), 'live_server_sessions': 0}
+        for name in _SUMMED_STATUS_FIELDS:
+            summary[name] = 0
+        for key in self._server_keys:
+            if not self._sessions.has_key(key):
+                continue
+            summary['live_server_sessions'] += 1
+            status = self._sessions[key].get_status()
+            for name in _SUMMED_STATUS_FIELDS:
+                summary[name] += status.get(name, 0)
+        return summary
+
     def join(self, key=None):
         """
         Force join on a session process.  If no key is specified, wait for all
@@ -218,6 +354,20 @@ class SessionManager(object):
         if not self._run:
             self._stop_all()
         self._cleanup()
+        self._restart_pending()
+        self._flush_queues()
+
+    def flush(self):
+        """
+        Send buffered queue items now instead of on the next tick.  Used
+        after handling control messages, which shouldn't wait for a tick.
+        """
+        self._flush_queues()
+
+    @threading_guard
+    def _flush_queues(self):
+        for instance in self._sessions.itervalues():
+            instance.flush()
 
     @threading_guard
     def _stop_all(self):
@@ -240,12 +390,93 @@ class SessionManager(object):
                 self._log.info('Cleaning up stopped session %s' % key)
                 instance.proc.join()
                 del self._sessions[key]
+                if self._stalled.has_key(key):
+                    del self._stalled[key]
+                if self._should_restart_instance(instance):
+                    self._schedule_restart(key, instance)
+                else:
+                    self._forget_session(key)
+                continue
+
+            self._check_stalled(key, instance)
 
             # Remove sessions that have no torrents
             if self._should_stop_instance(instance):
                 self._log.info('Stopping session %s due to lack of active torrents' % key)
                 instance.stop()
 
+    def _check_stalled(self, key, instance):
+        """
+        Log once when a session's event loop stops updating its telemetry
+        block, and once when it recovers.
+        """
+        stalled = instance.is_stalled(SessionManager.STALL_TIMEOUT)
+        if stalled and not self._stalled.has_key(key):
+            self._log.warning('Session %s event loop has not run for %i seconds' % (key, SessionManager.STALL_TIMEOUT))
+            self._stalled[key] = True
+        elif not stalled and self._stalled.has_key(key):
+            self._log.info('Session %s event loop running again' % key)
+            del self._stalled[key]
+
+    def _should_restart_instance(self, instance):
+        """
+        Server sessions run until they are told to stop.  Any other exit
+        is treated as a crash.
+        """
+        return self._run and instance.is_server() and not instance.is_stopping()
+
+    def _schedule_restart(self, key, instance):
+        error = instance.get_last_error()
+        if error:
+            reason = '%s: %s' % (error['exception'], error['message'])
+        else:
+            reason = 'exit code %s' % str(instance.proc.exitcode)
+
+        failures = self._restart_failures.get(key, 0)
+        if instance.age() >= SessionManager.RESTART_RESET_AGE:
+            failures = 0
+        delay = min(SessionManager.RESTART_MAX_DELAY,
+                    SessionManager.RESTART_MIN_DELAY * 2 ** failures)
+        self._restart_failures[key] = failures + 1
+        self._pending_restarts[key] = time.time() + delay
+        self._log.error('Session %s exited unexpectedly (%s), restarting in %i seconds' % (key, reason, delay))
+
+    def _restart_pending(self):
+        """
+        Recreate crashed sessions whose backoff delay has passed, then
+        replay state changing items such as publish_stats.
+        """
+        if not self._run:
+            self._pending_restarts.clear()
+            return
+        now = time.time()
+        for key in self._pending_restarts.keys():
+            if self._pending_restarts[key] > now:
+                continue
+            self._log.info('Restarting session %s (attempt %i)' % (key, self._restart_failures[key]))
+            instance = self._restart_session(key)
+            if instance:
+                for item in self._replay_items.get(key, {}).itervalues():
+                    instance.put(item)
+
+    @threading_guard
+    def _restart_session(self, key):
+        try:
+            instance = self._create_session(key, **self._session_kwargs[key])
+        except Exception, e:
+            self._log.error('Unable to restart session %s: %s' % (key, str(e)))
+            self._pending_restarts[key] = time.time() + SessionManager.RESTART_MAX_DELAY
+            return None
+        self._sessions[key] = instance
+        # failure count is kept so repeated crashes keep backing off
+        del self._pending_restarts[key]
+        return instance
+
+    def _forget_session(self, key):
+        for registry in (self._session_kwargs, self._replay_items, self._pending_restarts, self._restart_failures):
+            if registry.has_key(key):
+                del registry[key]
+
     def _should_stop_instance(self, instance):
         if not instance.is_server() \
                 and not instance.is_stopping() \
@@ -256,13 +487,22 @@ class SessionManager(object):
             return False
 
     @threading_guard
-    def check_queues(self):
+    def get_instances(self):
+        """
+        Session instances can be passed to select(), see SessionInstance.fileno
+        """
+        return self._sessions.values()
+
+    @threading_guard
+    def read_ready_queues(self, ready):
+        """
+        Returns all items from the out queues of the given instances
+        """
         items = []
-        for key, instance in self._sessions.iteritems():
-            item = instance.check_queue()
-            if item:
+        for instance in ready:
+            for item in instance.read_queue():
                 if self._verbose:
-                    self._log.info('Got item from queue (%s):' % key)
+                    self._log.info('Got item from queue (%s):' % instance.get_key())
                     self._log.info('%s: %s' % (item.type, item.value))
                 items.append(item)
         return items
@@ -280,14 +520,34 @@ class SessionManager(object):
     def _get_server_params(self, **kwargs):
         params = self._get_general_params(**kwargs)
         config = kwargs.get('config', None)
+        shard_index = kwargs.get('shard_index', 0)
+        shard_count = kwargs.get('shard_count', 1)
         mongodb_plugin_params = self._get_mongodb_plugin_params(config)
+        mongodb_plugin_params['shard_index'] = str(shard_index)
+        mongodb_plugin_params['shard_count'] = str(shard_count)
         server_alerts = self._get_server_alert_match_list(config)
-        params['listen_min'] = config.getint(MAIN_SECTION, 'listen_port')
-        params['listen_max'] = config.getint(MAIN_SECTION, 'listen_port')
+        # each shard listens on its own port, starting at listen_port
+        listen_port = config.getint(MAIN_SECTION, 'listen_port') + shard_index
+        params['listen_min'] = listen_port
+        params['listen_max'] = listen_port
+        params['shard_index'] = shard_index
+        params['shard_count'] = shard_count
+        state_root = config.get(MAIN_SECTION, 'session_state_root')
+        params['state_file'] = os.path.join(state_root, kwargs['key'] + '.state')
+        params['max_active_torrents'] = config.getint(MAIN_SECTION, 'max_active_torrents')
+        params['popularity_half_life'] = config.getint(MAIN_SECTION, 'popularity_half_life')
+        params['pinned_torrents'] = self._get_pinned_torrents(config)
+        params['warm_start_rate'] = config.getint(MAIN_SECTION, 'warm_start_rate')
+        params['warm_start_count'] = config.getint(MAIN_SECTION, 'warm_start_count')
+        params['filter_refresh_interval'] = config.getint(MONGODB_SECTION, 'lookup_filter_refresh_interval')
         params['mongodb_plugin_params'] = mongodb_plugin_params
         params['watcher_match_list'] = server_alerts
         return params
 
+    def _get_pinned_torrents(self, config):
+        value = config.get(MAIN_SECTION, 'pinned_torrents')
+        return [info_hash.strip().lower() for info_hash in value.split(',') if info_hash.strip()]
+
     def _get_general_params(self, **kwargs):
         config = kwargs.get('config', None)
         tick_interval = kwargs.get('tick_interval', None)
@@ -299,6 +559,7 @@ class SessionManager(object):
             'stop_on_watcher_exit': False,
             'inactive_torrent_timeout': config.getint(MAIN_SECTION, 'inactive_torrent_timeout'),
             'torrent_manager_exec_interval': config.getint(MAIN_SECTION, 'torrent_manager_exec_interval'),
+            'alert_log_rate_limit': config.getint(MAIN_SECTION, 'alert_log_rate_limit'),
             'session_type': kwargs.get('session_type', 'client')
             }
         return params
@@ -312,7 +573,23 @@ class SessionManager(object):
         params = {
             'connection_string': db_host + ':' + str(db_port),
             'torrentdb_ns': db_name + '.' + TORRENT_COLLECTION,
-            'torrent_file_root': torrent_file_root}
+            'torrent_file_root': torrent_file_root,
+            'catalog_backend': config.get(MAIN_SECTION, 'catalog_backend'),
+            'catalog_index_path': config.get(MAIN_SECTION, 'catalog_index_path'),
+            'lookup_threads': str(config.getint(MONGODB_SECTION, 'lookup_threads')),
+            'cache_size': str(config.getint(MONGODB_SECTION, 'lookup_cache_size')),
+            'cache_ttl': str(config.getint(MONGODB_SECTION, 'lookup_cache_ttl')),
+            'cache_negative_ttl': str(config.getint(MONGODB_SECTION, 'lookup_cache_negative_ttl')),
+            'filter_fpr': str(config.getfloat(MONGODB_SECTION, 'lookup_filter_fpr')),
+            'pool_size': str(config.getint(MONGODB_SECTION, 'pool_size')),
+            'query_timeout': str(config.getfloat(MONGODB_SECTION, 'query_timeout')),
+            'reconnect_backoff_min': str(config.getint(MONGODB_SECTION, 'reconnect_backoff_min')),
+            'reconnect_backoff_max': str(config.getint(MONGODB_SECTION, 'reconnect_backoff_max')),
+            'breaker_threshold': str(config.getint(MONGODB_SECTION, 'breaker_threshold')),
+            'breaker_reset': str(config.getint(MONGODB_SECTION, 'breaker_reset')),
+            'health_check_interval': str(config.getint(MONGODB_SECTION, 'health_check_interval')),
+            'torrent_info_cache_mb': str(config.getint(MONGODB_SECTION, 'torrent_info_cache_mb')),
+            'metrics_interval': str(config.getint(MONGODB_SECTION, 'lookup_metrics_interval'))}
         return params
 
     def _get_server_alert_match_list(self, config):
@@ -321,13 +598,15 @@ class SessionManager(object):
         return alerts
 
     def _get_client_alert_match_list(self, config):
+        # connection alerts are the highest volume on a busy server
+        sample_rate = config.getint(MAIN_SECTION, 'alert_log_sample_rate')
         alerts = [
             ('listen_succeeded', alert_match.ListenSucceededAlertMatch, {'expires_after': 0, 'log_on_match': True}),
             ('listen_failed', alert_match.ListenFailedAlertMatch, {'expires_after': 0, 'log_on_match': True}),
             ('torrent_finished', alert_match.TorrentFinishedAlertMatch, {'expires_after': 0, 'log_on_match': True}),
-            ('incoming_connection', alert_match.IncomingConnectionAlertMatch, {'expires_after': 0, 'log_on_match': True}),
-            ('peer_connect', alert_match.PeerConnectAlertMatch, {'expires_after': 0, 'log_on_match': True}),
-            ('peer_disconnect', alert_match.PeerDisconnectedAlertMatch, {'expires_after': 0, 'log_on_match': True}),
+            ('incoming_connection', alert_match.IncomingConnectionAlertMatch, {'expires_after': 0, 'log_on_match': True, 'log_sample_rate': sample_rate}),
+            ('peer_connect', alert_match.PeerConnectAlertMatch, {'expires_after': 0, 'log_on_match': True, 'log_sample_rate': sample_rate}),
+            ('peer_disconnect', alert_match.PeerDisconnectedAlertMatch, {'expires_after': 0, 'log_on_match': True, 'log_sample_rate': sample_rate}),
             ('file_error', alert_match.FileErrorAlertMatch, {'expires_after': 0, 'log_on_match': True}),
             ('torrent_error', alert_match.TorrentErrorAlertMatch, {'expires_after': 0, 'log_on_match': True}),
             ('tracker_error', alert_match.TrackerErrorAlertMatch, {'expires_after': 0, 'log_on_match': True})
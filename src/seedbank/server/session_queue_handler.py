@@ -62,6 +62,15 @@ class ServerQueueHandler(LibtorrentSessionQueueHandler):
     def _delegate(self, item):
         if item.type == 'publish_stats':
             self._handle_publish_stats(item.value)
+        if item.type == 'invalidate_torrent':
+            self._handle_invalidate_torrent(item.value)
+
+    def _handle_invalidate_torrent(self, params):
+        """
+        Drop the mongodb plugin's cached lookup for a torrent
+        """
+        message = {'action': 'invalidate', 'info_hash': str(params['info_hash'])}
+        self.session._ses.send_extension_message(message)
 
     def _handle_publish_stats(self, params):
         if not self.session._watcher:
@@ -14,11 +14,92 @@
 # limitations under the License.
 #
 
+import threading
+
+# Version of the batch envelope written by BatchingQueueWriter
+QUEUE_SCHEMA_VERSION = 1
+
+class SessionQueueException(Exception): pass
+
 class LibtorrentSessionQueueItem(object):
+    __slots__ = ('type', 'value')
+
     def __init__(self, item_type, value):
         self.type = item_type
         self.value = value
 
+    def __reduce__(self):
+        return (LibtorrentSessionQueueItem, (self.type, self.value))
+
     def __str__(self):
         s = 'QueueItem(' + self.type + ': ' + str(self.value) + ')'
         return s
+
+class BatchingQueueWriter(object):
+    """
+    Buffers queue items and writes everything buffered since the last
+    flush() to a multiprocessing queue as a single envelope:
+
+        (QUEUE_SCHEMA_VERSION, ((type, value), (type, value), ...))
+
+    One pickle and one pipe write per flush instead of one per item.  The
+    reader passes each envelope to unpack_batch().
+    """
+    def __init__(self, queue):
+        """
+        :Parameters:
+            - `queue`: multiprocessing.Queue to write envelopes to
+        """
+        self._queue = queue
+        self._pending = []
+        self._lock = threading.Lock()
+        self._batches_sent = 0
+        self._items_sent = 0
+
+    def put(self, item):
+        self._lock.acquire()
+        try:
+            self._pending.append((item.type, item.value))
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """
+        Write buffered items as one envelope.  Does nothing if the buffer
+        is empty.
+        """
+        self._lock.acquire()
+        try:
+            pending = self._pending
+            self._pending = []
+        finally:
+            self._lock.release()
+
+        if not pending:
+            return
+        self._queue.put((QUEUE_SCHEMA_VERSION, tuple(pending)))
+        self._batches_sent += 1
+        self._items_sent += len(pending)
+
+    def get_pending_count(self):
+        return len(self._pending)
+
+    def get_stats(self):
+        stats = {
+            'batches_sent': self._batches_sent,
+            'items_sent': self._items_sent
+            }
+        return stats
+
+def unpack_batch(envelope):
+    """
+    Returns the list of LibtorrentSessionQueueItem objects in an envelope
+    written by BatchingQueueWriter.
+    """
+    try:
+        (version, entries) = envelope
+    except (TypeError, ValueError):
+        raise SessionQueueException('Invalid session queue envelope')
+    if version != QUEUE_SCHEMA_VERSION:
+        raise SessionQueueException('Unsupported session queue schema version: %s' % str(version))
+    return [LibtorrentSessionQueueItem(item_type, value) for (item_type, value) in entries]
@@ -0,0 +1,89 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import libtorrent as lt
+
+class SessionStateException(Exception): pass
+
+class SessionStateFile(object):
+    """
+    Bencoded snapshot of a libtorrent session, written periodically by a
+    server session so a restarted process can warm up quickly:
+        - `session`: libtorrent session state (settings, DHT state)
+        - `torrents`: hex info hashes of the active torrents
+        - `ranking`: [info hash, score] pairs of the most popular torrents,
+            hottest first.  Scores are stored in thousandths since bencode
+            has no floats.  Missing from older state files.
+        - `saved`: unix timestamp
+
+    Settings aren't saved; they always come from the configuration.
+    """
+    SAVE_FLAGS = int(lt.save_state_flags_t.save_dht_state)
+
+    def __init__(self, path):
+        self._path = path
+
+    def get_path(self):
+        return self._path
+
+    def save(self, ses, info_hash_list, ranking=None):
+        """
+        Write to a temporary file and rename, so a crash while saving
+        never leaves a truncated state file behind.
+
+        :Parameters:
+            - `ses`: :class: libtorrent.session
+            - `info_hash_list`: Active torrents
+            - `ranking`: Optional list of (info hash, score) tuples
+        """
+        state = {
+            'session': ses.save_state(SessionStateFile.SAVE_FLAGS),
+            'torrents': list(info_hash_list),
+            'ranking': [[info_hash, int(score * 1000)] for (info_hash, score) in (ranking or [])],
+            'saved': int(time.time())
+            }
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self._path + '.tmp'
+        fp = open(tmp_path, 'wb')
+        try:
+            fp.write(lt.bencode(state))
+        finally:
+            fp.close()
+        os.rename(tmp_path, self._path)
+
+    def load(self):
+        """
+        Returns the saved state dict, or None if no state has been saved.
+        """
+        if not os.path.exists(self._path):
+            return None
+        fp = open(self._path, 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        state = lt.bdecode(data)
+        if not state or not state.has_key('session') or not state.has_key('torrents'):
+            raise SessionStateException('Invalid session state file: %s' % self._path)
+        ranking = []
+        for (info_hash, score) in state.get('ranking', []):
+            ranking.append((info_hash, score / 1000.0))
+        state['ranking'] = ranking
+        return state
@@ -0,0 +1,111 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawValue
+
+TELEMETRY_VERSION = 1
+
+class _TelemetryBlock(ctypes.Structure):
+    _fields_ = [
+        ('version', ctypes.c_uint32),
+        ('sequence', ctypes.c_uint32), # odd while a write is in progress
+        ('last_tick', ctypes.c_double),
+        ('last_update', ctypes.c_double),
+        ('torrent_count', ctypes.c_int32),
+        ('num_peers', ctypes.c_int32),
+        ('upload_rate', ctypes.c_int32),
+        ('download_rate', ctypes.c_int32),
+        ('up_bandwidth_queue', ctypes.c_int32),
+        ('down_bandwidth_queue', ctypes.c_int32),
+        ('in_queue_depth', ctypes.c_int32),
+        ('out_queue_depth', ctypes.c_int32),
+        ('alert_batch_size', ctypes.c_int32)
+        ]
+
+# counters set by SessionTelemetry.update()
+COUNTER_FIELDS = tuple([name for (name, ctype) in _TelemetryBlock._fields_
+                        if name not in ('version', 'sequence', 'last_tick', 'last_update')])
+
+class SessionTelemetry(object):
+    """
+    Fixed layout block of session counters in shared memory.  Created by
+    the session manager before the session process is forked.  The session
+    process is the only writer; the manager reads the block directly, with
+    no queue traffic or pickling.
+
+    Writes bump a sequence number before and after changing the block so a
+    reader can detect and retry a read that overlapped a write.
+    """
+    READ_RETRIES = 10
+
+    def __init__(self):
+        self._block = RawValue(_TelemetryBlock)
+        self._block.version = TELEMETRY_VERSION
+
+    def touch(self):
+        """
+        Record that the session event loop is running
+        """
+        self._block.last_tick = time.time()
+
+    def update(self, **kwargs):
+        """
+        Set counters.  Names must be in COUNTER_FIELDS.
+        """
+        block = self._block
+        block.sequence += 1
+        try:
+            for (name, value) in kwargs.iteritems():
+                setattr(block, name, int(value))
+            block.last_update = time.time()
+        finally:
+            block.sequence += 1
+
+    def read(self):
+        """
+        Returns a dict snapshot of the block.  The snapshot may be torn if
+        the writer is updating continuously, which isn't expected.
+        """
+        block = self._block
+        for i in xrange(SessionTelemetry.READ_RETRIES):
+            sequence = block.sequence
+            if sequence % 2 == 0:
+                data = self._copy(block)
+                if block.sequence == sequence:
+                    break
+        else:
+            data = self._copy(block)
+        return data
+
+    def _copy(self, block):
+        data = {'last_tick': block.last_tick, 'last_update': block.last_update}
+        for name in COUNTER_FIELDS:
+            data[name] = getattr(block, name)
+        return data
+
+    def get_torrent_count(self):
+        return self._block.torrent_count
+
+    def seconds_since_tick(self):
+        """
+        Returns seconds since the session event loop last ran, or None if
+        it has not run yet.
+        """
+        if not self._block.last_tick:
+            return None
+        return time.time() - self._block.last_tick
@@ -0,0 +1,44 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Division of the torrent catalog between server session processes.  Each
+shard owns an equal range of the leading 32 bits of the info hash.  Must
+agree with mongodb_torrent_db_plugin::_in_shard in libtorrent.
+"""
+
+SERVER_KEY_PREFIX = 'server'
+
+def get_shard_index(info_hash, shard_count):
+    """
+    Returns the index of the shard that owns a hex info hash string.
+    """
+    if shard_count <= 1:
+        return 0
+    prefix = int(str(info_hash)[:8], 16)
+    return (prefix * shard_count) >> 32
+
+def get_server_key(shard_index, shard_count):
+    """
+    Session manager key for a server shard.  A single server session keeps
+    the plain 'server' key.
+    """
+    if shard_count <= 1:
+        return SERVER_KEY_PREFIX
+    return '%s-%i' % (SERVER_KEY_PREFIX, shard_index)
+
+def get_server_keys(shard_count):
+    return [get_server_key(i, shard_count) for i in range(max(1, shard_count))]
@@ -0,0 +1,74 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import traceback
+from Queue import Queue
+import terasaur.log.log_helper as log_helper
+
+class TaskExecutor(object):
+    """
+    Small pool of worker threads for slow jobs (database writes, file
+    moves) that shouldn't block the reactor thread.  Tasks run in the
+    order they were submitted when there is one worker.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `label`: Thread name prefix
+            - `workers`: Number of worker threads
+            - `verbose`: Print tracebacks for task errors
+        """
+        self._label = kwargs.get('label', 'executor')
+        self._verbose = bool(kwargs.get('verbose', False))
+        self._queue = Queue()
+        self._threads = []
+        self._log = log_helper.get_logger(self.__class__.__name__)
+        for i in range(int(kwargs.get('workers', 1))):
+            thread = threading.Thread(target=self._work, name='%s-%i' % (self._label, i))
+            thread.daemon = True
+            self._threads.append(thread)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        self._queue.put((func, args, kwargs))
+
+    def stop(self):
+        """
+        Workers exit after finishing the tasks already submitted
+        """
+        for thread in self._threads:
+            self._queue.put(None)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            (func, args, kwargs) = task
+            try:
+                func(*args, **kwargs)
+            except Exception, e:
+                if self._verbose:
+                    traceback.print_exc()
+                self._log.error('(%s) Task error: %s' % (self._label, str(e)))
@@ -0,0 +1,100 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import threading
+
+class TimedLock(object):
+    """
+    Non-reentrant lock with a timed, blocking acquire.  Returns
+    immediately when the lock is free and waits on a condition variable
+    (not a sleep loop) when it is held by another thread.
+
+    Keeps counters for monitoring lock pressure:
+        - `acquired`: number of successful acquisitions
+        - `contended`: acquisitions that found the lock already held
+        - `timeouts`: acquisitions that gave up after the deadline
+        - `total_wait`: seconds spent waiting by contended acquisitions
+        - `max_wait`: longest single wait in seconds
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._locked = False
+        self._acquired = 0
+        self._contended = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self, timeout):
+        """
+        Acquire the lock, waiting no longer than `timeout` seconds.
+        Returns True if the lock was acquired, False otherwise.
+        """
+        self._cond.acquire()
+        try:
+            if not self._locked:
+                self._locked = True
+                self._acquired += 1
+                return True
+
+            self._contended += 1
+            start = time.time()
+            deadline = start + timeout
+            while self._locked:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            self._record_wait(time.time() - start)
+            if self._locked:
+                self._timeouts += 1
+                return False
+            self._locked = True
+            self._acquired += 1
+            return True
+        finally:
+            self._cond.release()
+
+    def release(self):
+        self._cond.acquire()
+        try:
+            if not self._locked:
+                raise RuntimeError('Release of unlocked TimedLock')
+            self._locked = False
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _record_wait(self, wait):
+        self._total_wait += wait
+        if wait > self._max_wait:
+            self._max_wait = wait
+
+    def get_stats(self):
+        self._cond.acquire()
+        try:
+            stats = {
+                'acquired': self._acquired,
+                'contended': self._contended,
+                'timeouts': self._timeouts,
+                'total_wait': self._total_wait,
+                'max_wait': self._max_wait
+                }
+        finally:
+            self._cond.release()
+        return stats
@@ -0,0 +1,99 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import terasaur.log.log_helper as log_helper
+from seedbank.db import catalog
+
+class TorrentAccessWriter(object):
+    """
+    Collects torrent access times reported by server sessions and writes
+    them to the torrent records' last_accessed field in bulk.
+
+    Access times are rounded down to `resolution` seconds, so each flush
+    issues one update per distinct rounded time rather than one per
+    torrent.  Stored values are at most `resolution` seconds early, and
+    late by at most the flush interval.
+
+    record() is called from the reactor thread, flush() from a worker.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `resolution`: Seconds to round access times to
+        """
+        self._resolution = int(kwargs.get('resolution', 60))
+        self._lock = threading.Lock()
+        self._pending = {} # info hash -> latest access time
+        self._flush_lock = threading.Lock()
+        self._written = 0
+        self._errors = 0
+        self._log = log_helper.get_logger(self.__class__.__name__)
+
+    def record(self, access_dict):
+        """
+        :Parameters:
+            - `access_dict`: info hash -> unix access time
+        """
+        self._lock.acquire()
+        try:
+            for (info_hash, timestamp) in access_dict.iteritems():
+                if timestamp > self._pending.get(info_hash, 0):
+                    self._pending[info_hash] = timestamp
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """
+        Write pending access times.  On a database error the batch is
+        returned to the pending set for the next flush.
+        """
+        self._flush_lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                pending = self._pending
+                self._pending = {}
+            finally:
+                self._lock.release()
+            if not pending:
+                return
+
+            buckets = {} # rounded time -> info hash list
+            for (info_hash, timestamp) in pending.iteritems():
+                rounded = int(timestamp) - int(timestamp) % self._resolution
+                buckets.setdefault(rounded, []).append(info_hash)
+            try:
+                for (timestamp, info_hash_list) in buckets.iteritems():
+                    catalog.get_backend().update_last_accessed(timestamp, info_hash_list)
+                self._written += len(pending)
+            except Exception, e:
+                self._errors += 1
+                self._log.error('Error writing torrent access times: %s' % str(e))
+                self.record(pending)
+        finally:
+            self._flush_lock.release()
+
+    def get_pending_count(self):
+        return len(self._pending)
+
+    def get_stats(self):
+        stats = {
+            'pending': len(self._pending),
+            'written': self._written,
+            'errors': self._errors
+            }
+        return stats
@@ -14,21 +14,43 @@
 # limitations under the License.
 #
 
+import time
 import libtorrent as lt
 import terasaur.log.log_helper as log_helper
 from seedbank.messaging.libtorrent_status import TorrentStatusPrinter
 from seedbank.mixin.tick_counter import TickCounterMixin
 from seedbank.server.session_queue_item import LibtorrentSessionQueueItem
+from seedbank.server.expiry_queue import ExpiryQueue
+from seedbank.server.active_set import ActiveSetPolicy
+
+class TorrentManagerException(Exception): pass
 
 class TorrentManager(TickCounterMixin):
     """
     Encapsulates logic for adding/removing torrents to the libtorrent session.  This
     includes tracking uploads and expiring inactive torrents.
+
+    The session's TorrentStateTable says which torrents the session holds,
+    with their handles and idle times.  Each torrent sits in an expiry
+    queue keyed by the earliest time it could become inactive, so a run
+    only checks torrents whose deadline has passed.
+
+    Activations and transfer activity are recorded in an ActiveSetPolicy.
+    Popular torrents get longer idle timeouts, and when the session holds
+    more than `max_active_torrents` the least popular are removed first.
+    Pinned torrents and uploads in progress are never removed.
+
+    With `report_access` set, access times seen since the previous run are
+    sent to the server process as a torrent_access queue item, to be
+    written to the torrent records' last_accessed field.
     """
     def __init__(self, **kwargs):
         TickCounterMixin.__init__(self, **kwargs)
         self._verbose = kwargs.get('verbose', False)
         self._label = kwargs.get('key', '')
+        self._torrent_state = kwargs.get('torrent_state', None) # TorrentStateTable
+        if self._torrent_state is None:
+            raise TorrentManagerException('Missing torrent state table')
         self._log = log_helper.get_logger(self.__class__.__name__)
         self._torrents = {} # tracked torrents
 
@@ -40,38 +62,124 @@ class TorrentManager(TickCounterMixin):
         # torrent timeout values
         self._inactive_torrent_timeout = kwargs.get('inactive_torrent_timeout', 60)
 
+        # popularity tracking; an active run counts as a fraction of an activation
+        self._active_set = ActiveSetPolicy(max_active=kwargs.get('max_active_torrents', 0),
+                                           half_life=kwargs.get('popularity_half_life', 3600),
+                                           pinned=kwargs.get('pinned_torrents', []))
+        self._activity_weight = float(self.get_exec_interval()) / self._inactive_torrent_timeout
+
+        # access times for last_accessed write-back
+        self._report_access = bool(kwargs.get('report_access', False))
+        self._accessed = {} # info hash -> unix time
+
+        # expiry tracking
+        self._expiry = ExpiryQueue()
+
     def _tick(self, **kwargs):
         """
-        Called from TickCounterMixin::tick
+        Called from TickCounterMixin::tick or TickCounterMixin::execute
 
         :Parameters:
             - `session`: :class: LibtorrentSession
         """
         try:
             session = kwargs.get('session', None) # LibtorrentSession object
+            self._handle_added_torrents()
+            self._handle_torrent_updates()
             self._check_libtorrent_torrents(session._ses)
+            self._enforce_budget(session._ses)
+            self._send_access_times(session)
             self._check_torrents(session)
         except Exception, e:
             self._log.error(str(e))
 
+    def _handle_added_torrents(self):
+        """
+        Schedule torrents added to the session since the last run.  New
+        torrents can't expire before a full timeout has passed.  Removed
+        torrents are forgotten when their deadline comes up.
+        """
+        now = time.time()
+        deadline = now + self._inactive_torrent_timeout
+        for info_hash in self._torrent_state.pop_added():
+            self._expiry.schedule(info_hash, deadline)
+            self._record_access(info_hash, now)
+
     def _check_libtorrent_torrents(self, lt_session):
-        torrents = lt_session.get_torrents()
-        for torrent in torrents:
-            if self._printer:
-                self._printer.print_single(torrent)
-            self._check_expiration(lt_session, torrent)
+        now = time.time()
+        for info_hash in self._expiry.pop_due(now):
+            torrent = self._torrent_state.get_handle(info_hash)
+            if not torrent or not torrent.is_valid():
+                self._forget_torrent(info_hash)
+                continue
+            self._check_expiration(lt_session, torrent, info_hash, now)
+
+    def _check_expiration(self, lt_session, torrent, info_hash, now):
+        """
+        Remove the torrent if it is inactive, otherwise schedule the next
+        check for the earliest time it could become inactive.
+        """
+        timeout = self._active_set.get_timeout(info_hash, self._inactive_torrent_timeout, now)
+        if self._active_set.is_pinned(info_hash):
+            self._expiry.schedule(info_hash, now + timeout)
+            return
+        idle = self._get_idle_time(torrent, info_hash)
+        if idle > timeout:
+            self._log.info('Removing inactive torrent: %s (%s)' % (torrent.name(), info_hash))
+            self._remove_torrent(lt_session, torrent)
+        else:
+            self._expiry.schedule(info_hash, now + timeout - idle + 1)
 
-    def _check_expiration(self, lt_session, torrent):
-        if self._is_expired(torrent):
-            self._log.info('Removing inactive torrent: %s (%s)' % (torrent.name(), torrent.info_hash()))
+    def _enforce_budget(self, lt_session):
+        evictions = self._active_set.select_evictions(self._torrent_state.get_info_hashes(), exclude=self._torrents)
+        for info_hash in evictions:
+            torrent = self._torrent_state.get_handle(info_hash)
+            if not torrent or not torrent.is_valid():
+                self._forget_torrent(info_hash)
+                continue
+            self._log.info('Removing unpopular torrent over active torrent limit: %s' % info_hash)
             self._remove_torrent(lt_session, torrent)
 
-    def _is_expired(self, torrent):
+    def _get_idle_time(self, torrent, info_hash):
+        """
+        Seconds since the torrent last transferred data in either direction
+        """
+        idle = self._torrent_state.get_idle_time(info_hash)
+        if idle is not None:
+            return idle
         s = torrent.status()
-        if s.time_since_download > self._inactive_torrent_timeout and s.time_since_upload > self._inactive_torrent_timeout:
-            return True
-        else:
-            return False
+        return min(s.time_since_download, s.time_since_upload)
+
+    def _record_access(self, info_hash, now, weight=1.0):
+        self._active_set.record_access(info_hash, now, weight)
+        if self._report_access:
+            self._accessed[info_hash] = now
+
+    def _send_access_times(self, session):
+        if not self._accessed:
+            return
+        session._out_writer.put(LibtorrentSessionQueueItem('torrent_access', self._accessed))
+        self._accessed = {}
+
+    def _handle_torrent_updates(self):
+        """
+        Record transfer activity reported since the last run
+        """
+        now = time.time()
+        for status in self._torrent_state.pop_updated():
+            if status.upload_rate > 0 or status.download_rate > 0:
+                self._record_access(str(status.info_hash), now, self._activity_weight)
+            if self._printer:
+                self._printer.print_status(status)
+
+    def _forget_torrent(self, info_hash):
+        self._expiry.remove(info_hash)
+
+    def get_torrent_count(self):
+        return len(self._torrent_state)
+
+    def get_active_set(self):
+        return self._active_set
 
     def _check_torrents(self, session):
         keys = self._torrents.keys()
@@ -99,7 +207,7 @@ class TorrentManager(TickCounterMixin):
             'torrent_root': torrent.save_path()
             }
         item = LibtorrentSessionQueueItem('torrent_finished', message)
-        session._out_q.put(item)
+        session._out_writer.put(item)
 
     def add_torrent(self, session, params):
         info_hash = params['info_hash']
@@ -136,6 +244,7 @@ class TorrentManager(TickCounterMixin):
         info_hash = str(torrent.info_hash())
         if self._torrents.has_key(info_hash):
             del self._torrents[info_hash]
+        self._forget_torrent(info_hash)
 
     def add_peer(self, session, params):
         if len(self._torrents) < 1:
@@ -0,0 +1,182 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import threading
+
+class TorrentStateTable(object):
+    """
+    Cache of libtorrent torrent_status objects, keyed by hex info hash.
+    Fed incrementally from state_update_alert, which only carries torrents
+    whose status changed since the last session.post_torrent_updates()
+    call, so readers never poll every torrent handle.
+
+    libtorrent stops reporting a torrent once its transfer rates drop to
+    zero.  The table records when each torrent was last active, so idle
+    time can be computed from the clock instead of another status call,
+    and rates of entries that haven't been updated recently are treated
+    as zero.
+
+    The table is also the session's record of which torrents it holds, with
+    a torrent handle for each.  Torrents are added and removed from
+    torrent_added_alert and torrent_removed_alert.
+
+    Updated from the alert watcher thread, read from the session thread.
+    """
+    def __init__(self, **kwargs):
+        """
+        :Parameters:
+            - `stale_after`: Seconds without an update after which an
+                entry's rates no longer count in get_totals()
+        """
+        self._stale_after = kwargs.get('stale_after', 5)
+        self._entries = {} # info hash -> [status, updated, last_active, handle, added]
+        self._added = [] # info hashes added since the last pop_added()
+        self._changed = set() # info hashes updated since the last pop_updated()
+        self._lock = threading.Lock()
+        self._updates_received = 0
+
+    def update(self, status_list):
+        """
+        Store statuses from a state_update_alert
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            for status in status_list:
+                info_hash = str(status.info_hash)
+                idle = min(status.time_since_download, status.time_since_upload)
+                entry = self._entries.get(info_hash, None)
+                if entry:
+                    entry[0:3] = [status, now, now - max(0, idle)]
+                else:
+                    self._entries[info_hash] = [status, now, now - max(0, idle), status.handle, now]
+                    self._added.append(info_hash)
+                self._changed.add(info_hash)
+            self._updates_received += len(status_list)
+        finally:
+            self._lock.release()
+
+    def add(self, handle):
+        """
+        Track a torrent before its first status update.  New torrents
+        count as active from the time they are added.
+        """
+        info_hash = str(handle.info_hash())
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if not self._entries.has_key(info_hash):
+                self._entries[info_hash] = [None, now, now, handle, now]
+                self._added.append(info_hash)
+        finally:
+            self._lock.release()
+
+    def remove(self, info_hash):
+        self._lock.acquire()
+        try:
+            if self._entries.has_key(info_hash):
+                del self._entries[info_hash]
+        finally:
+            self._lock.release()
+
+    def get_status(self, info_hash):
+        """
+        Returns the last reported torrent_status, or None
+        """
+        entry = self._entries.get(info_hash, None)
+        if entry:
+            return entry[0]
+        return None
+
+    def get_handle(self, info_hash):
+        """
+        Returns the torrent handle, or None if the torrent isn't in the
+        table
+        """
+        entry = self._entries.get(info_hash, None)
+        if entry:
+            return entry[3]
+        return None
+
+    def get_idle_time(self, info_hash):
+        """
+        Seconds since the torrent last transferred data, or None if the
+        torrent isn't in the table.
+        """
+        entry = self._entries.get(info_hash, None)
+        if not entry:
+            return None
+        return time.time() - entry[2]
+
+    def get_info_hashes(self):
+        self._lock.acquire()
+        try:
+            return self._entries.keys()
+        finally:
+            self._lock.release()
+
+    def pop_updated(self):
+        """
+        Returns the latest statuses of torrents updated since the previous
+        call that are still in the table, and forgets them
+        """
+        self._lock.acquire()
+        try:
+            changed = self._changed
+            self._changed = set()
+            return [self._entries[info_hash][0] for info_hash in changed
+                    if self._entries.has_key(info_hash)]
+        finally:
+            self._lock.release()
+
+    def pop_added(self):
+        """
+        Returns info hashes of torrents added since the previous call that
+        are still in the table, and forgets them
+        """
+        self._lock.acquire()
+        try:
+            added = self._added
+            self._added = []
+            return [info_hash for info_hash in added if self._entries.has_key(info_hash)]
+        finally:
+            self._lock.release()
+
+    def get_totals(self):
+        """
+        Returns a dict of counts and rates summed over all torrents
+        """
+        totals = {'num_torrents': 0, 'num_peers': 0, 'upload_rate': 0, 'download_rate': 0}
+        fresh_after = time.time() - self._stale_after
+        self._lock.acquire()
+        try:
+            totals['num_torrents'] = len(self._entries)
+            for (status, updated, last_active, handle, added) in self._entries.itervalues():
+                if status is None or updated < fresh_after:
+                    continue
+                totals['num_peers'] += status.num_peers
+                totals['upload_rate'] += status.upload_rate
+                totals['download_rate'] += status.download_rate
+        finally:
+            self._lock.release()
+        return totals
+
+    def get_updates_received(self):
+        return self._updates_received
+
+    def __len__(self):
+        return len(self._entries)
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-from terasaur.db import torrent_db
+from seedbank.db import catalog
 from seedbank.torrent.torrent_file import TorrentFile
 from terasaur.torrent.util import is_valid_info_hash
 from terasaur.mixin.timestamp import TimestampMixin
@@ -22,9 +22,10 @@ from terasaur.mixin.timestamp import TimestampMixin
 class TorrentException(Exception): pass
 
 """
-Persistent torrent object, data stored in mongodb
+Persistent torrent object, data stored in the catalog backend (mongodb or
+the local catalog index)
 
-Note that datetime values are always UTC in mongodb
+Note that datetime values are always UTC in the catalog
 """
 class Torrent(TimestampMixin):
     __slots__ = ('info_hash', 'name', 'size', 'data_root', 'added', 'last_accessed',
@@ -64,6 +65,7 @@ class Torrent(TimestampMixin):
                 self._torrent_file = TorrentFile(filename=kwargs['filename'])
             self.info_hash = str(self._torrent_file.get_info_hash())
             self.name = self._torrent_file.get_info().name()
+            self.size = self._torrent_file.get_info().total_size()
 
     @staticmethod
     def find(**kwargs):
@@ -84,7 +86,7 @@ class Torrent(TimestampMixin):
         info_hash = kwargs.get('info_hash', None)
         torrent_root = kwargs.get('torrent_root', None)
         Torrent._validate_info_hash(info_hash)
-        data = torrent_db.get(info_hash)
+        data = catalog.get_backend().get(info_hash)
         t = Torrent._data_to_torrent(data, torrent_root)
         return t
 
@@ -92,7 +94,7 @@ class Torrent(TimestampMixin):
     def _find_multiple(**kwargs):
         query = kwargs.get('query', None)
         torrent_root = kwargs.get('torrent_root', None)
-        data_list = torrent_db.find(query)
+        data_list = catalog.get_backend().find(query)
         torrent_list = []
         for data in data_list:
             t = Torrent._data_to_torrent(data, torrent_root)
@@ -105,6 +107,7 @@ class Torrent(TimestampMixin):
             t = Torrent(torrent_root=torrent_root)
             t.info_hash = data['info_hash']
             t.name = data['name']
+            t.size = data.get('size', None)
             t.data_root = data['data_root']
             t.added = data['added']
             t.last_accessed = data['last_accessed']
@@ -118,7 +121,7 @@ class Torrent(TimestampMixin):
         self.validate()
         self._save_torrent_file()
         save_dict = self._get_save_dict()
-        torrent_db.save(save_dict)
+        catalog.get_backend().save(save_dict)
         self.added = save_dict['added']
 
     def _save_torrent_file(self):
@@ -158,6 +161,7 @@ class Torrent(TimestampMixin):
         save_dict = {
             'info_hash': self.info_hash,
             'name': self.name,
+            'size': self.size,
             'data_root': self.data_root,
             'added': added_date,
             'last_accessed': self.last_accessed
@@ -173,7 +177,7 @@ class Torrent(TimestampMixin):
     def delete(self):
         self._validate_info_hash(self.info_hash)
         self._delete_torrent_file()
-        torrent_db.delete(self.info_hash)
+        catalog.get_backend().delete(self.info_hash)
 
     def _delete_torrent_file(self):
         # TODO: Note a missing torrent file to allow returning a
@@ -0,0 +1,188 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import re
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+
+from seedbank.db import catalog_index
+from seedbank.db.catalog_index import CatalogIndex, CatalogIndexException
+
+CPP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'libtorrent', 'src', 'seedbank', 'catalog_index.cpp')
+
+def make_hash(i):
+    return '%040x' % (i * 2654435761)
+
+def make_record(i, **kwargs):
+    record = {
+        'info_hash': make_hash(i),
+        'data_root': '/var/lib/seedbank/data/%i' % (i % 7),
+        'name': u'torrent %i' % i,
+        'size': 1000 * i,
+        'added': 1340000000 + i
+        }
+    record.update(kwargs)
+    return record
+
+class CatalogIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(prefix='test_catalog_index.')
+        self._path = os.path.join(self._dir, 'catalog.idx')
+        self._index = CatalogIndex(self._path)
+
+    def tearDown(self):
+        self._index.close()
+        shutil.rmtree(self._dir)
+
+    def test_missing_index(self):
+        self.assertEqual(self._index.get(make_hash(1)), None)
+        self.assertEqual(self._index.count(), 0)
+        self.assertEqual(self._index.iterate(), [])
+        self.assertFalse(os.path.exists(self._path))
+
+    def test_put_get_delete(self):
+        self._index.put(make_record(1))
+        self._index.put(make_record(2, name=None, size=None, added=None))
+
+        record = self._index.get(make_hash(1))
+        self.assertEqual(record['info_hash'], make_hash(1))
+        self.assertEqual(record['name'], u'torrent 1')
+        self.assertEqual(record['data_root'], u'/var/lib/seedbank/data/1')
+        self.assertEqual(record['size'], 1000)
+        self.assertEqual(record['added'], 1340000001)
+        self.assertEqual(record['last_accessed'], None)
+
+        record = self._index.get(make_hash(2))
+        self.assertEqual(record['name'], u'')
+        self.assertEqual(record['size'], 0)
+        self.assertEqual(record['added'], None)
+        self.assertEqual(self._index.get(make_hash(3)), None)
+        self.assertEqual(self._index.count(), 2)
+
+        # replacing keeps one copy
+        self._index.put(make_record(1, name=u'renamed \xe9'))
+        self.assertEqual(self._index.get(make_hash(1))['name'], u'renamed \xe9')
+        self.assertEqual(self._index.count(), 2)
+        self.assertEqual(len(self._index.iterate()), 2)
+
+        self._index.delete(make_hash(1))
+        self._index.delete(make_hash(3))
+        self.assertEqual(self._index.get(make_hash(1)), None)
+        self.assertEqual(self._index.get(make_hash(2))['info_hash'], make_hash(2))
+        self.assertEqual(self._index.count(), 1)
+
+    def test_field_lengths(self):
+        long_name = 'n' * (catalog_index.MAX_FIELD_LENGTH + 10)
+        self._index.put(make_record(1, name=long_name))
+        self.assertEqual(self._index.get(make_hash(1))['name'], long_name[:catalog_index.MAX_FIELD_LENGTH])
+        long_root = '/' + 'd' * catalog_index.MAX_FIELD_LENGTH
+        self.assertRaises(CatalogIndexException, self._index.put, make_record(2, data_root=long_root))
+        self.assertRaises(CatalogIndexException, self._index.get, 'abc')
+
+    def test_set_last_accessed(self):
+        for i in xrange(3):
+            self._index.put(make_record(i))
+        now = int(time.time())
+        self._index.set_last_accessed(now, [make_hash(0), make_hash(2), make_hash(9)])
+        self.assertEqual(self._index.get(make_hash(0))['last_accessed'], now)
+        self.assertEqual(self._index.get(make_hash(1))['last_accessed'], None)
+        self.assertEqual(self._index.get(make_hash(2))['last_accessed'], now)
+        self.assertEqual(self._index.get(make_hash(2))['size'], 2000)
+        self.assertEqual(self._index.get(make_hash(9)), None)
+
+    def test_rebuild_and_remap(self):
+        reader = CatalogIndex(self._path)
+        try:
+            self._index.put(make_record(0))
+            self.assertEqual(reader.get(make_hash(0))['info_hash'], make_hash(0))
+            inode = os.stat(self._path).st_ino
+
+            # deleted slots count against the load until the table is rebuilt
+            self._index.delete(make_hash(0))
+            count = int(catalog_index.MIN_SLOTS * catalog_index.MAX_LOAD) + 10
+            for i in xrange(1, count):
+                self._index.put(make_record(i))
+
+            self.assertNotEqual(os.stat(self._path).st_ino, inode)
+            self.assertFalse(os.path.exists(self._path + '.tmp'))
+            self.assertEqual(self._index.count(), count - 1)
+            slot_count = struct.unpack_from(catalog_index.HEADER_FORMAT, open(self._path, 'rb').read(64))[3]
+            self.assertEqual(slot_count, catalog_index.MIN_SLOTS * 2)
+            self.assertEqual(os.path.getsize(self._path),
+                             catalog_index.HEADER_SIZE + slot_count * catalog_index.RECORD_SIZE)
+
+            # the reader still has the old table mapped until it notices the new inode
+            self.assertEqual(reader.get(make_hash(0)), None)
+            for i in xrange(1, count):
+                self.assertEqual(reader.get(make_hash(i))['size'], 1000 * i)
+            self.assertEqual(reader.count(), count - 1)
+        finally:
+            reader.close()
+
+    def test_invalid_index(self):
+        f = open(self._path, 'wb')
+        f.write('\0' * catalog_index.HEADER_SIZE)
+        f.close()
+        self.assertRaises(CatalogIndexException, self._index.get, make_hash(1))
+
+class CatalogIndexLayoutTest(unittest.TestCase):
+    """
+    catalog_index.cpp reads the index directly, its offsets must match
+    """
+    def setUp(self):
+        f = open(CPP_PATH)
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        self._constants = {}
+        for (name, value) in re.findall(r'const int (\w+) = (\d+);', source):
+            self._constants[name] = int(value)
+        self._magic = re.search(r'char const magic\[\] = "(\w+)";', source).group(1)
+        self._header_offsets = [int(o) for o in re.findall(r'read_uint32_le\((?:header|\(char const\*\)addr) \+ (\d+)\)', source)]
+
+    def test_sizes(self):
+        self.assertEqual(struct.calcsize(catalog_index.RECORD_FORMAT), catalog_index.RECORD_SIZE)
+        self.assertTrue(struct.calcsize(catalog_index.HEADER_FORMAT) <= catalog_index.HEADER_SIZE)
+        self.assertEqual(self._magic, catalog_index.MAGIC)
+        self.assertEqual(self._constants['version'], catalog_index.VERSION)
+        self.assertEqual(self._constants['header_size'], catalog_index.HEADER_SIZE)
+        self.assertEqual(self._constants['record_size'], catalog_index.RECORD_SIZE)
+        self.assertEqual(self._constants['field_length'], catalog_index.MAX_FIELD_LENGTH + 1)
+
+    def test_record_offsets(self):
+        def offset(fields):
+            return struct.calcsize(catalog_index.RECORD_FORMAT[:catalog_index.RECORD_FORMAT.index(fields) + len(fields)])
+        self.assertEqual(offset('20s'), catalog_index.STATE_OFFSET)
+        self.assertEqual(self._constants['state_offset'], catalog_index.STATE_OFFSET)
+        self.assertEqual(self._constants['size_offset'], offset('B3x'))
+        self.assertEqual(offset('Qq'), catalog_index.LAST_ACCESSED_OFFSET)
+        self.assertEqual(self._constants['data_root_offset'], offset('Qqq'))
+        self.assertEqual(self._constants['name_offset'], offset('Qqq104s'))
+
+    def test_header_offsets(self):
+        # version, record size, slot count and used slots
+        expected = [struct.calcsize(catalog_index.HEADER_FORMAT[:i]) for i in xrange(3, 7)]
+        self.assertEqual(sorted(set(self._header_offsets)), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import os
+import time
+import shutil
+import binascii
+import socket
+import select
+import tempfile
+import threading
+import unittest
+
+try:
+    import libtorrent as lt
+except ImportError:
+    lt = None
+
+QUERY_TIMEOUT = 3
+HANDSHAKE_LENGTH = 68
+
+class SlowDatabase(object):
+    """
+    Stand-in mongod that accepts connections and never answers, so every
+    lookup in the mongodb plugin stalls until the query timeout
+    """
+    def __init__(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(16)
+        self._listener.settimeout(0.2)
+        self._connections = []
+        self._stop = False
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_port(self):
+        return self._listener.getsockname()[1]
+
+    def get_connection_count(self):
+        return len(self._connections)
+
+    def stop(self):
+        self._stop = True
+        self._thread.join()
+        for conn in self._connections:
+            conn.close()
+        self._listener.close()
+
+    def _accept(self):
+        while not self._stop:
+            try:
+                (conn, address) = self._listener.accept()
+                self._connections.append(conn)
+            except socket.timeout:
+                pass
+
+def make_handshake(info_hash):
+    return '\x13BitTorrent protocol' + '\0' * 8 + info_hash + '-TT0000-' + os.urandom(12)
+
+def read_handshake(sock, timeout):
+    """
+    Returns the peer's handshake, or what arrived of it before the
+    connection closed or `timeout` seconds passed
+    """
+    data = ''
+    deadline = time.time() + timeout
+    while len(data) < HANDSHAKE_LENGTH:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            break
+        try:
+            chunk = sock.recv(HANDSHAKE_LENGTH - len(data))
+        except socket.error:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def wait_for_close(sock, timeout):
+    """
+    Returns the seconds until the peer closed the connection, or None
+    """
+    start = time.time()
+    deadline = start + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            return None
+        try:
+            if not sock.recv(4096):
+                return time.time() - start
+        except socket.error:
+            return time.time() - start
+
+class PeerParkingTest(unittest.TestCase):
+    """
+    Incoming connections for an info hash the mongodb plugin is looking up
+    are parked until the lookup finishes.  A slow database must only hold
+    up those connections, never peers of torrents already in the session,
+    and a failed lookup must end with the parked peer disconnected.
+    """
+    def setUp(self):
+        if not lt:
+            self.skipTest('libtorrent python bindings not available')
+        self._dir = tempfile.mkdtemp(prefix='test_peer_parking.')
+        self._database = SlowDatabase()
+        self._sockets = []
+
+        self._ses = lt.session()
+        self._ses.listen_on(45000, 45999)
+        params = {
+            'connection_string': '127.0.0.1:%i' % self._database.get_port(),
+            'torrent_file_root': self._dir,
+            'lookup_threads': '2',
+            'query_timeout': str(QUERY_TIMEOUT),
+            'filter_fpr': '0',
+            'breaker_threshold': '0',
+            'health_check_interval': '0'
+            }
+        self._ses.add_extension('mongodb_torrent_db', params)
+        self._info_hash = self._add_torrent()
+
+    def tearDown(self):
+        for sock in self._sockets:
+            sock.close()
+        if hasattr(self, '_ses'):
+            del self._ses
+            self._database.stop()
+            shutil.rmtree(self._dir)
+
+    def test_slow_lookup_does_not_delay_active_torrent(self):
+        # parked behind a lookup that won't finish for QUERY_TIMEOUT seconds
+        parked_hash = os.urandom(20)
+        parked_peer = self._connect()
+        parked_peer.sendall(make_handshake(parked_hash))
+        self.assertEqual(read_handshake(parked_peer, 0.5), '')
+
+        # a second peer for the same unknown info hash waits with the first
+        second_parked_peer = self._connect()
+        second_parked_peer.sendall(make_handshake(parked_hash))
+
+        start = time.time()
+        active_peer = self._connect()
+        active_peer.sendall(make_handshake(self._info_hash))
+        reply = read_handshake(active_peer, QUERY_TIMEOUT)
+        elapsed = time.time() - start
+        self.assertEqual(len(reply), HANDSHAKE_LENGTH)
+        self.assertEqual(reply[28:48], self._info_hash)
+        self.assertTrue(elapsed < 1.0, 'active torrent handshake took %.2f s' % elapsed)
+        self.assertTrue(self._database.get_connection_count() > 0)
+
+        # still parked, then dropped once the lookup fails, without looping
+        # back into another lookup
+        self.assertEqual(wait_for_close(parked_peer, 0.1), None)
+        limit = QUERY_TIMEOUT * 2 + 5
+        for sock in (parked_peer, second_parked_peer):
+            closed_after = wait_for_close(sock, limit)
+            self.assertTrue(closed_after is not None, 'parked peer still connected after %i s' % limit)
+
+    def _connect(self):
+        sock = socket.create_connection(('127.0.0.1', self._ses.listen_port()), 5)
+        self._sockets.append(sock)
+        return sock
+
+    def _add_torrent(self):
+        """
+        Seed a small torrent from the temp dir, returns its raw info hash
+        """
+        data_path = os.path.join(self._dir, 'data.bin')
+        f = open(data_path, 'wb')
+        f.write(os.urandom(64 * 1024))
+        f.close()
+
+        fs = lt.file_storage()
+        lt.add_files(fs, data_path)
+        t = lt.create_torrent(fs, 16 * 1024)
+        lt.set_piece_hashes(t, self._dir)
+        ti = lt.torrent_info(lt.bdecode(lt.bencode(t.generate())))
+        handle = self._ses.add_torrent({'ti': ti, 'save_path': self._dir})
+
+        deadline = time.time() + 10
+        while handle.status().state != lt.torrent_status.seeding:
+            if time.time() > deadline:
+                self.fail('test torrent never started seeding')
+            time.sleep(0.1)
+        return binascii.a2b_hex(str(ti.info_hash()))
+
+if __name__ == '__main__':
+    unittest.main()
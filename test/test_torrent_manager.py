@@ -0,0 +1,158 @@
+#
+# Copyright 2012 ibiblio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import threading
+import unittest
+
+from seedbank.server.torrent_state_table import TorrentStateTable
+
+try:
+    from seedbank.server.torrent_manager import TorrentManager
+except ImportError:
+    # needs libtorrent and terasaur
+    TorrentManager = None
+
+class FakeHandle(object):
+    def __init__(self, info_hash):
+        self._info_hash = info_hash
+
+    def info_hash(self):
+        return self._info_hash
+
+    def is_valid(self):
+        return True
+
+class FakeStatus(object):
+    def __init__(self, info_hash, upload_rate=0):
+        self.info_hash = info_hash
+        self.handle = FakeHandle(info_hash)
+        self.time_since_download = 0
+        self.time_since_upload = 0
+        self.upload_rate = upload_rate
+        self.download_rate = 0
+        self.num_peers = 0
+
+class FakeSession(object):
+    """
+    What TorrentManager uses of LibtorrentSession
+    """
+    _ses = None
+    _out_writer = None
+
+def make_hash(i):
+    return '%040x' % i
+
+class TorrentStateTableTest(unittest.TestCase):
+    def test_pop_added(self):
+        table = TorrentStateTable()
+        table.add(FakeHandle(make_hash(1)))
+        table.update([FakeStatus(make_hash(2)), FakeStatus(make_hash(1))])
+        table.add(FakeHandle(make_hash(2)))
+        self.assertEqual(table.pop_added(), [make_hash(1), make_hash(2)])
+        self.assertEqual(table.pop_added(), [])
+
+        # removed before the manager saw it
+        table.add(FakeHandle(make_hash(3)))
+        table.remove(make_hash(3))
+        self.assertEqual(table.pop_added(), [])
+        self.assertEqual(len(table), 2)
+
+    def test_pop_updated(self):
+        table = TorrentStateTable()
+        table.add(FakeHandle(make_hash(1)))
+        self.assertEqual(table.pop_updated(), [])
+        table.update([FakeStatus(make_hash(1)), FakeStatus(make_hash(2))])
+        table.update([FakeStatus(make_hash(1), upload_rate=10)])
+        updated = table.pop_updated()
+        self.assertEqual(sorted([status.info_hash for status in updated]), [make_hash(1), make_hash(2)])
+        self.assertEqual([status.upload_rate for status in updated if status.info_hash == make_hash(1)], [10])
+        self.assertEqual(table.pop_updated(), [])
+
+        table.update([FakeStatus(make_hash(2))])
+        table.remove(make_hash(2))
+        self.assertEqual(table.pop_updated(), [])
+
+class TorrentManagerTest(unittest.TestCase):
+    def setUp(self):
+        if not TorrentManager:
+            self.skipTest('libtorrent or terasaur not available')
+
+    def test_concurrent_add(self):
+        """
+        Torrents added by the alert watcher thread while the manager runs
+        are all scheduled for expiry
+        """
+        count = 20000
+        table = TorrentStateTable()
+        manager = TorrentManager(exec_interval=5, tick_interval=1, torrent_state=table)
+        session = FakeSession()
+
+        def add_torrents():
+            for i in xrange(count):
+                if i % 2:
+                    table.add(FakeHandle(make_hash(i)))
+                else:
+                    table.update([FakeStatus(make_hash(i))])
+        thread = threading.Thread(target=add_torrents)
+        thread.start()
+        runs = 0
+        while thread.is_alive():
+            manager.execute(session=session)
+            runs += 1
+        thread.join()
+        manager.execute(session=session)
+
+        self.assertTrue(runs > 1)
+        missing = [i for i in xrange(count) if not manager._expiry.has_key(make_hash(i))]
+        self.assertEqual(missing, [])
+        self.assertEqual(len(manager._expiry), count)
+
+    def test_concurrent_update(self):
+        """
+        Every state update handled while the manager runs credits the
+        torrent's activity
+        """
+        count = 20000
+        table = TorrentStateTable()
+        manager = TorrentManager(exec_interval=5, tick_interval=1, torrent_state=table)
+        session = FakeSession()
+        for i in xrange(count):
+            table.add(FakeHandle(make_hash(i)))
+        manager.execute(session=session)
+
+        credited = set()
+        def record_access(info_hash, now, weight=1.0):
+            credited.add(info_hash)
+        manager._record_access = record_access
+
+        def update_torrents():
+            for i in xrange(count):
+                table.update([FakeStatus(make_hash(i), upload_rate=1000)])
+        thread = threading.Thread(target=update_torrents)
+        thread.start()
+        runs = 0
+        while thread.is_alive():
+            manager.execute(session=session)
+            runs += 1
+        thread.join()
+        manager.execute(session=session)
+
+        self.assertTrue(runs > 1)
+        self.assertEqual(len(credited), count)
+
+if __name__ == '__main__':
+    unittest.main()